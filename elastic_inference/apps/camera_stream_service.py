@@ -12,6 +12,9 @@ compression.
                   |    +-----------------------------+
                   |==> | Dropped frames (prometheus) |
                        +-----------------------------+
+
+The frames dropped on local queue before sending to frame queue are exported
+as prometheus metric "ei_capture_overflow_frames".
 """
 import logging
 import signal
@@ -20,6 +23,7 @@ import os
 import sys
 import socket
 import redis
+import prometheus_client as prom
 
 # add current path into PYTHONPATH
 APP_PATH = os.path.dirname(__file__)
@@ -28,7 +32,9 @@ sys.path.append(APP_PATH)
 from clcn.appbase import CLCNAppBase        # pylint: disable=wrong-import-position
 from clcn.video import WebCamCaptureTask    # pylint: disable=wrong-import-position
 from clcn.stream import StreamInfo          # pylint: disable=wrong-import-position
-from clcn.frame import FrameQueueProduceTask, RedisFrameQueue   # pylint: disable=wrong-import-position
+from clcn.frame import FrameQueueProduceTask  # pylint: disable=wrong-import-position
+from clcn.queuefactory import FrameQueueFactory # pylint: disable=wrong-import-position
+from clcn.profiling import install_profiler # pylint: disable=wrong-import-position
 
 LOG = logging.getLogger(__name__)
 
@@ -41,6 +47,11 @@ class CameraServiceApp(CLCNAppBase):
         self._redis_host = self.get_env("QUEUE_HOST", "127.0.0.1")
         self._redis_port = int(self.get_env("QUEUE_PORT", "6379"))
         self._infer_type = self.get_env("INFER_TYPE", "face")
+        self._queue_backend = self.get_env("QUEUE_BACKEND", "list")
+        # max frames kept for this stream on fair frame queue
+        self._stream_max_len = int(self.get_env("QUEUE_STREAM_MAX_LEN", "8"))
+        # bytes of each frame slot on shm frame queue
+        self._slot_size = int(self.get_env("QUEUE_SLOT_SIZE", "262144"))
         self._camera_number = int(self.get_env("CAMERA_INDEX", "0"))
         self._camera_fps = int(self.get_env("CAMERA_FPS", "15"))
         stream_name = self.get_env("STREAM_NAME", "")
@@ -49,18 +60,49 @@ class CameraServiceApp(CLCNAppBase):
                 socket.gethostbyname(socket.gethostname()),
                 self._camera_number)
         self._stream_info = StreamInfo(stream_name, self._infer_type)
+        # max milliseconds to wait for more frames before flushing
+        self._flush_max_latency = float(
+            self.get_env("FLUSH_MAX_LATENCY", "0")) / 1000
+        self._metrics_port = int(self.get_env("METRICS_PORT", "8000"))
+        # the stacks are sampled for PROFILE_SECONDS on SIGUSR2 or HTTP
+        # request on PROFILE_PORT (0 means disabled), dumped to PROFILE_DIR
+        self._profile_dir = self.get_env("PROFILE_DIR", "/tmp")
+        self._profile_seconds = float(self.get_env("PROFILE_SECONDS", "30"))
+        self._profile_port = int(self.get_env("PROFILE_PORT", "0"))
+        self._counter_overflow = prom.Counter(
+            'ei_capture_overflow_frames',
+            'Frames dropped on local queue before sending to frame queue',
+            ['stream']).labels(stream_name)
+        self._summary_stage_seconds = prom.Summary(
+            'ei_capture_stage_seconds',
+            'Seconds spent in each stage of capture hot path',
+            ['stream', 'stage'])
 
     def run(self):
         redis_conn = redis.StrictRedis(self._redis_host, self._redis_port)
-        out_queue = RedisFrameQueue(redis_conn, self._infer_type)
+        out_queue = FrameQueueFactory.get_queue(
+            redis_conn, self._infer_type, self._queue_backend,
+            stream_max_len=self._stream_max_len, slot_size=self._slot_size)
 
         frame_queue = queue.Queue(10)
-        capture_task = WebCamCaptureTask(self._camera_number, self._camera_fps,
-                                         frame_queue)
+        capture_task = WebCamCaptureTask(
+            self._camera_number, self._camera_fps, frame_queue,
+            report_overflow_fn=self._counter_overflow.inc,
+            report_stage_fn=self._report_stages)
         publisher_task = FrameQueueProduceTask(self._stream_info, frame_queue,
-                                               out_queue)
+                                               out_queue,
+                                               self._flush_max_latency,
+                                               self._report_stages)
+        install_profiler(self._profile_dir, self._profile_seconds,
+                         self._profile_port)
         capture_task.start()
         publisher_task.start()
+        prom.start_http_server(self._metrics_port)
+
+    def _report_stages(self, observations):
+        for stage, seconds in observations:
+            self._summary_stage_seconds.labels(
+                self._stream_info.name, stage).observe(seconds)
 
 def start_app():
     """
@@ -0,0 +1,215 @@
+"""
+Redis based frame queue with fair scheduling among streams.
+
+Each stream of the category gets its own sub queue on redis, and the inference
+engines pop the frames from the sub queues in round robin, so a high FPS
+stream could not crowd out the frames of a low FPS stream.
+"""
+import logging
+import time
+from .frame import RedisFrameQueue
+
+LOG = logging.getLogger(__name__)
+
+class FairRedisFrameQueue(RedisFrameQueue):
+    """
+    Redis based frame queue with fair scheduling among streams.
+
+    Each stream of the category gets its own sub queue and drop limit, and the
+    frames are popped from the sub queues in round robin. So a high FPS stream
+    could not crowd out the frames of a low FPS stream.
+
+    The drop limit is stream_max_len for all streams by default, and could be
+    overridden for given streams via stream_max_lens. It is applied on
+    pushing, so the producer of the stream decides it.
+    """
+
+    # default max frames kept on each stream's sub queue
+    _STREAM_MAX_LEN = 8
+
+    # Push a frame into the stream's sub queue, register the stream, refresh
+    # its expire key and trim the sub queue counting drops on the stream. All
+    # the pushed frames are counted on KEYS[5].
+    _FAIR_PUSH_SCRIPT = """
+    local len = redis.call("RPUSH", KEYS[1], ARGV[1])
+    redis.call("INCR", KEYS[5])
+    if redis.call("SISMEMBER", KEYS[2], ARGV[4]) == 0 then
+        redis.call("SADD", KEYS[2], ARGV[4])
+    end
+    redis.call("SETEX", KEYS[3], ARGV[2], "1")
+    local max_len = tonumber(ARGV[3])
+    if len > max_len then
+        redis.call("LTRIM", KEYS[1], -max_len, -1)
+        redis.call("HINCRBY", KEYS[4], ARGV[4], len - max_len)
+    end
+    return len
+    """
+
+    # Pop up to ARGV[1] frames in round robin starting from the saved cursor
+    # from the streams given as ARGV[2..], whose sub queue and expire key are
+    # KEYS[4..] in pairs, and unregister the expired stream without frames.
+    # Return the registered streams as the number of streams followed by the
+    # names for next call, the stream drops collected as the number of pairs
+    # followed by stream/drop pairs, then the frames.
+    _FAIR_POP_SCRIPT = """
+    local frames = {}
+    local count = tonumber(ARGV[1])
+    local total = #ARGV - 1
+    if count > 0 and total > 0 then
+        local index = tonumber(redis.call("GET", KEYS[2]) or "0")
+        local empty = 0
+        while #frames < count and empty < total do
+            local slot = index % total
+            local frame = redis.call("LPOP", KEYS[4 + slot * 2])
+            if frame then
+                table.insert(frames, frame)
+                empty = 0
+            else
+                empty = empty + 1
+                if redis.call("EXISTS", KEYS[5 + slot * 2]) == 0 then
+                    redis.call("SREM", KEYS[1], ARGV[2 + slot])
+                end
+            end
+            index = index + 1
+        end
+        redis.call("SET", KEYS[2], index % total)
+    end
+
+    local drops = redis.call("HGETALL", KEYS[3])
+    if #drops > 0 then
+        redis.call("DEL", KEYS[3])
+    end
+
+    local streams = redis.call("SMEMBERS", KEYS[1])
+    local ret = {#streams}
+    for _, stream in ipairs(streams) do table.insert(ret, stream) end
+    table.insert(ret, #drops / 2)
+    for _, item in ipairs(drops) do table.insert(ret, item) end
+    for _, frame in ipairs(frames) do table.insert(ret, frame) end
+    return ret
+    """
+
+    def __init__(self, redis_conn, category="face",
+                 stream_max_len=_STREAM_MAX_LEN, stream_max_lens=None):
+        RedisFrameQueue.__init__(self, redis_conn, category)
+        self._stream_max_len = stream_max_len
+        self._stream_max_lens = dict(stream_max_lens or {})
+        self._fair_push_script = self._redis.register_script(
+            self._FAIR_PUSH_SCRIPT)
+        self._fair_pop_script = self._redis.register_script(
+            self._FAIR_POP_SCRIPT)
+        # registered streams returned by last pop to pass their keys to next
+        self._streams = []
+        self._pending_drops = {}
+        self._stream_drops = {}
+
+    @property
+    def streams_name(self):
+        """
+        Name of the set for streams having sub queue
+        """
+        return self.name + "_streams"
+
+    @property
+    def stream_drops_name(self):
+        """
+        Name of the hash for frames dropped on each stream
+        """
+        return self.name + "_stream_drops"
+
+    def sub_queue_name(self, stream_name):
+        """
+        Name of the sub queue for given stream
+        """
+        return self.name + ":" + stream_name
+
+    def stream_max_len(self, stream_name):
+        """
+        Max frames kept on the sub queue of given stream
+        """
+        return self._stream_max_lens.get(stream_name, self._stream_max_len)
+
+    def _load_streams(self):
+        self._streams = sorted(sid.decode("utf-8") for sid in
+                               self._redis.smembers(self.streams_name))
+        return self._streams
+
+    def push_on_queuer(self, info, msg):
+        self.push_batch_on_queuer(info, [msg])
+
+    def push_batch_on_queuer(self, info, msgs):
+        keys = [self.sub_queue_name(info.name), self.streams_name,
+                info.name + "_expire", self.stream_drops_name,
+                self.push_counter_name]
+        max_len = self.stream_max_len(info.name)
+        if len(msgs) == 1:
+            self._fair_push_script(
+                keys=keys, args=[msgs[0], self._STREAM_EXPIRE, max_len,
+                                 info.name])
+            return
+        pipe = self._redis.pipeline(transaction=False)
+        for msg in msgs:
+            self._fair_push_script(
+                keys=keys, args=[msg, self._STREAM_EXPIRE, max_len,
+                                 info.name], client=pipe)
+        pipe.execute()
+
+    def pop_on_queuer(self):
+        batch = self.pop_batch_on_queuer(1)
+        if len(batch) == 0:
+            return None
+        return batch[0]
+
+    def bpop_on_queuer(self, timeout):
+        keys = [self.sub_queue_name(stream)
+                for stream in self._streams or self._load_streams()]
+        if len(keys) == 0:
+            # nothing to block on before any stream is registered
+            time.sleep(timeout)
+            return None
+        return self._blpop(keys, timeout)
+
+    def pop_batch_on_queuer(self, count):
+        streams = self._streams or self._load_streams()
+        keys = [self.streams_name, self.name + "_cursor",
+                self.stream_drops_name]
+        for stream in streams:
+            keys += [self.sub_queue_name(stream), stream + "_expire"]
+        ret = self._fair_pop_script(keys=keys, args=[count] + streams)
+
+        total = ret[0]
+        self._streams = sorted(sid.decode("utf-8")
+                               for sid in ret[1:1 + total])
+        offset = 1 + total
+        pairs = ret[offset]
+        for index in range(pairs):
+            stream = ret[offset + 1 + index * 2].decode("utf-8")
+            drop_frame = int(ret[offset + 2 + index * 2])
+            self._pending_drops[stream] = \
+                self._pending_drops.get(stream, 0) + drop_frame
+        return ret[offset + 1 + pairs * 2:]
+
+    def pop_drop_on_queuer(self, count):
+        batch = self.pop_batch_on_queuer(count)
+        drop_frame = 0
+        for stream, value in self._pending_drops.items():
+            drop_frame += value
+            self._stream_drops[stream] = \
+                self._stream_drops.get(stream, 0) + value
+        self._pending_drops = {}
+        return batch, drop_frame
+
+    def drop_on_queuer(self):
+        _, drop_frame = self.pop_drop_on_queuer(0)
+        return drop_frame
+
+    def depth_on_queuer(self):
+        pipe = self._redis.pipeline(transaction=False)
+        for stream in self._load_streams():
+            pipe.llen(self.sub_queue_name(stream))
+        return sum(pipe.execute())
+
+    def collect_stream_drops(self):
+        stream_drops = self._stream_drops
+        self._stream_drops = {}
+        return stream_drops
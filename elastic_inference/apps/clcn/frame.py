@@ -11,9 +11,13 @@ improve inference speed on. The number of replicas are depends on the computatio
 requirement of inference model.
 """
 import logging
+import queue
+import struct
 import time
 import msgpack
+import redis
 from .appbase import CLCNTask
+from .profiling import StageTimer
 
 LOG = logging.getLogger(__name__)
 
@@ -21,12 +25,31 @@ class FrameMessage:
     """
     A frame message on message queue, including inference category, raw frame
     binary data and name.
+
+    The binary packet is a fixed header followed by name, category and frame
+    payload:
+
+      magic(4) version(1) timestamp(8) sequence(4) codec(1)
+      name length(2) category length(2)
+
+    The packet is parsed via memoryview slices, so the payload is not copied
+    until it is decoded. The legacy msgpack packet is still accepted.
     """
 
-    def __init__(self, name, category, data):
+    CODEC_JPEG = 0
+
+    _MAGIC = b"EIFM"
+    _VERSION = 1
+    _HEADER = struct.Struct("!4sBdIBHH")
+
+    def __init__(self, name, category, data, *, timestamp=0, sequence=0,
+                 codec=CODEC_JPEG):
         self._name = name
         self._category = category
         self._data = data
+        self._timestamp = timestamp
+        self._sequence = sequence
+        self._codec = codec
 
     @property
     def name(self):
@@ -49,28 +72,124 @@ class FrameMessage:
         """
         return self._data
 
+    @property
+    def timestamp(self):
+        """
+        Capture timestamp in seconds since epoch, 0 for unknown
+        """
+        return self._timestamp
+
+    @property
+    def sequence(self):
+        """
+        Frame sequence number within its stream
+        """
+        return self._sequence
+
+    @property
+    def codec(self):
+        """
+        Codec of frame binary data
+        """
+        return self._codec
+
+    def frame_size(self):
+        """
+        Parse the frame size (weight, height) from the SOF segment of JPEG
+        data without decoding, None if it is not found.
+        """
+        view = memoryview(self._data)
+        if self._codec != self.CODEC_JPEG or view[:2] != b"\xff\xd8":
+            return None
+        pos = 2
+        while pos + 9 <= len(view):
+            if view[pos] != 0xff:
+                return None
+            marker = view[pos + 1]
+            if marker == 0xff:
+                # fill byte before marker
+                pos += 1
+                continue
+            if 0xd0 <= marker <= 0xd7 or marker == 0x01:
+                # standalone marker without length
+                pos += 2
+                continue
+            if 0xc0 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc):
+                height, weight = struct.unpack_from("!HH", view, pos + 5)
+                return weight, height
+            pos += 2 + struct.unpack_from("!H", view, pos + 2)[0]
+        return None
+
+    def to_buffers(self):
+        """
+        Pack frame message into the header buffer, including name and
+        category, and the frame payload buffer. The payload is not copied, so
+        the queue able to send them separately could skip the copy of
+        to_binary().
+        """
+        name = self._name.encode("utf-8")
+        category = self._category.encode("utf-8")
+        header = self._HEADER.pack(self._MAGIC, self._VERSION,
+                                   self._timestamp, self._sequence,
+                                   self._codec, len(name), len(category))
+        return b"".join((header, name, category)), self._data
+
     def to_binary(self):
         """
         Pack all frame message into binary packet
         """
-        msg = {"name":self._name, "category":self._category, "data": self._data}
-        return msgpack.packb(msg, use_bin_type=True)
+        return b"".join(self.to_buffers())
 
     @staticmethod
     def from_binary(binary):
         """
         Decode frame message from binary packet
         """
-        msg = msgpack.unpackb(binary, raw=False)
-        return FrameMessage(msg["name"], msg["category"], msg["data"])
+        view = memoryview(binary)
+        if view[:4] != FrameMessage._MAGIC:
+            # legacy packet from the producer not upgraded yet
+            msg = msgpack.unpackb(binary, raw=False)
+            return FrameMessage(msg["name"], msg["category"], msg["data"])
+        return FrameMessage._parse(view)
+
+    @staticmethod
+    def from_buffers(header, data):
+        """
+        Decode frame message from the header and payload buffers packed by
+        to_buffers()
+        """
+        view = memoryview(header)
+        if view[:4] != FrameMessage._MAGIC:
+            LOG.error("Invalid frame message header")
+            return None
+        return FrameMessage._parse(view, data)
 
-class FrameQueueBase:
+    @staticmethod
+    def _parse(view, data=None):
+        _, version, timestamp, sequence, codec, name_len, category_len = \
+            FrameMessage._HEADER.unpack_from(view)
+        if version != FrameMessage._VERSION:
+            LOG.error("Unsupported frame message version: %d", version)
+            return None
+
+        offset = FrameMessage._HEADER.size
+        name = str(view[offset:offset + name_len], "utf-8")
+        offset += name_len
+        category = str(view[offset:offset + category_len], "utf-8")
+        offset += category_len
+        if data is None:
+            data = view[offset:]
+        return FrameMessage(name, category, data, timestamp=timestamp,
+                            sequence=sequence, codec=codec)
+
+class FrameQueueBase:     # pylint: disable=too-many-public-methods
     """
     Frame queue base.
     """
 
     def __init__(self, category="face"):
         self._category = category
+        self._sequences = {}
 
     @property
     def name(self):
@@ -79,31 +198,123 @@ class FrameQueueBase:
         """
         return "queue_" + self._category
 
-    def push(self, stream_info, msg):
+    def _pack(self, stream_info, msg, timestamp):
+        if timestamp is None:
+            timestamp = time.time()
+        sequence = self._sequences.get(stream_info.name, 0)
+        self._sequences[stream_info.name] = (sequence + 1) & 0xffffffff
+        msg = FrameMessage(stream_info.name, stream_info.category, msg,
+                           timestamp=timestamp, sequence=sequence)
+        return self._encode(msg)
+
+    def _encode(self, msg):
+        # the list element on redis must be one buffer, so the payload is
+        # copied once into the packet, the queue able to take the header and
+        # payload separately overrides it
+        return msg.to_binary()
+
+    def _decode(self, binary):
+        return FrameMessage.from_binary(binary)
+
+    def push(self, stream_info, msg, timestamp=None):
         """
-        Push frame message into queue.
+        Push frame message into queue, timestamp is the frame's capture time
+        and default to now.
         """
         if stream_info.category != self._category:
             LOG.error("Invalid category for frame")
             return
-        msg = FrameMessage(stream_info.name, stream_info.category, msg)
-        self.push_on_queuer(stream_info, msg.to_binary())
+        self.push_on_queuer(stream_info,
+                            self._pack(stream_info, msg, timestamp))
 
-    def pop(self):
+    def push_batch(self, stream_info, msgs, timestamps=None):
         """
-        Pop a frame message from frame's queue
+        Push several frame messages of a stream into queue at once, with the
+        frames' capture time in timestamps.
+        """
+        if stream_info.category != self._category:
+            LOG.error("Invalid category for frame")
+            return
+        if timestamps is None:
+            timestamps = [None] * len(msgs)
+        self.push_batch_on_queuer(
+            stream_info, [self._pack(stream_info, msg, timestamp)
+                          for msg, timestamp in zip(msgs, timestamps)])
+
+    def pop(self, timeout=0):
+        """
+        Pop a frame message from frame's queue, wait up to timeout seconds
+        for a new frame if the queue is empty.
         """
         binary = self.pop_on_queuer()
+        if binary is None and timeout > 0:
+            binary = self.bpop_on_queuer(timeout)
         if binary is None:
             return None
-        return FrameMessage.from_binary(binary)
+        return self._decode(binary)
+
+    def pop_batch(self, max_count, timeout=0):
+        """
+        Pop up to max_count frame messages from frame's queue at once, wait
+        up to timeout seconds for the first frame if the queue is empty.
+
+        Return the frame messages and the number of overflow frames dropped
+        from frame's queue, so no separate drop() is needed.
+        """
+        batch, drop_frame = self.pop_drop_on_queuer(max_count)
+        if len(batch) == 0 and timeout > 0:
+            binary = self.bpop_on_queuer(timeout)
+            if binary is not None:
+                batch.append(binary)
+                if max_count > 1:
+                    more, more_drop = self.pop_drop_on_queuer(max_count - 1)
+                    batch += more
+                    drop_frame += more_drop
+
+        msgs = []
+        for binary in batch:
+            msg = self._decode(binary)
+            if msg is None:
+                drop_frame += 1
+                continue
+            msgs.append(msg)
+        return msgs, drop_frame
 
     def drop(self):
         """
-        Drop overflow frame message from frame's queue
+        Drop overflow frame messages from frame's queue and return the number
+        of dropped ones, including those reclaimed from dead consumers.
         """
         return self.drop_on_queuer()
 
+    def ack(self, count=None):
+        """
+        Acknowledge the oldest count frame messages popped have been handled,
+        all the popped ones if count is None.
+        """
+        self.ack_on_queuer(count)
+
+    def depth(self):
+        """
+        Number of frames waiting on frame queue, None if it is unknown.
+        """
+        return self.depth_on_queuer()
+
+    def pushed(self):
+        """
+        Total number of frames pushed into frame queue, None if it is
+        unknown. The arrival rate of all producers is derived from its
+        increase over time.
+        """
+        return self.pushed_on_queuer()
+
+    def collect_stream_drops(self):
+        """
+        Collect the number of dropped frames for each stream since last
+        collection. Only the queue tracking each stream separately knows it.
+        """
+        return {}
+
     def is_stream_expired(self, info):
         """
         Judge whether a frame is expired on frame queue
@@ -111,6 +322,14 @@ class FrameQueueBase:
         raise NotImplementedError(
             "inherited class must implement this function.")
 
+    def expired_streams(self, infos):
+        """
+        Get the expired ones from given streams. The default one judges the
+        stream one by one, inherited class could override it to save the
+        round trips.
+        """
+        return [info for info in infos if self.is_stream_expired(info)]
+
     def push_on_queuer(self, info, msg):
         """
         Push message to frame queue
@@ -118,12 +337,44 @@ class FrameQueueBase:
         raise NotImplementedError(
             "inherited class must implement this function.")
 
+    def push_batch_on_queuer(self, info, msgs):
+        """
+        Push several messages to frame queue. The default one pushes the
+        message one by one, inherited class could override it to save the
+        round trips.
+        """
+        for msg in msgs:
+            self.push_on_queuer(info, msg)
+
     def pop_on_queuer(self):
         """
         Pop message from frame queue
         """
         raise NotImplementedError(
             "inherited class must implement this function.")
+
+    def bpop_on_queuer(self, timeout):
+        """
+        Blocking pop message from frame queue, return None if no message
+        arrives within timeout seconds.
+        """
+        raise NotImplementedError(
+            "inherited class must implement this function.")
+
+    def pop_batch_on_queuer(self, count):
+        """
+        Pop up to count messages from frame queue. The default one pops the
+        message one by one, inherited class could override it to save the
+        round trips.
+        """
+        batch = []
+        while len(batch) < count:
+            binary = self.pop_on_queuer()
+            if binary is None:
+                break
+            batch.append(binary)
+        return batch
+
     def drop_on_queuer(self):
         """
         Drop message from frame queue
@@ -131,57 +382,238 @@ class FrameQueueBase:
         raise NotImplementedError(
             "inherited class must implement this function.")
 
+    def pop_drop_on_queuer(self, count):
+        """
+        Pop up to count messages then drop overflow message from frame queue.
+        The default one does them separately, inherited class could override
+        it to do them in one round trip.
+        """
+        batch = self.pop_batch_on_queuer(count)
+        if len(batch) == 0:
+            return batch, 0
+        return batch, self.drop_on_queuer()
+
+    def ack_on_queuer(self, count=None):
+        """
+        Acknowledge popped messages on frame queue. Nothing to do by default
+        since the popped message is removed from frame queue at once.
+        """
+
+    def depth_on_queuer(self):
+        """
+        Get the number of messages on frame queue. The default one does not
+        know it, inherited class could override it.
+        """
+        return None
+
+    def pushed_on_queuer(self):
+        """
+        Get the total number of messages pushed on frame queue. The default
+        one does not know it, inherited class could override it.
+        """
+        return None
+
 class FrameQueueProduceTask(CLCNTask):
     """
     Frame queue produce task to get framew fraom input queue and put into
-    output queue.
+    output queue. The item on input queue is the tuple of capture timestamp
+    and frame data.
+
+    All frames available on input queue are flushed to output queue at once,
+    and the task waits for more frames up to max_latency seconds after the
+    first one to make the flush bigger.
     """
 
-    def __init__(self, stream_info, in_queue, out_queue):
+    _MAX_FLUSH_FRAMES = 10
+
+    def __init__(self, stream_info, in_queue, out_queue, max_latency=0,
+                 report_stage_fn=None):
         CLCNTask.__init__(self)
         self._inq = in_queue
         self._outq = out_queue
         self._stream_info = stream_info
+        self._max_latency = max_latency
+        self._timer = StageTimer(report_stage_fn)
 
     def execute(self):
         """
         Task Entry
         """
         while not self.is_task_stopping:
-            if self._inq.empty():
-                time.sleep(0.01)
-                continue
-            msg = self._inq.get_nowait()
-            if msg is None:
+            # wake up as soon as a frame is captured, the timeout is only to
+            # check whether the task is requested to stop
+            try:
+                msg = self._inq.get(timeout=0.5)
+            except queue.Empty:
                 continue
-            self._outq.push(self._stream_info, msg)
+
+            batch = [msg]
+            deadline = time.time() + self._max_latency
+            while len(batch) < self._MAX_FLUSH_FRAMES:
+                remaining = deadline - time.time()
+                try:
+                    if remaining > 0:
+                        batch.append(self._inq.get(timeout=remaining))
+                    else:
+                        batch.append(self._inq.get_nowait())
+                except queue.Empty:
+                    break
+
+            batch = [item for item in batch if item is not None]
+            with self._timer.time("push"):
+                if len(batch) == 1:
+                    timestamp, msg = batch[0]
+                    self._outq.push(self._stream_info, msg, timestamp)
+                elif len(batch) > 1:
+                    timestamps, msgs = zip(*batch)
+                    self._outq.push_batch(self._stream_info, msgs, timestamps)
 
 class RedisFrameQueue(FrameQueueBase):
     """
     Redis based frame queue implementation.
     """
 
+    # max frames kept on queue, the older ones are dropped
+    _MAX_LEN = 32
+    # seconds to keep stream alive after its last frame
+    _STREAM_EXPIRE = 1
+
+    # Push a frame, refresh the stream's expire key and trim the queue, the
+    # trimmed frames are counted on KEYS[3] for consumer to collect, and all
+    # the pushed ones on KEYS[4].
+    _PUSH_SCRIPT = """
+    local len = redis.call("RPUSH", KEYS[1], ARGV[1])
+    redis.call("SETEX", KEYS[2], ARGV[2], "1")
+    redis.call("INCR", KEYS[4])
+    local max_len = tonumber(ARGV[3])
+    if len > max_len then
+        redis.call("LTRIM", KEYS[1], -max_len, -1)
+        redis.call("INCRBY", KEYS[3], len - max_len)
+    end
+    return len
+    """
+
+    # Pop up to ARGV[1] frames and trim the queue, return the number of
+    # dropped frames including the ones trimmed on push followed by frames.
+    _POP_SCRIPT = """
+    local frames = {}
+    local count = tonumber(ARGV[1])
+    if count > 0 then
+        frames = redis.call("LRANGE", KEYS[1], 0, count - 1)
+        redis.call("LTRIM", KEYS[1], #frames, -1)
+    end
+
+    local dropped = 0
+    local pushed_dropped = redis.call("GET", KEYS[2])
+    if pushed_dropped then
+        redis.call("DEL", KEYS[2])
+        dropped = tonumber(pushed_dropped)
+    end
+
+    local max_len = tonumber(ARGV[2])
+    local len = redis.call("LLEN", KEYS[1])
+    if len > max_len then
+        redis.call("LTRIM", KEYS[1], -max_len, -1)
+        dropped = dropped + len - max_len
+    end
+    table.insert(frames, 1, dropped)
+    return frames
+    """
+
     def __init__(self, redis_conn, category="face"):
         FrameQueueBase.__init__(self, category)
         self._redis = redis_conn
+        self._push_script = self._redis.register_script(self._PUSH_SCRIPT)
+        self._pop_script = self._redis.register_script(self._POP_SCRIPT)
+        self._is_float_timeout = True
+
+    @property
+    def drop_counter_name(self):
+        """
+        Name of the counter for frames trimmed on pushing
+        """
+        return self.name + "_dropped"
+
+    @property
+    def push_counter_name(self):
+        """
+        Name of the counter for all frames pushed
+        """
+        return self.name + "_pushed"
 
     def push_on_queuer(self, info, msg):
-        self._redis.rpush(self.name, msg)
-        self._redis.setex(info.name + "_expire", "1", 2)
+        self._push_script(
+            keys=[self.name, info.name + "_expire", self.drop_counter_name,
+                  self.push_counter_name],
+            args=[msg, self._STREAM_EXPIRE, self._MAX_LEN])
+
+    def push_batch_on_queuer(self, info, msgs):
+        pipe = self._redis.pipeline(transaction=False)
+        for msg in msgs:
+            self._push_script(
+                keys=[self.name, info.name + "_expire",
+                      self.drop_counter_name, self.push_counter_name],
+                args=[msg, self._STREAM_EXPIRE, self._MAX_LEN], client=pipe)
+        pipe.execute()
 
     def pop_on_queuer(self):
         return self._redis.lpop(self.name)
 
+    def _blpop(self, keys, timeout):
+        if self._is_float_timeout:
+            try:
+                ret = self._redis.blpop(keys, max(0.001, timeout))
+                return None if ret is None else ret[1]
+            except redis.exceptions.ResponseError:
+                # redis server older than 6.0 only accepts integer timeout
+                self._is_float_timeout = False
+        if timeout < 1:
+            # 0 means blocking forever, poll once after the timeout instead
+            time.sleep(timeout)
+            return self.pop_on_queuer()
+        ret = self._redis.blpop(keys, int(timeout))
+        return None if ret is None else ret[1]
+
+    def bpop_on_queuer(self, timeout):
+        return self._blpop(self.name, timeout)
+
+    def pop_batch_on_queuer(self, count):
+        # LRANGE + LTRIM within one MULTI/EXEC is a single round trip, and
+        # also works on redis server older than 6.2 without "LPOP count"
+        pipe = self._redis.pipeline()
+        pipe.lrange(self.name, 0, count - 1)
+        pipe.ltrim(self.name, count, -1)
+        batch, _ = pipe.execute()
+        return batch
+
+    def pop_drop_on_queuer(self, count):
+        ret = self._pop_script(keys=[self.name, self.drop_counter_name],
+                               args=[count, self._MAX_LEN])
+        return ret[1:], ret[0]
+
     def drop_on_queuer(self):
-        msg_len = self._redis.llen(self.name)
-        drop_frame = 0
-        if msg_len > 32:
-            self._redis.ltrim(self.name, -32, -1)
-            drop_frame = msg_len - 32
+        _, drop_frame = self.pop_drop_on_queuer(0)
         return drop_frame
 
+    def depth_on_queuer(self):
+        return self._redis.llen(self.name)
+
+    def pushed_on_queuer(self):
+        return int(self._redis.get(self.push_counter_name) or 0)
+
     def is_stream_expired(self, info):
         if not self._redis.exists(info.name + "_expire"):
             LOG.debug("stream %s expired.", info.name)
             return True
         return False
+
+    def expired_streams(self, infos):
+        pipe = self._redis.pipeline(transaction=False)
+        for info in infos:
+            pipe.exists(info.name + "_expire")
+        expired = []
+        for info, exists in zip(infos, pipe.execute()):
+            if not exists:
+                LOG.debug("stream %s expired.", info.name)
+                expired.append(info)
+        return expired
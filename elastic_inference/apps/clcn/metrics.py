@@ -0,0 +1,287 @@
+"""
+Rate estimators for the autoscaling metrics of inference service.
+
+The frames inferred, skipped and dropped are counted as they happen, the
+rates are estimated over time by EWMA or sliding window instead of the fixed
+buckets reset on each report, so the metrics do not jump between reports.
+The service capacity is the frames inferred per busy second of the engine,
+so it is measured at any load instead of only when the engine is saturated.
+
+The start time defaults to the wall clock, while an offline simulator could
+run them on its own clock by passing start and now explicitly.
+"""
+import math
+import time
+from collections import deque, namedtuple
+
+# snapshot of inference metrics reported by inference engine, stream_frames
+# is the number of frames inferred for each stream since last snapshot
+InferMetrics = namedtuple("InferMetrics", [
+    "infer_fps", "drop_fps", "skip_fps", "arrival_fps", "service_fps",
+    "scale_ratio", "queue_depth", "stream_frames"])
+
+class RateEstimatorBase:
+    """
+    Estimate the rate of events counted over time.
+    """
+
+    def __init__(self, start=None):
+        self._start = time.time() if start is None else start
+
+    # virtual function must be implemented by inherited class
+    def add(self, count, now=None):
+        """
+        Count the events happened at now
+        """
+        raise NotImplementedError(
+            "inherited class must implement this function.")
+
+    # virtual function must be implemented by inherited class
+    def rate(self, now=None):
+        """
+        Estimated events per second at now
+        """
+        raise NotImplementedError(
+            "inherited class must implement this function.")
+
+class EWMARate(RateEstimatorBase):
+    """
+    Exponentially weighted moving average of the rate, the weight of a past
+    rate halves every half_life seconds regardless of the update interval.
+    """
+
+    def __init__(self, half_life=10, start=None):
+        RateEstimatorBase.__init__(self, start)
+        self._half_life = half_life
+        self._pending = 0
+        self._last = self._start
+        self._rate = None
+
+    def add(self, count, now=None):
+        self._pending += count
+
+    def rate(self, now=None):
+        if now is None:
+            now = time.time()
+        duration = now - self._last
+        if duration <= 0:
+            return self._rate or 0
+        instant = self._pending / duration
+        if self._rate is None:
+            self._rate = instant
+        else:
+            alpha = 1 - math.pow(0.5, duration / self._half_life)
+            self._rate += alpha * (instant - self._rate)
+        self._pending = 0
+        self._last = now
+        return self._rate
+
+class SlidingWindowRate(RateEstimatorBase):
+    """
+    Average rate over the last window seconds.
+    """
+
+    def __init__(self, window=30, start=None):
+        RateEstimatorBase.__init__(self, start)
+        self._window = window
+        self._events = deque()
+        self._total = 0
+
+    def _expire(self, now):
+        while len(self._events) != 0 and \
+            self._events[0][0] <= now - self._window:
+            self._total -= self._events.popleft()[1]
+
+    def add(self, count, now=None):
+        if count == 0:
+            return
+        if now is None:
+            now = time.time()
+        self._events.append((now, count))
+        self._total += count
+        self._expire(now)
+
+    def rate(self, now=None):
+        if now is None:
+            now = time.time()
+        self._expire(now)
+        # the window is not full yet since start
+        duration = min(self._window, now - self._start)
+        if duration <= 0:
+            return 0
+        return self._total / duration
+
+class RateEstimatorFactory:
+    """
+    Factory class for rate estimator instance
+    """
+
+    @staticmethod
+    def get_estimator(name, seconds, start=None):
+        """
+        Get rate estimator instance according to name, seconds is the half
+        life of EWMA or the length of sliding window.
+        """
+        if name == "window":
+            return SlidingWindowRate(seconds, start)
+        return EWMARate(seconds, start)
+
+class InferRates:
+    """
+    Track the rates of frames inferred, skipped and dropped by an inference
+    engine and estimate its capacity.
+
+    The capacity is the infer rate over the busy rate, the seconds per second
+    the engine spends inferring. The throughput of an engine not saturated is
+    only its share of arrivals, while the frames per busy second is what it
+    could serve if it were busy all the time.
+    """
+
+    def __init__(self, estimator="ewma", seconds=30, start=None):
+        self._infer = RateEstimatorFactory.get_estimator(estimator, seconds,
+                                                         start)
+        self._drop = RateEstimatorFactory.get_estimator(estimator, seconds,
+                                                        start)
+        self._skip = RateEstimatorFactory.get_estimator(estimator, seconds,
+                                                        start)
+        self._busy = RateEstimatorFactory.get_estimator(estimator, seconds,
+                                                        start)
+        # the capacity is kept while idle since nothing is measured
+        self._service_fps = 0
+        self._stream_frames = {}
+
+    def add(self, infer_frame, drop_frame, skip_frame, now=None):
+        """
+        Count the frames inferred, dropped and skipped at now
+        """
+        self._infer.add(infer_frame, now)
+        self._drop.add(drop_frame, now)
+        self._skip.add(skip_frame, now)
+
+    def add_busy(self, seconds, now=None):
+        """
+        Count the seconds the engine was busy inferring till now
+        """
+        self._busy.add(seconds, now)
+
+    def add_stream(self, name, infer_frame):
+        """
+        Count the frames inferred for a stream
+        """
+        self._stream_frames[name] = \
+            self._stream_frames.get(name, 0) + infer_frame
+
+    def snapshot(self, now=None, queue_depth=None):
+        """
+        Estimate the rates at now and return them as InferMetrics.
+
+        The arrival rate is the sum of inferred, skipped and dropped ones, and
+        the scale ratio is the arrival rate over the capacity. It is the same
+        as (infer + skip + drop) / infer under load, while it goes below 1
+        smoothly as the load decreases.
+        """
+        if now is None:
+            now = time.time()
+        infer_fps = self._infer.rate(now)
+        drop_fps = self._drop.rate(now)
+        skip_fps = self._skip.rate(now)
+        arrival_fps = infer_fps + drop_fps + skip_fps
+        busy = self._busy.rate(now)
+        if busy > 0 and infer_fps > 0:
+            self._service_fps = infer_fps / busy
+        service_fps = self._service_fps
+        scale_ratio = 0
+        if service_fps > 0:
+            scale_ratio = arrival_fps / service_fps
+        stream_frames = self._stream_frames
+        self._stream_frames = {}
+        return InferMetrics(infer_fps, drop_fps, skip_fps, arrival_fps,
+                            service_fps, scale_ratio, queue_depth,
+                            stream_frames)
+
+def erlang_c(servers, load):
+    """
+    Probability that a frame waits in M/M/c queue with given servers and
+    offered load (arrival rate over service rate of one server).
+    """
+    if load <= 0:
+        return 0.0
+    if load >= servers:
+        return 1.0
+    # Erlang B by recursion is stable for many servers
+    erlang_b = 1.0
+    for index in range(1, servers + 1):
+        erlang_b = load * erlang_b / (index + load * erlang_b)
+    return servers * erlang_b / (servers - load * (1 - erlang_b))
+
+def desired_replicas(arrival_fps, service_fps, backlog=0, *,
+                     target_utilization=0.8, target_wait=0.5,
+                     drain_seconds=10, max_replicas=64):
+    """
+    Smallest number of replicas each serving service_fps to keep up with
+    arrival_fps, so the utilization and the mean queue wait of M/M/c model
+    are within the targets, while the backlog on queue is drained within
+    drain_seconds. Return None if the service rate is unknown.
+    """
+    if service_fps <= 0:
+        return None
+    demand = arrival_fps + backlog / drain_seconds
+    if demand <= 0:
+        return 0
+    load = demand / service_fps
+    replicas = max(1, math.ceil(load / target_utilization))
+    while replicas < max_replicas:
+        if replicas > load and erlang_c(replicas, load) / \
+            (replicas * service_fps - demand) <= target_wait:
+            break
+        replicas += 1
+    return replicas
+
+class ServiceRateRegistry:
+    """
+    Share the service rate of each inference pod of a category on redis, so
+    the queue exporter gets the rates of all pods without scraping them.
+    """
+
+    # seconds without report before a pod is considered gone
+    _STALE_SECONDS = 60
+
+    def __init__(self, redis_conn, category):
+        self._redis = redis_conn
+        self._category = category
+
+    @property
+    def name(self):
+        """
+        Name of the hash for the rates of each pod
+        """
+        return "service_rates_" + self._category
+
+    def report(self, pod, metrics):
+        """
+        Report the InferMetrics of a pod
+        """
+        self._redis.hset(self.name, pod, "%f %f %f" % (
+            time.time(), metrics.service_fps, metrics.infer_fps))
+
+    def collect(self, now=None):
+        """
+        Collect the service rates of alive pods, the stale ones are removed.
+        The pods not having inferred any frame yet are left out, since their
+        capacity is unknown rather than 0.
+        """
+        if now is None:
+            now = time.time()
+        rates = {}
+        stale = []
+        for pod, value in self._redis.hgetall(self.name).items():
+            report_time, service_fps, _ = [float(item) for item in
+                                           value.decode("utf-8").split()]
+            if now - report_time > self._STALE_SECONDS:
+                stale.append(pod)
+                continue
+            if service_fps > 0:
+                rates[pod.decode("utf-8")] = service_fps
+        if len(stale) != 0:
+            self._redis.hdel(self.name, *stale)
+        return rates
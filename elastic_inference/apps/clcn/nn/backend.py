@@ -0,0 +1,184 @@
+"""
+Inference backends to run the neural network of a model on device.
+
+The backend takes the NCHW input blob prepared by NN class and returns the
+SSD detection output blob, whose rows are [image_id, label, conf, xmin, ymin,
+xmax, ymax]. The backend is selected by name:
+
+  * openvino: OpenVINO inference engine, it is the default one.
+  * opencv: OpenCV's dnn module on CPU as reference.
+  * synthetic: no model file is needed, it holds each frame for given cost
+    and outputs the same detections, so the whole pipeline can be benchmarked
+    on any linux box.
+"""
+import os
+import time
+import logging
+import cv2
+import numpy as np
+
+LOG = logging.getLogger(__name__)
+
+class InferBackendBase:
+    """
+    Inference backend base class.
+    """
+
+    def __init__(self, model_dir, model_name):
+        self._model_dir = model_dir
+        self._model_name = model_name
+
+    @property
+    def cache_state(self):     # pylint: disable=no-self-use
+        """
+        State of compiled model cache: none, cold or warm
+        """
+        return "none"
+
+    def model_path(self, ext):
+        """
+        Path of model file with given extension
+        """
+        return os.path.join(self._model_dir, self._model_name + ext)
+
+    # virtual function must be implemented by inherited class
+    def load(self, num_requests=1):
+        """
+        Load the model and return the input shape (channel, height, weight),
+        num_requests is the max number of inferences in flight.
+        """
+        raise NotImplementedError(
+            "inherited class must implement this function.")
+
+    def prepare(self, batch_size):
+        """
+        Prepare the network for given batch size ahead of inference. The
+        default one does nothing, inherited class could override it to load
+        the network for the batch size.
+        """
+
+    # virtual function must be implemented by inherited class
+    def infer(self, blob):
+        """
+        Infer the input blob and return the output blob.
+        """
+        raise NotImplementedError(
+            "inherited class must implement this function.")
+
+    def start_async(self, blob):
+        """
+        Start inferring the input blob and return the handle to wait for. The
+        default one infers synchronously, inherited class could override it
+        if the device runs several inferences in parallel. The blob is reused
+        for next batch, so it must be copied before returning.
+        """
+        return self.infer(blob)
+
+    def wait(self, handle):
+        """
+        Wait for the inference started by start_async() and return the output
+        blob.
+        """
+        return handle
+
+class OpenCVBackend(InferBackendBase):
+    """
+    OpenCV dnn module based backend running on CPU.
+
+    The model is expected to take the raw BGR pixels like the OpenVINO IR
+    ones, the model file is searched by the extensions in order.
+    """
+
+    _MODEL_FORMATS = [(".onnx", None), (".caffemodel", ".prototxt"),
+                      (".pb", ".pbtxt"), (".xml", ".bin")]
+
+    def __init__(self, model_dir, model_name, input_size=(300, 300)):
+        InferBackendBase.__init__(self, model_dir, model_name)
+        self._input_size = input_size
+        self._net = None
+
+    def load(self, num_requests=1):
+        for model_ext, config_ext in self._MODEL_FORMATS:
+            model_path = self.model_path(model_ext)
+            if not os.path.exists(model_path):
+                continue
+            config_path = ""
+            if config_ext is not None:
+                config_path = self.model_path(config_ext)
+            LOG.debug("Model: %s", model_path)
+            self._net = cv2.dnn.readNet(model_path, config_path)
+            if model_ext != ".xml":
+                self._net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+            self._net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+            weight, height = self._input_size
+            return 3, height, weight
+
+        raise FileNotFoundError("No model file found for %s in %s" %
+                                (self._model_name, self._model_dir))
+
+    def infer(self, blob):
+        self._net.setInput(blob.astype(np.float32))
+        return self._net.forward()
+
+class SyntheticBackend(InferBackendBase):
+    """
+    Deterministic backend without model file.
+
+    Each frame is held for cost_ms milliseconds without the GIL like the real
+    inference runtime, then the same detections are output for every frame.
+    """
+
+    def __init__(self, model_dir=None, model_name=None, cost_ms=10,
+                 detections=1, input_size=(300, 300)):
+        InferBackendBase.__init__(self, model_dir, model_name)
+        self._cost = cost_ms / 1000.0
+        self._detections = detections
+        self._input_size = input_size
+        self._outputs = {}
+
+    def load(self, num_requests=1):
+        LOG.info("Synthetic backend: %.1f ms and %d detections per frame",
+                 self._cost * 1000, self._detections)
+        weight, height = self._input_size
+        return 3, height, weight
+
+    def _get_output(self, batch_size):
+        if batch_size not in self._outputs:
+            # lay the boxes side by side in the middle of frame
+            step = 1.0 / (self._detections + 1)
+            rows = []
+            for index in range(batch_size):
+                for det in range(self._detections):
+                    xmin = (det + 0.5) * step
+                    rows.append([index, 1, 0.9, xmin, 0.25,
+                                 xmin + step, 0.75])
+            output = np.reshape(np.array(rows, dtype=np.float32), (1, 1, -1, 7))
+            self._outputs[batch_size] = output
+        return self._outputs[batch_size]
+
+    def infer(self, blob):
+        batch_size = blob.shape[0]
+        time.sleep(self._cost * batch_size)
+        return self._get_output(batch_size)
+
+class InferBackendFactory:
+    """
+    Factory class for inference backend instance
+    """
+
+    @staticmethod
+    def get_backend(name, model_dir, model_name, **kwargs):
+        """
+        Get inference backend instance according to backend name, kwargs are
+        passed to the backend's constructor.
+        """
+        if name == "synthetic":
+            return SyntheticBackend(model_dir, model_name, **kwargs)
+        if name == "opencv":
+            return OpenCVBackend(model_dir, model_name, **kwargs)
+        if name != "openvino":
+            LOG.warning("%s is not a recoginized infer backend, use openvino.",
+                        name)
+        # openvino is optional for other backends, only import it on demand
+        from .openvino_backend import OpenVinoBackend  # pylint: disable=import-outside-toplevel
+        return OpenVinoBackend(model_dir, model_name, **kwargs)
@@ -0,0 +1,67 @@
+"""
+Deadline based dynamic batching of the frames from frame queue.
+
+The streams of same category arrive interleaved on one frame queue at
+different rates. Instead of inferring whatever is on queue at the moment, the
+batcher keeps collecting frames after the first one until the max batch size
+is reached or the max wait expires, so the batch is filled at peak while a
+lone frame is not held longer than the deadline in low traffic periods.
+"""
+import time
+
+class DynamicBatcher:
+    """
+    Collect the frames from frame queue into batches.
+    """
+
+    def __init__(self, frame_queue, batch_sizes, max_wait_ms=0):
+        self._queue = frame_queue
+        self._batch_sizes = sorted(set(batch_sizes))
+        self._max_wait = max_wait_ms / 1000.0
+
+    @property
+    def batch_sizes(self):
+        """
+        Batch sizes the network is prepared for in ascending order
+        """
+        return self._batch_sizes
+
+    @property
+    def max_batch_size(self):
+        """
+        Max number of frames in a batch
+        """
+        return self._batch_sizes[-1]
+
+    @property
+    def max_wait(self):
+        """
+        Max seconds to wait for more frames after the first one of batch
+        """
+        return self._max_wait
+
+    def collect(self, timeout):
+        """
+        Collect a batch of frames, wait up to timeout seconds for the first
+        frame. Return the frame messages, the number of overflow frames
+        dropped from frame queue and the seconds waited for more frames after
+        the first one.
+        """
+        max_count = self.max_batch_size
+        msgs, drop_frame = self._queue.pop_batch(max_count, timeout)
+        if len(msgs) == 0 or len(msgs) == max_count or self._max_wait <= 0:
+            return msgs, drop_frame, 0
+
+        # block on frame queue for the rest of max wait instead of polling
+        start = time.time()
+        deadline = start + self._max_wait
+        now = start
+        while len(msgs) < max_count and now < deadline:
+            more, more_drop = self._queue.pop_batch(max_count - len(msgs),
+                                                    deadline - now)
+            msgs += more
+            drop_frame += more_drop
+            now = time.time()
+            if len(more) == 0:
+                break
+        return msgs, drop_frame, now - start
@@ -1,149 +1,607 @@
 """
-Openvino based inference engine
+Neural network based inference engine
 """
 import logging
 import time
+import queue
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import numpy as np
-from openvino.inference_engine import IEPlugin
 
 from clcn.appbase import CLCNTask
-from clcn.stream import StreamInfo
-from clcn.nn.nn import NNGeneralDetection
+from clcn.metrics import InferRates
+from clcn.profiling import StageTimer
+from clcn.stream import StreamInfo, StreamMessage
+from clcn.nn.nn import NNGeneralDetection, render_detections, \
+    DETECTION_WIRE_DTYPE
+from clcn.nn.backend import InferBackendFactory
+from clcn.nn.tracker import StreamTracker
+from clcn.nn.batcher import DynamicBatcher
 
 LOG = logging.getLogger(__name__)
 
+# entry on infer stage queue to drop the trackers of expired streams
+_ExpiredStreams = namedtuple("_ExpiredStreams", ["ids"])
+
+# options of inference engine:
+# - batch_size and batch_sizes: largest and prepared batch sizes, the batch is
+#   collected within max_wait_ms
+# - infer_requests: number of inferences in flight
+# - decode_workers and encode_workers: threads to decode and encode frames
+# - output_mode: one of InferEngineTask.OUTPUT_*
+# - max_skip: max interval of inferred frames under load
+# - rate_estimator and rate_window: "ewma" or "window" over given seconds
+EngineOptions = namedtuple("EngineOptions", [
+    "batch_size", "batch_sizes", "max_wait_ms", "infer_requests",
+    "decode_workers", "encode_workers", "output_mode", "max_skip",
+    "rate_estimator", "rate_window"],
+    defaults=[1, None, 0, 1, 1, 1, "frame", 1, "ewma", 30])
+
+# functions called to report the metrics of inference engine, None to skip
+EngineReporters = namedtuple("EngineReporters", [
+    "report_metric_fn", "report_latency_fn", "report_detection_fn",
+    "report_batch_fn", "report_stage_fn"],
+    defaults=[None, None, None, None, None])
+
+# detection model run by NNInferEngineTask on the backend with given arguments,
+# the detections under threshold are filtered and the top_k kept if not 0
+DetectionModel = namedtuple("DetectionModel", [
+    "model_dir", "model_name", "backend", "backend_args", "threshold",
+    "top_k"],
+    defaults=["/models/", "SqueezeNetSSD-5Class", "openvino", None, 0.5, 0])
+
 class InferEngineTask(CLCNTask):
     """
     Inference task.
     """
 
-    def __init__(self, input_queue, output_broker, report_metric_fn=None):
+    # seconds to block on frame queue when it is empty
+    _POP_TIMEOUT = 1
+    # seconds between two metric reports
+    _METRIC_REPORT_INTERVAL = 10
+    # seconds without any frame before checking whether stream is expired
+    _STREAM_IDLE = 2
+    # seconds between two stream expiry checks on frame queue
+    _EXPIRE_CHECK_INTERVAL = 1
+    # seconds to block on stage queue before checking task stopping
+    _STAGE_TIMEOUT = 0.5
+    # seconds between two adjustments of frame skip interval
+    _SKIP_ADAPT_INTERVAL = 2
+
+    # decode flags to reduce JPEG resolution by the scale
+    _REDUCED_DECODE_FLAGS = [(8, cv2.IMREAD_REDUCED_COLOR_8),
+                             (4, cv2.IMREAD_REDUCED_COLOR_4),
+                             (2, cv2.IMREAD_REDUCED_COLOR_2)]
+
+    # publish the frame annotated with detections
+    OUTPUT_FRAME = "frame"
+    # publish the detections only
+    OUTPUT_DETECTION = "detection"
+    # publish the origin frame and its detections for client side overlay
+    OUTPUT_OVERLAY = "overlay"
+
+    def __init__(self, input_queue, output_broker, options=None,
+                 reporters=None):
         CLCNTask.__init__(self)
+        options = options or EngineOptions()
+        reporters = reporters or EngineReporters()
         self._input_queue = input_queue
         self._output_broker = output_broker
-        self._infer_frame_count = 0
-        self._drop_frame_count = 0
-        self._infer_time_start = 0
+        # the rates are estimated by EWMA or sliding window over
+        # rate_window seconds
+        self._rates = InferRates(options.rate_estimator,
+                                 options.rate_window)
+        # seconds the infer stage is busy, written on infer stage thread and
+        # counted into the rates on popping thread
+        self._busy_seconds = 0
+        self._reported_busy = 0
+        self._metric_report_time = time.time()
         self._cached_streams = {}
-        self._report_metric_fn = report_metric_fn
+        self._expire_check_time = 0
+        self._report_metric_fn = reporters.report_metric_fn
+        # the batch is collected up to the largest batch size within max
+        # wait, then padded to the smallest prepared batch size to hold it
+        self._batch_sizes = sorted(set(list(options.batch_sizes or []) +
+                                       [options.batch_size]))
+        self._batch_size = self._batch_sizes[-1]
+        self._batcher = DynamicBatcher(input_queue, self._batch_sizes,
+                                       options.max_wait_ms)
+        self._report_batch_fn = reporters.report_batch_fn
+        self._report_latency_fn = reporters.report_latency_fn
+        self._report_detection_fn = reporters.report_detection_fn
+        # the seconds of each stage on hot path are reported in batches
+        self._timer = StageTimer(reporters.report_stage_fn)
+        self._output_mode = options.output_mode
+        # max number of inferences in flight
+        self._infer_requests = options.infer_requests
+        self._inflight = deque()
+        # the frames go through decode, infer and encode stages in parallel,
+        # the bounded queues between stages keep the batches in popping order
+        # and hold enough batches for each worker to pick up the next one
+        self._decode_pool = ThreadPoolExecutor(
+            max_workers=options.decode_workers)
+        self._encode_pool = ThreadPoolExecutor(
+            max_workers=options.encode_workers)
+        self._infer_queue = queue.Queue(maxsize=2 * options.decode_workers)
+        self._publish_queue = queue.Queue(maxsize=2 * options.encode_workers)
+        self._stages = [
+            CLCNTask(name="InferStage", exec_func=self._infer_stage),
+            CLCNTask(name="PublishStage", exec_func=self._publish_stage)]
+        # under load only every Nth frame of a stream is inferred, N adapts
+        # to the frame drops and queue depth up to max_skip, the detections
+        # of the skipped frames are propagated by the tracker of each stream
+        self._max_skip = options.max_skip
+        self._skip_interval = 1
+        self._skip_adapt_time = 0
+        self._skip_adapt_drops = 0
+        # frames since last inferred one for each stream, on popping thread
+        self._stream_skips = {}
+        # trackers of each stream, on infer stage thread
+        self._trackers = {}
 
     def infer(self, frame):
         """
-        Infer a frame
+        Infer a frame and return its detections as DETECTION_DTYPE array
         """
         raise NotImplementedError("inheritted class must implement this")
 
-    def execute(self):
+    def infer_batch(self, frames):
         """
-        Task entry
+        Infer a batch of frames. The default one infers the frame one by one,
+        inherited class could override it to do the real batch inference.
         """
-        idle_count = 0
-        max_infer_fps = 0
-        self._infer_time_start = time.time()
-        while not self.is_task_stopping:
-            now = time.time()
-            for key in list(self._cached_streams):
-                info = StreamInfo.from_id(key)
-                if self._input_queue.is_stream_expired(info):
-                    self._output_broker.unregister_stream(info)
-                    del self._cached_streams[key]
-
-            msg = self._input_queue.pop()
-            if msg is None:
-                time.sleep(0.05)
-                idle_count += 1
-                # reset the infer and drop fps when idle over 30s
-                if idle_count > 600:
-                    idle_count = 0
-                    LOG.info("Idle for 30 seconds")
-                    # idle means it has the potential to scale down
-                    # thus set the scale ratio to 0.5
-                    if self._report_metric_fn is not None:
-                        self._report_metric_fn(0, 0, 0.5)
+        return [self.infer(frame) for frame in frames]
 
-                continue
+    def infer_async(self, frames):
+        """
+        Start inferring a batch of frames and return the handle to wait for.
+        The default one infers synchronously, inherited class could override
+        it to keep several inference requests in flight.
+        """
+        return self.infer_batch(frames)
+
+    def wait_infer(self, handle):
+        """
+        Wait for the inference started by infer_async() and return the
+        detections of each frame.
+        """
+        return handle
+
+    @property
+    def input_size(self):
+        """
+        Size (weight, height) of network input, the frame could be decoded at
+        reduced resolution close to it. None means unknown.
+        """
+        return None
 
-            idle_count = 0
-            self._drop_frame_count += self._input_queue.drop()
+    def render(self, frame, detections):     # pylint: disable=no-self-use
+        """
+        Draw the detections on frame before publishing.
+        """
+        return render_detections(frame, detections)
 
+    def _report_latency(self, infos, msgs, pop_time):
+        """
+        Report the queue wait from capture to pop and the inference latency
+        from pop to publish for each frame.
+        """
+        if self._report_latency_fn is None:
+            return
+        infer_latency = time.time() - pop_time
+        for info, msg in zip(infos, msgs):
+            queue_wait = None
+            if msg.timestamp > 0:
+                queue_wait = pop_time - msg.timestamp
+            self._report_latency_fn(info, queue_wait, infer_latency)
+
+    def _expire_streams(self, now):
+        """
+        Unregister the expired streams. The stream is tracked locally by its
+        last frame time, only the idle ones are checked on frame queue.
+        """
+        if now - self._expire_check_time < self._EXPIRE_CHECK_INTERVAL:
+            return
+        self._expire_check_time = now
+
+        idle_infos = []
+        for key, last_time in self._cached_streams.items():
+            if now - last_time > self._STREAM_IDLE:
+                idle_infos.append(StreamInfo.from_id(key))
+        if len(idle_infos) == 0:
+            return
+
+        expired = self._input_queue.expired_streams(idle_infos)
+        if len(expired) != 0:
+            self._output_broker.unregister_streams(expired)
+        expired_ids = [info.id for info in expired]
+        for info in idle_infos:
+            if info.id in expired_ids:
+                del self._cached_streams[info.id]
+                self._stream_skips.pop(info.id, None)
+            else:
+                # the frames might go to other replicas, check it later
+                self._cached_streams[info.id] = now
+        if len(expired_ids) != 0 and self._max_skip > 1:
+            # the trackers are owned by infer stage thread, drop them there
+            # after the frames popped before
+            self._put_stage(self._infer_queue, _ExpiredStreams(expired_ids),
+                            self)
+
+    def _register_streams(self, msgs, now):
+        """
+        Register the streams of frames on broker.
+        """
+        infos = []
+        for msg in msgs:
             info = StreamInfo(msg.name, msg.category, "inferred")
             if info.id not in self._cached_streams.keys():
                 self._output_broker.register_stream(info)
 
             self._cached_streams[info.id] = now
+            infos.append(info)
+        return infos
+
+    def _report_rates(self, now):
+        """
+        Report the estimated rates and scale ratio periodically.
+        """
+        if now - self._metric_report_time < self._METRIC_REPORT_INTERVAL:
+            return
+        self._metric_report_time = now
+
+        busy = self._busy_seconds
+        self._rates.add_busy(busy - self._reported_busy, now)
+        self._reported_busy = busy
+        metrics = self._rates.snapshot(now, self._input_queue.depth())
+        LOG.info("[%s] Infer/skip/drop speed: %.2f/%.2f/%.2f FPS, "
+                 "capacity: %.2f FPS, scale ratio: %.2f",
+                 self._input_queue.name, metrics.infer_fps, metrics.skip_fps,
+                 metrics.drop_fps, metrics.service_fps, metrics.scale_ratio)
+        if self._report_metric_fn is not None:
+            self._report_metric_fn(metrics)
+
+    def _adapt_skip(self, now, drop_frame):
+        """
+        Adjust the frame skip interval by the frames dropped and left on
+        queue since last adjustment. It is doubled once overloaded and
+        decreased by one otherwise, so it backs off quickly from drops and
+        returns to full inference gradually.
+        """
+        self._skip_adapt_drops += drop_frame
+        if self._max_skip <= 1 or \
+            now - self._skip_adapt_time < self._SKIP_ADAPT_INTERVAL:
+            return
+        depth = self._input_queue.depth()
+        overloaded = self._skip_adapt_drops > 0 or \
+            (depth is not None and depth > 2 * self._batch_size)
+        if overloaded:
+            interval = min(self._max_skip, self._skip_interval * 2)
+        else:
+            interval = max(1, self._skip_interval - 1)
+        if interval != self._skip_interval:
+            LOG.info("Frame skip interval: %d -> %d (drop: %d, depth: %s)",
+                     self._skip_interval, interval, self._skip_adapt_drops,
+                     depth)
+            self._skip_interval = interval
+        self._skip_adapt_time = now
+        self._skip_adapt_drops = 0
+
+    def _plan_skips(self, infos):
+        """
+        Decide whether to skip inferring each frame. The first frame of a
+        stream is always inferred, then one in every skip interval frames.
+        """
+        skips = []
+        for info in infos:
+            since = self._stream_skips.get(info.id)
+            skip = since is not None and since + 1 < self._skip_interval
+            self._stream_skips[info.id] = since + 1 if skip else 0
+            skips.append(skip)
+        return skips
+
+    def _track(self, infos, msgs, skips, inferred):
+        """
+        Merge the detections of inferred frames with the ones predicted by
+        tracker for skipped frames in frame order.
+        """
+        if self._max_skip <= 1:
+            return inferred
+        inferred = iter(inferred)
+        detections = []
+        with self._timer.time("track"):
+            for info, msg, skip in zip(infos, msgs, skips):
+                tracker = self._trackers.get(info.id)
+                if tracker is None:
+                    tracker = self._trackers[info.id] = StreamTracker()
+                if skip:
+                    detections.append(tracker.predict(msg.sequence))
+                else:
+                    dets = next(inferred)
+                    tracker.update(dets, msg.sequence)
+                    detections.append(dets)
+        return detections
+
+    def _decode_flag(self, msg):
+        # the decoded frame is published in frame mode, keep full resolution
+        if self._output_mode == self.OUTPUT_FRAME or self.input_size is None:
+            return cv2.IMREAD_COLOR
+        frame_size = msg.frame_size()
+        if frame_size is None:
+            return cv2.IMREAD_COLOR
 
-            # decode frame from queue
-            image = np.asarray(bytearray(msg.data), dtype="uint8")
-            image = cv2.imdecode(image, cv2.IMREAD_COLOR)
+        # decode at the smallest resolution which is still not less than the
+        # network input, it saves most of the decoding and resizing
+        weight, height = self.input_size
+        for scale, flag in self._REDUCED_DECODE_FLAGS:
+            if frame_size[0] // scale >= weight and \
+                frame_size[1] // scale >= height:
+                return flag
+        return cv2.IMREAD_COLOR
 
-            # infer the frame
-            result = self.infer(image)
+    def _decode(self, msg):
+        # decode frame from queue without copying the payload
+        with self._timer.time("decode"):
+            image = np.frombuffer(msg.data, dtype=np.uint8)
+            return cv2.imdecode(image, self._decode_flag(msg))
 
-            # encode inferred frame
-            _, jpeg = cv2.imencode('.jpg', result)
+    def _encode(self, msg, frame, detections, publish_time):
+        """
+        Encode the inferred frame into the packets to publish according to
+        output mode.
+        """
+        packets = []
+        if self._output_mode == self.OUTPUT_FRAME:
+            with self._timer.time("render"):
+                frame = self.render(frame, detections)
+            with self._timer.time("encode"):
+                _, jpeg = cv2.imencode('.jpg', frame)
+            packets.append(jpeg.data)
+        elif self._output_mode == self.OUTPUT_OVERLAY:
+            # forward the origin frame as is, the boxes are drawn by client
+            packets.append(msg.data)
+        binaries = [StreamMessage(packet, StreamMessage.KIND_JPEG,
+                                  msg.sequence, msg.timestamp,
+                                  publish_time).to_binary()
+                    for packet in packets]
+
+        if self._output_mode != self.OUTPUT_FRAME:
+            records = detections.astype(DETECTION_WIRE_DTYPE).tobytes()
+            binaries.append(StreamMessage(
+                records, StreamMessage.KIND_DETECTIONS, msg.sequence,
+                msg.timestamp, publish_time).to_binary())
+        return binaries
 
-            # send to broker
-            self._output_broker.publish(info, jpeg.tobytes())
+    @staticmethod
+    def _put_stage(stage_queue, entry, task):
+        """
+        Put the entry to next stage, block while the stage is full so the
+        frames are left on frame queue and counted there once overflow.
+        """
+        while not task.is_task_stopping:
+            try:
+                stage_queue.put(entry, timeout=InferEngineTask._STAGE_TIMEOUT)
+                return True
+            except queue.Full:
+                continue
+        return False
 
-            duration = now - self._infer_time_start
-            self._infer_frame_count += 1
-            if duration > 10:
-                infer_fps = self._infer_frame_count / duration
-                drop_fps = self._drop_frame_count / duration
+    def _complete_inflight(self, keep, task):
+        """
+        Wait for the oldest inference in flight until only keep ones are
+        left, then hand over their results to encode workers.
+        """
+        while len(self._inflight) > keep:
+            infos, msgs, frames, skips, handle, pop_time = \
+                self._inflight.popleft()
+            inferred = [] if handle is None else self.wait_infer(handle)
+            detections = self._track(infos, msgs, skips, inferred)
 
-                LOG.info("[%s] Infer speed: %02f FPS", \
-                    info.category, infer_fps)
-                LOG.info("[%s] Drop frame speed: %02f FPS", \
-                    info.category, drop_fps)
+            publish_time = time.time()
+            encoded = [self._encode_pool.submit(
+                self._encode, msg, frame, dets, publish_time)
+                       for msg, frame, dets in zip(msgs, frames, detections)]
+            self._put_stage(self._publish_queue,
+                            (infos, msgs, detections, encoded, pop_time),
+                            task)
 
-                if infer_fps > max_infer_fps:
-                    max_infer_fps = infer_fps
-                if drop_fps > 0:
-                    scale_ratio = (infer_fps + drop_fps) / infer_fps
+    def _infer_stage(self, task):
+        """
+        Infer the decoded batches in popping order.
+        """
+        while not task.is_task_stopping:
+            try:
+                # do not wait on stage queue while frames are being inferred
+                if len(self._inflight) != 0:
+                    entry = self._infer_queue.get_nowait()
                 else:
-                    scale_ratio = infer_fps/max_infer_fps
+                    entry = self._infer_queue.get(timeout=self._STAGE_TIMEOUT)
+            except queue.Empty:
+                entry = None
+
+            # the stage is busy except waiting for the next batch, and the
+            # frames inferred per busy second is the capacity
+            start = time.perf_counter()
+            if entry is None:
+                self._complete_inflight(0, task)
+            elif isinstance(entry, _ExpiredStreams):
+                self._complete_inflight(0, task)
+                for key in entry.ids:
+                    self._trackers.pop(key, None)
+            else:
+                self._start_inflight(entry, task)
+            self._busy_seconds += time.perf_counter() - start
 
-                if self._report_metric_fn is not None:
-                    self._report_metric_fn(
-                        infer_fps, drop_fps, scale_ratio)
-                self._infer_time_start = now
-                self._infer_frame_count = 0
-                self._drop_frame_count = 0
+    def _start_inflight(self, entry, task):
+        """
+        Start inferring the batch and complete the oldest ones beyond the
+        limit, so the next batch is decoded during the inference in flight.
+        """
+        infos, msgs, decoded, skips, pop_time = entry
+        frames = [None if future is None else future.result()
+                  for future in decoded]
+        infer_frames = [frame for frame, skip in zip(frames, skips)
+                        if not skip]
+        handle = None
+        if len(infer_frames) != 0:
+            handle = self.infer_async(infer_frames)
+        self._inflight.append((infos, msgs, frames, skips, handle, pop_time))
+        self._complete_inflight(self._infer_requests - 1, task)
+
+    def _publish_stage(self, task):
+        """
+        Publish the encoded batches in popping order and acknowledge them.
+        """
+        while not task.is_task_stopping:
+            try:
+                entry = self._publish_queue.get(timeout=self._STAGE_TIMEOUT)
+            except queue.Empty:
+                continue
 
+            # fan out inferred frames to each stream on broker
+            infos, msgs, detections, encoded, pop_time = entry
+            items = [(info, binary)
+                     for info, future in zip(infos, encoded)
+                     for binary in future.result()]
+            with self._timer.time("publish"):
+                self._output_broker.publish_batch(items)
+                self._input_queue.ack(len(msgs))
+            self._report_latency(infos, msgs, pop_time)
+            if self._report_detection_fn is not None:
+                for info, dets in zip(infos, detections):
+                    self._report_detection_fn(info, dets)
 
-class OpenVinoInferEngineTask(InferEngineTask):
+    def execute(self):
+        """
+        Task entry
+        """
+        for stage in self._stages:
+            stage.start()
+
+        while not self.is_task_stopping:
+            self._expire_streams(time.time())
+
+            msgs, drop_frame, batch_wait = self._batcher.collect(
+                self._POP_TIMEOUT)
+            now = time.time()
+            # the rates keep being reported while idle, so they decay to 0
+            # instead of holding the last values
+            self._report_rates(now)
+            if len(msgs) == 0:
+                self._rates.add(0, drop_frame, 0, now)
+                continue
+
+            if self._report_batch_fn is not None:
+                self._report_batch_fn(len(msgs), batch_wait)
+            self._adapt_skip(now, drop_frame)
+
+            infos = self._register_streams(msgs, now)
+            skips = self._plan_skips(infos)
+            # the skipped frame is only decoded to publish in frame mode
+            decoded = [None if skip and self._output_mode != self.OUTPUT_FRAME
+                       else self._decode_pool.submit(self._decode, msg)
+                       for msg, skip in zip(msgs, skips)]
+            if not self._put_stage(self._infer_queue,
+                                   (infos, msgs, decoded, skips, now), self):
+                break
+
+            skip_frame = sum(skips)
+            self._rates.add(len(msgs) - skip_frame, drop_frame, skip_frame,
+                            now)
+            for info, skip in zip(infos, skips):
+                if not skip:
+                    self._rates.add_stream(info.name, 1)
+
+        for stage in self._stages:
+            stage.stop()
+        self._decode_pool.shutdown(wait=False)
+        self._encode_pool.shutdown(wait=False)
+
+
+class NNInferEngineTask(InferEngineTask):
     """
-    Openvino based inference engine
+    Neural network based inference engine, the network runs on the backend
+    selected by name like openvino, opencv or synthetic.
     """
 
-    _DEFAULT_MODEL_DIR = "/models/"
-    _DEFAULT_MODLE_NAME = "SqueezeNetSSD-5Class"
-
     def __init__(self, origin_frame_queue, inferred_frame_queue,
-                 report_metric_fn=None,
-                 model_dir=_DEFAULT_MODEL_DIR,
-                 model_name=_DEFAULT_MODLE_NAME):
-        InferEngineTask.__init__(self, origin_frame_queue, \
-            inferred_frame_queue, \
-            report_metric_fn)
-        LOG.info("Model dir: %s", model_dir)
-        LOG.info("Model name: %s", model_name)
-        self._plugin = self._init_openvino_cpu_plugin()
-        self._nn = NNFactory.get_detection(model_dir, model_name)
-        self._nn.load()
-        self._exec = self._plugin.load(network=self._nn.net)
+                 model=None, options=None, reporters=None):
+        start = time.time()
+        model = model or DetectionModel()
+        options = options or EngineOptions()
+        InferEngineTask.__init__(self, origin_frame_queue,
+                                 inferred_frame_queue, options, reporters)
+        LOG.info("Model dir: %s", model.model_dir)
+        LOG.info("Model name: %s", model.model_name)
+        LOG.info("Infer backend: %s", model.backend)
+        LOG.info("Output mode: %s", options.output_mode)
+        LOG.info("Batch sizes: %s, max wait: %d ms", self._batch_sizes,
+                 options.max_wait_ms)
+        LOG.info("Infer requests: %d", options.infer_requests)
+        LOG.info("Decode/encode workers: %d/%d", options.decode_workers,
+                 options.encode_workers)
+        LOG.info("Max frame skip interval: %d", options.max_skip)
+        self._nn = NNFactory.get_detection(model.model_dir, model.model_name,
+                                           model.backend, model.backend_args)
+        self._nn.threshold = model.threshold
+        self._nn.top_k = model.top_k
+        self._nn.load(options.infer_requests)
+        if options.batch_sizes:
+            # the batch is padded to the prepared sizes, so the network is
+            # never reshaped at runtime
+            self._nn.prepare_batch_sizes(self._batch_sizes)
+        else:
+            # the configured batch size is prepared up front while smaller
+            # one is prepared when queue runs short
+            self._nn.reshape(self._batch_size)
+        for size in self._nn.batch_sizes or [self._batch_size]:
+            self._warm_up(size)
+        # the warm up is not counted in the stage metrics
+        self._nn.timer = self._timer
+        self._startup_seconds = time.time() - start
+        LOG.info("Started up in %.2f seconds, model cache: %s",
+                 self._startup_seconds, self.model_cache)
 
-    @staticmethod
-    def _init_openvino_cpu_plugin():
-        plugin = IEPlugin(device="CPU")
-        plugin.add_cpu_extension("/usr/lib64/libcpu_extension.so")
-        return plugin
+    @property
+    def startup_seconds(self):
+        """
+        Seconds to load, compile and warm up the model
+        """
+        return self._startup_seconds
+
+    @property
+    def model_cache(self):
+        """
+        State of compiled model cache: none, cold or warm
+        """
+        return self._nn.backend.cache_state
+
+    def _warm_up(self, batch_size):
+        """
+        Infer the dummy frames once, so the first frames from queue do not
+        wait for the lazy initialization of backend.
+        """
+        frame = np.zeros((self._nn.height, self._nn.weight, self._nn.channel),
+                         dtype=np.uint8)
+        self._nn.infer_batch([frame] * batch_size)
+
+    @property
+    def input_size(self):
+        return self._nn.weight, self._nn.height
 
     def infer(self, frame):
-        in_frame = self._nn.process_input(frame)
-        res = self._exec.infer(inputs={self._nn.input_blob: in_frame})
-        return self._nn.process_output(frame, res)
+        return self.infer_batch([frame])[0]
+
+    def infer_batch(self, frames):
+        return self._nn.infer_batch(frames)
+
+    def infer_async(self, frames):
+        return self._nn.start_infer(frames), len(frames)
+
+    def wait_infer(self, handle):
+        infer_handle, batch_size = handle
+        return self._nn.wait_infer(infer_handle, batch_size)
 
 class NNFactory:
     """
@@ -151,11 +609,13 @@ class NNFactory:
     """
 
     @staticmethod
-    def get_detection(model_dir, model_name):
+    def get_detection(model_dir, model_name, backend="openvino",
+                      backend_args=None):
         """
-        Get NN detection class according to model name
+        Get NN detection class according to model name, which runs on the
+        backend with given name and arguments.
         """
-        if model_name.lower() in [
+        if model_name is not None and model_name.lower() in [
                 "person-detection-retail-0013",
                 "person-vehicle-bike-detection-crossroad-0078_int8",
                 "person-vehicle-bike-detection-crossroad-0078_fp32",
@@ -165,4 +625,7 @@ class NNFactory:
                 ]:
             LOG.warning("%s is not a recoginized model.", model_name.lower())
 
-        return NNGeneralDetection(model_dir, model_name)
+        if backend_args is None:
+            backend_args = {}
+        return NNGeneralDetection(InferBackendFactory.get_backend(
+            backend, model_dir, model_name, **backend_args))
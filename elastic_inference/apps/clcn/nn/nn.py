@@ -7,28 +7,65 @@ shape, your can create inherited class to overide process_input() method
 if your model might requires different shape.
 Also the default framework has some assumptions on ouput such as BB box for
 detection results. you can create inherited class to overide process_output()
-if your model's output is different.
+if your model's output is different. The parsed detections are drawn on frame
+by render_detections() only when needed.
 """
-import os
 import logging
 import cv2
-from openvino.inference_engine import IENetwork
+import numpy as np
+
+from clcn.profiling import StageTimer
 
 LOG = logging.getLogger(__name__)
 
+# detections of a frame, the box is [xmin, ymin, xmax, ymax] relative to the
+# frame's size
+DETECTION_DTYPE = np.dtype([("class_id", np.int32), ("score", np.float32),
+                            ("box", np.float32, (4,))])
+# detection records published on stream broker, same as StreamMessage.DETECTION
+DETECTION_WIRE_DTYPE = np.dtype([("class_id", "<i4"), ("score", "<f4"),
+                                 ("box", "<f4", (4,))])
+
+def render_detections(frame, detections):
+    """
+    Draw the boxes and scores of detections on frame
+    """
+    orig_height, orig_weight, _ = frame.shape
+    boxes = (detections["box"] *
+             [orig_weight, orig_height, orig_weight, orig_height]).astype(int)
+    for det, (xmin, ymin, xmax, ymax) in zip(detections, boxes):
+        color = (0, 255, 0)
+        cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), color, 2)
+        det_label = str(det["class_id"])
+        cv2.putText(
+            frame,
+            det_label + ' ' + str(round(float(det["score"]) * 100, 1)) + ' %',
+            (xmin, ymin - 7),
+            cv2.FONT_HERSHEY_COMPLEX, 0.6, (255, 0, 0), 1)
+    return frame
+
 class NNBase:
     """
     NN base class to abstract the common infrastucture for NN infer.
     """
 
-    def __init__(self, model_dir, model_name):
+    def __init__(self, backend, threshold=0.5, top_k=0):
         self._batch_size = 0
         self._channel = 0
         self._height = 0
         self._weight = 0
-        self._model_dir = model_dir
-        self._model_name = model_name
-        self._net = None
+        self._backend = backend
+        self._threshold = threshold
+        self._top_k = top_k
+        # input blob for each batch size and resized frame are preallocated
+        # and reused across frames
+        self._blobs = {}
+        self._resized = None
+        # batch sizes prepared up front to pad the batches to, in ascending
+        # order, the network is reshaped for any other size on demand
+        self._batch_sizes = []
+        # times the preprocess, infer and postprocess stages, no-op by default
+        self._timer = StageTimer()
 
     @property
     def batch_size(self):
@@ -75,97 +112,175 @@ class NNBase:
         self._weight = value
 
     @property
-    def model_xml_path(self):
+    def threshold(self):
         """
-        model file path
+        Min score of detections.
         """
-        path = os.path.join(self._model_dir, self._model_name + ".xml")
-        return path
+        return self._threshold
+
+    @threshold.setter
+    def threshold(self, value):
+        self._threshold = value
 
     @property
-    def model_weight_path(self):
+    def top_k(self):
         """
-        weight file path
+        Max number of detections for each frame, 0 means no limit.
         """
-        path = os.path.join(self._model_dir, self._model_name + ".bin")
-        return path
+        return self._top_k
+
+    @top_k.setter
+    def top_k(self, value):
+        self._top_k = value
 
     @property
-    def net(self):
+    def batch_sizes(self):
         """
-        NN network
+        Batch sizes prepared up front in ascending order.
         """
-        return self._net
+        return self._batch_sizes
 
     @property
-    def input_blob(self):
+    def timer(self):
         """
-        Input blob
+        Stage timer of preprocess, infer and postprocess.
         """
-        return next(iter(self.net.inputs))
+        return self._timer
+
+    @timer.setter
+    def timer(self, value):
+        self._timer = value
 
     @property
-    def output_blob(self):
+    def backend(self):
         """
-        Output blob
+        Inference backend running the network
         """
-        return next(iter(self.net.outputs))
+        return self._backend
 
-    def load(self):
+    def load(self, num_requests=1):
         """
-        Load NN weight file.
+        Load NN on backend, num_requests is the max number of inferences in
+        flight.
         """
-        LOG.debug("Model XML: %s", self.model_xml_path)
-        LOG.debug("Model weight: %s", self.model_weight_path)
+        self.channel, self.height, self.weight = \
+            self._backend.load(num_requests)
+        self._blobs = {}
+        self._resized = np.empty((self.height, self.weight, self.channel),
+                                 dtype=np.uint8)
+        LOG.debug("Network input size: %dx%d", self.weight, self.height)
 
-        self._net = IENetwork(
-            model=self.model_xml_path, weights=self.model_weight_path)
+    def reshape(self, batch_size):
+        """
+        Prepare the network on backend for given batch size.
+        """
+        self._backend.prepare(batch_size)
+        self.batch_size = batch_size
 
-        # Read and pre-process input image
-        self.batch_size, self.channel, self.height, self.weight = \
-            self._net.inputs[self.input_blob].shape
-        LOG.debug("Network input shape: %s",
-                  str(self._net.inputs[self.input_blob].shape))
-        LOG.debug("Network output shape: %s",
-                  str(self._net.outputs[self.output_blob].shape))
+    def prepare_batch_sizes(self, batch_sizes):
+        """
+        Prepare the network for several batch sizes up front, the batch of
+        other size is padded to the smallest prepared one to hold it.
+        """
+        for batch_size in sorted(set(batch_sizes)):
+            self.reshape(batch_size)
+        self._batch_sizes = sorted(set(self._batch_sizes + batch_sizes))
+
+    def padded_batch_size(self, count):
+        """
+        Smallest prepared batch size to hold count frames, so the batch is
+        padded instead of reshaping the network for each count. It is count
+        itself if no prepared one is large enough.
+        """
+        for batch_size in self._batch_sizes:
+            if batch_size >= count:
+                return batch_size
+        return count
 
-    def process_input(self, frame):
+    def process_input(self, frame, blob=None):
         """
-        Process input
+        Process input into CHW blob, it is written into the given blob to save
+        the allocation.
         """
-        in_frame = cv2.resize(frame, (self.weight, self.height))
+        if blob is None:
+            blob = np.empty((self.channel, self.height, self.weight),
+                            dtype=np.uint8)
+        if frame.shape[:2] != (self.height, self.weight):
+            frame = cv2.resize(frame, (self.weight, self.height),
+                               dst=self._resized)
         # Change data layout from HWC to CHW
-        in_frame = in_frame.transpose((2, 0, 1))
-        in_frame = in_frame.reshape(
-            (self.batch_size, self.channel, self.height, self.weight))
-        return in_frame
-
-    def process_output(self, frame, result):
-        """
-        Process ouput
-        """
-        orig_height, orig_weight, _ = frame.shape
-        for obj in result[self.output_blob][0][0]:
-            if obj[2] > 0.5:
-                xmin = int(obj[3] * orig_weight)
-                ymin = int(obj[4] * orig_height)
-                xmax = int(obj[5] * orig_weight)
-                ymax = int(obj[6] * orig_height)
-                class_id = int(obj[1])
-                color = (0, 255, 0)
-                cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), color, 2)
-                det_label = str(class_id)
-                cv2.putText(
-                    frame,
-                    det_label + ' ' + str(round(obj[2] * 100, 1)) + ' %',
-                    (xmin, ymin - 7),
-                    cv2.FONT_HERSHEY_COMPLEX, 0.6, (255, 0, 0), 1)
-        return frame
+        np.copyto(blob, frame.transpose((2, 0, 1)))
+        return blob
+
+    def process_input_batch(self, frames, batch_size=None):
+        """
+        Process a batch of input frames into one NCHW blob, the blob is reused
+        by next batch of same size. The blob could be larger than the number
+        of frames, the padded ones are left as is and not parsed on output.
+        """
+        if batch_size is None:
+            batch_size = len(frames)
+        if batch_size not in self._blobs:
+            self._blobs[batch_size] = np.zeros(
+                (batch_size, self.channel, self.height, self.weight),
+                dtype=np.uint8)
+        blob = self._blobs[batch_size]
+        for index, frame in enumerate(frames):
+            self.process_input(frame, blob[index])
+        return blob
+
+    def process_output(self, result, batch_size=1):
+        """
+        Parse the SSD output blob into the detections of each frame in batch,
+        the rows are [image_id, label, conf, xmin, ymin, xmax, ymax].
+        """
+        rows = result.reshape(-1, 7)
+        rows = rows[rows[:, 2] > self.threshold]
+        detections = []
+        for index in range(batch_size):
+            dets = rows[rows[:, 0] == index]
+            if 0 < self.top_k < len(dets):
+                dets = dets[np.argsort(-dets[:, 2], kind="stable")
+                            [:self.top_k]]
+            frame_dets = np.empty(len(dets), dtype=DETECTION_DTYPE)
+            frame_dets["class_id"] = dets[:, 1]
+            frame_dets["score"] = dets[:, 2]
+            frame_dets["box"] = dets[:, 3:7]
+            detections.append(frame_dets)
+        return detections
+
+    def start_infer(self, frames):
+        """
+        Start inferring a batch of frames and return the handle to wait for.
+        """
+        with self._timer.time("preprocess"):
+            blob = self.process_input_batch(
+                frames, self.padded_batch_size(len(frames)))
+        # the synchronous backend infers on starting while the asynchronous
+        # one does on waiting, the inference is the sum of both stages
+        with self._timer.time("infer_start"):
+            return self._backend.start_async(blob)
+
+    def wait_infer(self, handle, batch_size):
+        """
+        Wait for the inference started by start_infer() and return the
+        detections of each frame.
+        """
+        with self._timer.time("infer_wait"):
+            result = self._backend.wait(handle)
+        with self._timer.time("postprocess"):
+            return self.process_output(result, batch_size)
+
+    def infer_batch(self, frames):
+        """
+        Infer a batch of frames and return the detections of each frame.
+        """
+        return self.wait_infer(self.start_infer(frames), len(frames))
 
 class NNGeneralDetection(NNBase):
     """
     Generate detection with comon input and BB box output.
     """
 
-    def __init__(self, model_dir, model_name):
-        NNBase.__init__(self, model_dir, model_name)
+    def __init__(self, backend, threshold=0.5, top_k=0):
+        NNBase.__init__(self, backend, threshold, top_k)
@@ -0,0 +1,157 @@
+"""
+OpenVINO inference engine backend.
+
+The compiled model is cached under the cache directory when the IECore API
+supports CACHE_DIR, so the pods started later on same node skip compiling.
+The legacy IEPlugin API is used on the old releases without cache.
+"""
+import os
+import hashlib
+import logging
+import numpy as np
+import openvino.inference_engine as ie
+
+from clcn.nn.backend import InferBackendBase
+
+LOG = logging.getLogger(__name__)
+
+class OpenVinoBackend(InferBackendBase):
+    """
+    OpenVINO backend running the IR model on CPU plugin.
+    """
+
+    _DEFAULT_CPU_EXTENSION = "/usr/lib64/libcpu_extension.so"
+    _DEVICE = "CPU"
+
+    def __init__(self, model_dir, model_name,
+                 cpu_extension=_DEFAULT_CPU_EXTENSION, cache_dir=None):
+        InferBackendBase.__init__(self, model_dir, model_name)
+        self._cpu_extension = cpu_extension
+        self._cache_dir = cache_dir
+        self._cache_state = "none"
+        self._core = None
+        self._plugin = None
+        self._net = None
+        self._input_blob = None
+        self._output_blob = None
+        self._shape = None
+        self._num_requests = 1
+        # executable network and its free infer requests for each batch size
+        self._execs = {}
+        self._free_requests = {}
+
+    @property
+    def model_xml_path(self):
+        """
+        model file path
+        """
+        return self.model_path(".xml")
+
+    @property
+    def model_weight_path(self):
+        """
+        weight file path
+        """
+        return self.model_path(".bin")
+
+    @property
+    def cache_state(self):
+        """
+        State of compiled model cache: none, cold or warm
+        """
+        return self._cache_state
+
+    def _get_cache_path(self):
+        """
+        Cache path keyed by model name, device config and the model files, so
+        the models of different precision or version do not share cache.
+        """
+        digest = hashlib.sha1()
+        for path in [self.model_xml_path, self.model_weight_path]:
+            stat = os.stat(path)
+            digest.update(("%s:%d:%d" % (os.path.basename(path), stat.st_size,
+                                         stat.st_mtime)).encode("utf-8"))
+        digest.update(("%s:%s" % (self._DEVICE, self._cpu_extension)).encode(
+            "utf-8"))
+        return os.path.join(self._cache_dir, "%s-%s-%s" % (
+            self._model_name, self._DEVICE, digest.hexdigest()[:12]))
+
+    def _enable_cache(self):
+        cache_path = self._get_cache_path()
+        try:
+            self._core.set_config({"CACHE_DIR": cache_path}, self._DEVICE)
+        except RuntimeError:
+            LOG.warning("Model cache is not supported by this OpenVINO")
+            return
+        if os.path.isdir(cache_path) and len(os.listdir(cache_path)) != 0:
+            self._cache_state = "warm"
+        else:
+            self._cache_state = "cold"
+        LOG.info("Model cache (%s): %s", self._cache_state, cache_path)
+
+    def load(self, num_requests=1):
+        LOG.debug("Model XML: %s", self.model_xml_path)
+        LOG.debug("Model weight: %s", self.model_weight_path)
+
+        if hasattr(ie, "IECore") and hasattr(ie.IECore, "read_network"):
+            self._core = ie.IECore()
+            if os.path.exists(self._cpu_extension):
+                self._core.add_extension(self._cpu_extension, self._DEVICE)
+            if self._cache_dir:
+                self._enable_cache()
+            self._net = self._core.read_network(
+                model=self.model_xml_path, weights=self.model_weight_path)
+        else:
+            if self._cache_dir:
+                LOG.warning("Model cache is not supported by IEPlugin API")
+            self._plugin = ie.IEPlugin(device=self._DEVICE)
+            self._plugin.add_cpu_extension(self._cpu_extension)
+            self._net = ie.IENetwork(
+                model=self.model_xml_path, weights=self.model_weight_path)
+        self._input_blob = next(iter(self._net.inputs))
+        self._output_blob = next(iter(self._net.outputs))
+        self._num_requests = num_requests
+
+        self._shape = self._net.inputs[self._input_blob].shape
+        LOG.debug("Network input shape: %s", str(self._shape))
+        LOG.debug("Network output shape: %s",
+                  str(self._net.outputs[self._output_blob].shape))
+        return tuple(self._shape[1:])
+
+    def prepare(self, batch_size):
+        if batch_size not in self._execs:
+            LOG.info("Load network for batch size %d", batch_size)
+            if batch_size != self._shape[0]:
+                self._shape = [batch_size] + list(self._shape[1:])
+                self._net.reshape({self._input_blob: self._shape})
+            if self._core is not None:
+                self._execs[batch_size] = self._core.load_network(
+                    network=self._net, device_name=self._DEVICE,
+                    num_requests=self._num_requests)
+            else:
+                self._execs[batch_size] = self._plugin.load(
+                    network=self._net, num_requests=self._num_requests)
+            self._free_requests[batch_size] = list(range(self._num_requests))
+        return self._execs[batch_size]
+
+    def infer(self, blob):
+        res = self.prepare(blob.shape[0]).infer(
+            inputs={self._input_blob: blob})
+        return res[self._output_blob]
+
+    def start_async(self, blob):
+        batch_size = blob.shape[0]
+        exec_net = self.prepare(batch_size)
+        request_id = self._free_requests[batch_size].pop()
+        exec_net.start_async(request_id=request_id,
+                             inputs={self._input_blob: blob})
+        return batch_size, request_id
+
+    def wait(self, handle):
+        batch_size, request_id = handle
+        request = self._execs[batch_size].requests[request_id]
+        request.wait(-1)
+        # copy the output out since the request will be reused
+        output = np.copy(request.outputs[self._output_blob])
+        self._free_requests[batch_size].append(request_id)
+        return output
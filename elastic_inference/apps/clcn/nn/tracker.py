@@ -0,0 +1,117 @@
+"""
+Lightweight tracker to propagate detections over the frames skipped from
+inference.
+
+The detections of inferred frames are associated with the tracks of same
+stream by IOU, the box velocity of each track is measured per frame, so the
+boxes of the skipped frames are extrapolated from the last inferred frame.
+"""
+import numpy as np
+
+from clcn.nn.nn import DETECTION_DTYPE
+
+def iou_matrix(boxes_a, boxes_b):
+    """
+    IOU of each pair of boxes [xmin, ymin, xmax, ymax] from two arrays
+    """
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    inter = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(boxes_a[:, 2:] - boxes_a[:, :2], axis=1)
+    area_b = np.prod(boxes_b[:, 2:] - boxes_b[:, :2], axis=1)
+    union = area_a[:, None] + area_b[None, :] - inter
+    return inter / np.maximum(union, 1e-9)
+
+class StreamTracker:
+    """
+    Track the detections of a stream.
+    """
+
+    # min IOU to associate a detection with a track
+    _IOU_THRESHOLD = 0.3
+    # inferred frames to keep the track without any detection matched
+    _MAX_AGE = 2
+
+    def __init__(self):
+        self._tracks = np.empty(0, dtype=DETECTION_DTYPE)
+        self._velocities = np.empty((0, 4), dtype=np.float32)
+        self._ages = np.empty(0, dtype=np.int32)
+        self._sequence = None
+
+    @property
+    def sequence(self):
+        """
+        Sequence number of last inferred frame, None if there is no one
+        """
+        return self._sequence
+
+    def _match(self, detections):
+        """
+        Greedily associate the detections with the tracks of same class in
+        the order of IOU, return the pairs of track and detection index.
+        """
+        if len(self._tracks) == 0 or len(detections) == 0:
+            return []
+        iou = iou_matrix(self._tracks["box"], detections["box"])
+        iou[self._tracks["class_id"][:, None] !=
+            detections["class_id"][None, :]] = 0
+
+        pairs = []
+        used_tracks = set()
+        used_dets = set()
+        order = np.argsort(-iou, axis=None)
+        for track, det in zip(*np.unravel_index(order, iou.shape)):
+            if iou[track, det] < self._IOU_THRESHOLD:
+                break
+            if track in used_tracks or det in used_dets:
+                continue
+            used_tracks.add(track)
+            used_dets.add(det)
+            pairs.append((track, det))
+        return pairs
+
+    def _gap(self, sequence):
+        # frames since last inferred one, the sequence wraps around at 32 bits
+        # and the older frame has no gap
+        gap = (sequence - self._sequence) & 0xffffffff
+        return 0 if gap & 0x80000000 else gap
+
+    def update(self, detections, sequence):
+        """
+        Update the tracks by the detections of inferred frame
+        """
+        gap = 1
+        if self._sequence is not None:
+            gap = max(1, self._gap(sequence))
+
+        velocities = np.zeros((len(detections), 4), dtype=np.float32)
+        matched_tracks = np.zeros(len(self._tracks), dtype=bool)
+        for track, det in self._match(detections):
+            velocities[det] = (detections["box"][det] -
+                               self._tracks["box"][track]) / gap
+            matched_tracks[track] = True
+
+        # the unmatched tracks are kept for a while in case of miss detection
+        kept = ~matched_tracks & (self._ages < self._MAX_AGE)
+        kept_tracks = self._tracks[kept].copy()
+        kept_tracks["box"] += self._velocities[kept] * gap
+
+        self._tracks = np.concatenate([detections, kept_tracks])
+        self._velocities = np.concatenate([velocities,
+                                           self._velocities[kept]])
+        self._ages = np.concatenate([np.zeros(len(detections), np.int32),
+                                     self._ages[kept] + 1])
+        self._sequence = sequence
+
+    def predict(self, sequence):
+        """
+        Extrapolate the detections of skipped frame from the tracks matched
+        on last inferred frame.
+        """
+        alive = self._ages == 0
+        detections = self._tracks[alive].copy()
+        if self._sequence is not None:
+            gap = self._gap(sequence)
+            detections["box"] = np.clip(
+                detections["box"] + self._velocities[alive] * gap, 0, 1)
+        return detections
@@ -0,0 +1,203 @@
+"""
+Hot path instrumentation and on-demand profiling.
+
+StageTimer times the stages of a hot path like decode, inference and encode.
+The observations are buffered and flushed to the report function once a
+second, so the hot path only pays two clock reads for each stage.
+
+StackSampler samples the stacks of all threads for given seconds and writes
+them in collapsed format for flame graph tools. It is triggered by SIGUSR2 or
+by HTTP request on PROFILE_PORT, so a live pod could be profiled without
+restarting it. Unlike cProfile, it covers all threads of the process.
+
+  kill -USR2 <pid>
+  curl http://<pod>:<PROFILE_PORT>/profile?seconds=10
+"""
+import os
+import sys
+import time
+import signal
+import socket
+import logging
+import threading
+import contextlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+LOG = logging.getLogger(__name__)
+
+class StageTimer:
+    """
+    Time the stages of hot path and report the seconds of each stage.
+    """
+
+    # seconds between two flushes of buffered observations
+    _FLUSH_INTERVAL = 1
+
+    def __init__(self, report_fn=None):
+        self._report_fn = report_fn
+        self._lock = threading.Lock()
+        self._pending = []
+        self._flush_time = time.time()
+
+    @contextlib.contextmanager
+    def time(self, stage):
+        """
+        Time the code block as given stage
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def observe(self, stage, seconds):
+        """
+        Observe the seconds of a stage, the observations are reported as a
+        list of (stage, seconds) tuples once a second.
+        """
+        if self._report_fn is None:
+            return
+        observations = None
+        with self._lock:
+            self._pending.append((stage, seconds))
+            now = time.time()
+            if now - self._flush_time >= self._FLUSH_INTERVAL:
+                observations = self._pending
+                self._pending = []
+                self._flush_time = now
+        if observations is not None:
+            self._report_fn(observations)
+
+class StackSampler:
+    """
+    Sample the stacks of all threads and dump them in collapsed format, each
+    line is a stack from thread name to leaf function followed by the count.
+    """
+
+    # seconds between two samples
+    _INTERVAL = 0.005
+    # max seconds of one profiling
+    _MAX_SECONDS = 300
+
+    def __init__(self, out_dir="/tmp", interval=_INTERVAL):
+        self._out_dir = out_dir
+        self._interval = interval
+        self._running = threading.Lock()
+
+    def start(self, seconds):
+        """
+        Start sampling in background, return False if it is already running.
+        """
+        if self._running.locked():
+            LOG.warning("Profiling is already running")
+            return False
+        threading.Thread(target=self.sample, args=(seconds,),
+                         name="StackSampler", daemon=True).start()
+        return True
+
+    @staticmethod
+    def _format_frame(frame):
+        code = frame.f_code
+        return "%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename),
+                               code.co_firstlineno)
+
+    def _collect(self, seconds):
+        stacks = Counter()
+        sampler_id = threading.get_ident()
+        deadline = time.time() + min(seconds, self._MAX_SECONDS)
+        while time.time() < deadline:
+            names = {thread.ident: thread.name
+                     for thread in threading.enumerate()}
+            # pylint: disable=protected-access
+            for ident, frame in sys._current_frames().items():
+                if ident == sampler_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._format_frame(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                stacks[";".join(reversed(stack))] += 1
+            time.sleep(self._interval)
+        return stacks
+
+    def sample(self, seconds):
+        """
+        Sample for given seconds and return the path of dumped file, None if
+        it is already running.
+        """
+        if not self._running.acquire(blocking=False):   # pylint: disable=consider-using-with
+            return None
+        try:
+            LOG.info("Start profiling for %.1f seconds", seconds)
+            stacks = self._collect(seconds)
+            path = os.path.join(self._out_dir, "profile-%s-%d-%s.txt" % (
+                socket.gethostname(), os.getpid(),
+                time.strftime("%Y%m%d-%H%M%S")))
+            with open(path, "w", encoding="utf-8") as dump:
+                for stack, count in stacks.most_common():
+                    dump.write("%s %d\n" % (stack, count))
+            LOG.info("Profile is dumped to %s", path)
+            return path
+        finally:
+            self._running.release()
+
+class _ProfileRequestHandler(BaseHTTPRequestHandler):
+
+    sampler = None
+    seconds = 30
+
+    def do_GET(self):       # pylint: disable=invalid-name
+        """
+        Profile for ?seconds=N and respond the collapsed stacks.
+        """
+        url = urlparse(self.path)
+        if url.path != "/profile":
+            self.send_error(404)
+            return
+        try:
+            seconds = float(parse_qs(url.query).get(
+                "seconds", [self.seconds])[0])
+        except ValueError:
+            self.send_error(400, "seconds must be a number")
+            return
+        path = self.sampler.sample(seconds)
+        if path is None:
+            self.send_error(409, "Profiling is already running")
+            return
+        with open(path, "rb") as dump:
+            body = dump.read()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):   # pylint: disable=redefined-builtin
+        LOG.debug(format, *args)
+
+def install_profiler(out_dir="/tmp", seconds=30, port=0, on_signal=None):
+    """
+    Install the SIGUSR2 handler to profile for given seconds, and serve the
+    profiling on HTTP port if it is not 0. on_signal is called with the
+    signal number after starting profiling, for example to forward the
+    signal to worker processes.
+    """
+    sampler = StackSampler(out_dir)
+
+    def signal_handler(num, _):
+        sampler.start(seconds)
+        if on_signal is not None:
+            on_signal(num)
+
+    signal.signal(signal.SIGUSR2, signal_handler)
+    if port != 0:
+        handler = type("ProfileRequestHandler", (_ProfileRequestHandler,),
+                       {"sampler": sampler, "seconds": seconds})
+        server = ThreadingHTTPServer(("0.0.0.0", port), handler)
+        threading.Thread(target=server.serve_forever, name="ProfileServer",
+                         daemon=True).start()
+        LOG.info("Profiling is served on port %d", port)
+    return sampler
@@ -0,0 +1,48 @@
+"""
+Factory of frame queue backends.
+
+It is apart from the frame module, since the backends in their own modules
+are based on the frame queue defined there.
+"""
+import logging
+from .frame import RedisFrameQueue
+from .fairqueue import FairRedisFrameQueue
+from .streamqueue import RedisStreamFrameQueue
+
+LOG = logging.getLogger(__name__)
+
+class FrameQueueFactory:
+    """
+    Factory class for frame queue instance
+    """
+
+    @staticmethod
+    def get_queue(redis_conn, category, backend="list", *,
+                  stream_max_len=None, stream_max_lens=None, consumer=None,
+                  slot_size=None):
+        """
+        Get frame queue instance according to backend name. The fair backend
+        keeps up to stream_max_len frames for each stream, which could be
+        overridden for given streams via stream_max_lens dict. The stream
+        backend reads as consumer, which must be unique for each process and
+        defaults to the host name. The shm backend is created with slot_size
+        bytes for each frame by the first process opening it.
+        """
+        if backend == "shm":
+            # shared memory requires python 3.8, only import it on demand
+            from .shmqueue import SharedMemoryFrameQueue  # pylint: disable=import-outside-toplevel
+            if slot_size is None:
+                return SharedMemoryFrameQueue(category)
+            return SharedMemoryFrameQueue(category, slot_size=slot_size)
+        if backend == "stream":
+            return RedisStreamFrameQueue(redis_conn, category, consumer)
+        if backend == "fair":
+            if stream_max_len is None:
+                return FairRedisFrameQueue(
+                    redis_conn, category, stream_max_lens=stream_max_lens)
+            return FairRedisFrameQueue(redis_conn, category, stream_max_len,
+                                       stream_max_lens)
+        if backend != "list":
+            LOG.warning("%s is not a recoginized queue backend, use list.",
+                        backend)
+        return RedisFrameQueue(redis_conn, category)
@@ -0,0 +1,277 @@
+"""
+Shared memory based frame queue for single node deployment.
+
+When the stream services and the inference service run on the same edge node,
+the frames are passed via a ring buffer on shared memory instead of the redis
+list on loopback. The ring buffer has fixed size slots, its head and tail are
+protected by a file lock, and only a one byte notification is sent to the
+consumer via a unix socket for every frame.
+
+The ring buffer is not a lock-free single producer/single consumer one. Each
+stream service of the category is a producer and each inference worker is a
+consumer, and the producer moves the head forward to drop the oldest frame
+when the ring is full, so both indexes are written by both sides. Python has
+no atomic operation on shared memory either, so the head and tail are read
+and written under the file lock, which is held only for copying one frame.
+
+All services need share same /dev/shm, for example via "--ipc=host" and
+"-v /dev/shm:/dev/shm" for docker.
+"""
+import contextlib
+import fcntl
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+from multiprocessing import shared_memory, resource_tracker
+from .frame import FrameQueueBase
+
+LOG = logging.getLogger(__name__)
+
+class SharedMemoryFrameQueue(FrameQueueBase):
+    """
+    Shared memory ring buffer based frame queue implementation.
+
+    It keeps same overflow semantic as RedisFrameQueue, only newest _MAX_LEN
+    frames are kept for inference, and the older ones are counted as dropped.
+    """
+
+    _SHM_DIR = "/dev/shm"
+    _SLOT_COUNT = 64
+    _SLOT_SIZE = 256 * 1024
+    # max frames kept on queue, the older ones are dropped
+    _MAX_LEN = 32
+    # seconds to keep stream alive after its last frame
+    _STREAM_EXPIRE = 1
+
+    _MAGIC = b"EISQ"
+    # magic, slot count, slot size
+    _HEADER = struct.Struct("=4sII")
+    # head, tail, frames dropped on pushing
+    _STATE = struct.Struct("=QQQ")
+    _SLOT_HEADER = struct.Struct("=I")
+
+    def __init__(self, category="face", slot_count=_SLOT_COUNT,
+                 slot_size=_SLOT_SIZE):
+        FrameQueueBase.__init__(self, category)
+        self._slot_count = slot_count
+        self._slot_size = slot_size
+        self._thread_lock = threading.Lock()
+        self._lock_fd = os.open(self._path(".lock"), os.O_CREAT | os.O_RDWR)
+        self._shm = self._open_shm()
+        self._notify_sock = None
+        self._notify_bound = False
+
+    def _path(self, suffix):
+        return os.path.join(self._SHM_DIR, "ei_" + self.name + suffix)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        # flock is held by open file description, so the threads sharing the
+        # descriptor are serialized by the thread lock
+        with self._thread_lock:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _open_shm(self):
+        size = self._HEADER.size + self._STATE.size + \
+            self._slot_count * (self._SLOT_HEADER.size + self._slot_size)
+        with self._locked():
+            try:
+                shm = shared_memory.SharedMemory(
+                    name="ei_" + self.name, create=True, size=size)
+                self._HEADER.pack_into(shm.buf, 0, self._MAGIC,
+                                       self._slot_count, self._slot_size)
+                self._STATE.pack_into(shm.buf, self._HEADER.size, 0, 0, 0)
+                LOG.info("Create shared memory frame queue %s", shm.name)
+            except FileExistsError as exc:
+                shm = shared_memory.SharedMemory(name="ei_" + self.name)
+                magic, self._slot_count, self._slot_size = \
+                    self._HEADER.unpack_from(shm.buf, 0)
+                if magic != self._MAGIC:
+                    raise ValueError(
+                        "Invalid shared memory frame queue") from exc
+        # the queue should outlive the process, do not let the resource
+        # tracker unlink it when this process exits
+        resource_tracker.unregister(
+            shm._name, "shared_memory")     # pylint: disable=protected-access
+        return shm
+
+    def _read_state(self):
+        return self._STATE.unpack_from(self._shm.buf, self._HEADER.size)
+
+    def _write_state(self, head, tail, dropped):
+        self._STATE.pack_into(self._shm.buf, self._HEADER.size,
+                              head, tail, dropped)
+
+    def _slot_offset(self, index):
+        return self._HEADER.size + self._STATE.size + \
+            (index % self._slot_count) * \
+            (self._SLOT_HEADER.size + self._slot_size)
+
+    def _read_slot(self, index):
+        offset = self._slot_offset(index)
+        length, = self._SLOT_HEADER.unpack_from(self._shm.buf, offset)
+        offset += self._SLOT_HEADER.size
+        # copy out before unlock since the slot might be overwritten later
+        return bytes(self._shm.buf[offset:offset + length])
+
+    def _notify(self):
+        if self._notify_sock is None:
+            self._notify_sock = socket.socket(socket.AF_UNIX,
+                                              socket.SOCK_DGRAM)
+            self._notify_sock.setblocking(False)
+        try:
+            self._notify_sock.sendto(b"\0", self._path(".notify"))
+        except OSError:
+            # no consumer is waiting or its buffer is full
+            pass
+
+    def _bind_notify(self):
+        if self._notify_bound:
+            return self._notify_sock is not None
+        self._notify_bound = True
+
+        path = self._path(".notify")
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            sock.bind(path)
+        except OSError:
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            try:
+                probe.sendto(b"\0", path)
+                # another consumer is waiting on it, fall back to polling
+                LOG.info("Notification is taken by other consumer")
+                sock.close()
+                return False
+            except ConnectionRefusedError:
+                # stale socket left by a dead consumer
+                os.unlink(path)
+                sock.bind(path)
+            finally:
+                probe.close()
+        self._notify_sock = sock
+        return True
+
+    def _encode(self, msg):
+        # the header and payload are written into the slot one after another
+        # to skip copying the payload into one packet first
+        return msg.to_buffers()
+
+    def push_on_queuer(self, info, msg):
+        header, data = msg
+        length = len(header) + len(data)
+        with self._locked():
+            head, tail, dropped = self._read_state()
+            if length > self._slot_size:
+                # counted as dropped like the overflow ones, so the drop rate
+                # and scale ratio see the frames lost for the slot size
+                self._write_state(head, tail, dropped + 1)
+                LOG.error("Frame size %d exceeds the slot size %d",
+                          length, self._slot_size)
+                return
+            if tail - head >= self._slot_count:
+                head += 1
+                dropped += 1
+            offset = self._slot_offset(tail)
+            self._SLOT_HEADER.pack_into(self._shm.buf, offset, length)
+            offset += self._SLOT_HEADER.size
+            self._shm.buf[offset:offset + len(header)] = header
+            offset += len(header)
+            self._shm.buf[offset:offset + len(data)] = data
+            self._write_state(head, tail + 1, dropped)
+
+        # the modify time of alive file is the stream's last frame time
+        alive_path = self._path("." + info.name + ".alive")
+        try:
+            os.utime(alive_path)
+        except FileNotFoundError:
+            with open(alive_path, "a", encoding="utf-8"):
+                pass
+        self._notify()
+
+    def pop_on_queuer(self):
+        batch = self.pop_batch_on_queuer(1)
+        if len(batch) == 0:
+            return None
+        return batch[0]
+
+    def bpop_on_queuer(self, timeout):
+        is_notified = self._bind_notify()
+        deadline = time.time() + timeout
+        while True:
+            binary = self.pop_on_queuer()
+            remaining = deadline - time.time()
+            if binary is not None or remaining <= 0:
+                return binary
+            if is_notified:
+                self._notify_sock.settimeout(remaining)
+                try:
+                    self._notify_sock.recv(64)
+                except socket.timeout:
+                    pass
+            else:
+                time.sleep(min(remaining, 0.01))
+
+    def pop_batch_on_queuer(self, count):
+        batch, _ = self._pop_drop(count, False)
+        return batch
+
+    def pop_drop_on_queuer(self, count):
+        return self._pop_drop(count, True)
+
+    def drop_on_queuer(self):
+        _, drop_frame = self._pop_drop(0, True)
+        return drop_frame
+
+    def _pop_drop(self, count, is_drop):
+        batch = []
+        drop_frame = 0
+        with self._locked():
+            head, tail, dropped = self._read_state()
+            while len(batch) < count and head < tail:
+                batch.append(self._read_slot(head))
+                head += 1
+            if is_drop:
+                drop_frame = dropped
+                dropped = 0
+                if tail - head > self._MAX_LEN:
+                    drop_frame += tail - head - self._MAX_LEN
+                    head = tail - self._MAX_LEN
+            self._write_state(head, tail, dropped)
+        return batch, drop_frame
+
+    def depth_on_queuer(self):
+        with self._locked():
+            head, tail, _ = self._read_state()
+        return tail - head
+
+    def pushed_on_queuer(self):
+        # the tail only moves forward on pushing
+        _, tail, _ = self._read_state()
+        return tail
+
+    def is_stream_expired(self, info):
+        try:
+            last_time = os.path.getmtime(
+                self._path("." + info.name + ".alive"))
+        except FileNotFoundError:
+            return True
+        if time.time() - last_time > self._STREAM_EXPIRE:
+            LOG.debug("stream %s expired.", info.name)
+            return True
+        return False
+
+    def close(self):
+        """
+        Close the queue on this process, the shared memory is kept.
+        """
+        self._shm.close()
+        os.close(self._lock_fd)
+        if self._notify_sock is not None:
+            self._notify_sock.close()
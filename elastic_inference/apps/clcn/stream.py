@@ -6,6 +6,7 @@ will be published on stream broker for next step action such as displaying on
 stream dashboard or trigger FaaS actions.
 """
 import logging
+import struct
 import time
 from .appbase import CLCNTask
 
@@ -61,6 +62,105 @@ class StreamInfo:
             return None
         return StreamInfo(name, category, status)
 
+class StreamMessage:
+    """
+    A message published on stream broker, including the inferred frame and
+    the timestamps to trace its latency. The binary packet is a fixed header
+    followed by the payload:
+
+      magic(4) version(1) kind(1) sequence(4) capture timestamp(8)
+      publish timestamp(8)
+
+    The packet without the magic is treated as legacy raw JPEG frame. The
+    payload of detections kind is packed records of DETECTION, which are the
+    class id, score and box [xmin, ymin, xmax, ymax] relative to frame size.
+    """
+
+    KIND_JPEG = 0
+    KIND_DETECTIONS = 1
+
+    DETECTION = struct.Struct("<if4f")
+
+    _MAGIC = b"EISM"
+    _VERSION = 1
+    _HEADER = struct.Struct("!4sBBIdd")
+
+    def __init__(self, payload, kind=KIND_JPEG, sequence=0,
+                 capture_time=0, publish_time=0):
+        self._payload = payload
+        self._kind = kind
+        self._sequence = sequence
+        self._capture_time = capture_time
+        self._publish_time = publish_time
+
+    @property
+    def payload(self):
+        """
+        Message payload like JPEG frame
+        """
+        return self._payload
+
+    @property
+    def kind(self):
+        """
+        Kind of the payload
+        """
+        return self._kind
+
+    @property
+    def sequence(self):
+        """
+        Sequence number of origin frame within its stream
+        """
+        return self._sequence
+
+    @property
+    def capture_time(self):
+        """
+        Capture timestamp of origin frame, 0 for unknown
+        """
+        return self._capture_time
+
+    @property
+    def publish_time(self):
+        """
+        Timestamp of publishing on stream broker, 0 for unknown
+        """
+        return self._publish_time
+
+    def detections(self):
+        """
+        Unpack the detection records from payload as tuples of class id,
+        score, xmin, ymin, xmax, ymax
+        """
+        return list(self.DETECTION.iter_unpack(self._payload))
+
+    def to_binary(self):
+        """
+        Pack the message into binary packet
+        """
+        header = self._HEADER.pack(self._MAGIC, self._VERSION, self._kind,
+                                   self._sequence, self._capture_time,
+                                   self._publish_time)
+        return b"".join((header, self._payload))
+
+    @staticmethod
+    def from_binary(binary):
+        """
+        Decode the message from binary packet
+        """
+        view = memoryview(binary)
+        if view[:4] != StreamMessage._MAGIC:
+            return StreamMessage(binary)
+
+        _, version, kind, sequence, capture_time, publish_time = \
+            StreamMessage._HEADER.unpack_from(view)
+        if version != StreamMessage._VERSION:
+            LOG.error("Unsupported stream message version: %d", version)
+            return None
+        return StreamMessage(view[StreamMessage._HEADER.size:], kind,
+                             sequence, capture_time, publish_time)
+
 class StreamBrokerBase:
     """
     Stream broker base class.
@@ -94,6 +194,14 @@ class StreamBrokerBase:
         raise NotImplementedError(
             "inherited class must implement this function.")
 
+    def del_streams_on_broker(self, infos):
+        """
+        Delete streams on stream broker. The default one deletes the stream
+        one by one, inherited class could override it to save the round trips.
+        """
+        for info in infos:
+            self.del_stream_on_broker(info)
+
     # virtual function must be implemented by inherited class
     def publish_frame_on_broker(self, info, msg):
         """
@@ -160,12 +268,44 @@ class StreamBrokerBase:
         self.del_stream_on_broker(info)
         return True
 
+    def unregister_streams(self, infos):
+        """
+        Unregister several streams at once
+        """
+        removed = []
+        for info in infos:
+            LOG.debug("Unregister stream: %s", info.id)
+            if info.id not in list(self.streams):
+                LOG.error("Stream %s does not exist!", info.id)
+                continue
+            del self._streams[info.id]
+            removed.append(info)
+        if len(removed) != 0:
+            self.del_streams_on_broker(removed)
+        return len(removed)
+
     def publish(self, stream_info, frame_byte):
         """
         Publish a frame to stream broker
         """
         self.publish_frame_on_broker(stream_info, frame_byte)
 
+    def publish_batch(self, items):
+        """
+        Publish a batch of frames to stream broker, each item is a tuple of
+        (stream_info, frame_byte)
+        """
+        self.publish_frames_on_broker(items)
+
+    def publish_frames_on_broker(self, items):
+        """
+        Publish a batch of frames to stream broker. The default one publishes
+        the frame one by one, inherited class could override it to save the
+        round trips.
+        """
+        for info, msg in items:
+            self.publish_frame_on_broker(info, msg)
+
 class RedisStreamBroker(StreamBrokerBase):
     """
     Redis based stream broker.
@@ -248,8 +388,23 @@ class RedisStreamBroker(StreamBrokerBase):
         """
         self._redis.srem(self._KEY_STREAM_NAMES, info.id)
 
+    def del_streams_on_broker(self, infos):
+        """
+        Delete streams on broker via one command
+        """
+        self._redis.srem(self._KEY_STREAM_NAMES, *[info.id for info in infos])
+
     def publish_frame_on_broker(self, info, msg):
         """
         Publish stream on broker
         """
         self._redis.publish(info.id, msg)
+
+    def publish_frames_on_broker(self, items):
+        """
+        Publish a batch of frames on broker via one pipeline
+        """
+        pipe = self._redis.pipeline(transaction=False)
+        for info, msg in items:
+            pipe.publish(info.id, msg)
+        pipe.execute()
@@ -0,0 +1,308 @@
+"""
+Redis streams based frame queue.
+
+The frames are appended to a redis stream and read via one consumer group by
+all inference replicas of same category, so the frames held by a replica
+killed by HPA scale down are claimed by the other replicas instead of being
+lost.
+"""
+import logging
+import socket
+import threading
+import time
+import redis
+from .frame import FrameMessage, FrameQueueBase
+
+LOG = logging.getLogger(__name__)
+
+class RedisStreamFrameQueue(FrameQueueBase):
+    """
+    Redis streams based frame queue implementation.
+
+    All inference replicas of same category read the frames via one consumer
+    group, the delivered frame keeps pending until it is acknowledged after
+    publishing. So the frames held by a replica killed by HPA scale down can
+    be claimed and inferred by the other replicas instead of being lost.
+    """
+
+    _GROUP_NAME = "infer"
+    # approximate max length of the stream to bound the memory
+    _MAX_LEN = 1024
+    # max backlog frames to keep for consumer group like RedisFrameQueue
+    _MAX_BACKLOG = 32
+    # claim the frame pending on other consumer for longer than this
+    _CLAIM_IDLE_MS = 5000
+    _CLAIM_INTERVAL = 5
+
+    # remove the consumer without pending frames idle for longer than this
+    _DEAD_CONSUMER_MS = 60000
+
+    # Move consumer group's last delivered ID forward to keep only newest
+    # ARGV[2] frames for delivering, and return the number of skipped frames.
+    # The skipped ones are counted from the group's lag without reading them,
+    # only the server older than 7.0 without lag counts them by range.
+    _DROP_SCRIPT = """
+    local function id_before(left, right)
+        local lms, lseq = string.match(left, "(%d+)-(%d+)")
+        local rms, rseq = string.match(right, "(%d+)-(%d+)")
+        if tonumber(lms) ~= tonumber(rms) then
+            return tonumber(lms) < tonumber(rms)
+        end
+        return tonumber(lseq) < tonumber(rseq)
+    end
+
+    local last, entries_read, lag
+    for _, group in ipairs(redis.call("XINFO", "GROUPS", KEYS[1])) do
+        local info = {}
+        for i = 1, #group, 2 do info[group[i]] = group[i + 1] end
+        if info["name"] == ARGV[1] then
+            last = info["last-delivered-id"]
+            entries_read = info["entries-read"]
+            lag = info["lag"]
+        end
+    end
+    if last == nil then return 0 end
+
+    local keep = tonumber(ARGV[2])
+    if lag and entries_read and lag <= keep then return 0 end
+    local newest = redis.call("XREVRANGE", KEYS[1], "+", "-", "COUNT", keep + 1)
+    if #newest <= keep then return 0 end
+    local head = newest[#newest][1]
+
+    if lag and entries_read then
+        redis.call("XGROUP", "SETID", KEYS[1], ARGV[1], head,
+                   "ENTRIESREAD", entries_read + lag - keep)
+        return lag - keep
+    end
+
+    if not id_before(last, head) then return 0 end
+    local dropped = redis.call("XRANGE", KEYS[1], last, head)
+    local count = #dropped
+    if count > 0 and dropped[1][1] == last then count = count - 1 end
+    redis.call("XGROUP", "SETID", KEYS[1], ARGV[1], head)
+    return count
+    """
+
+    def __init__(self, redis_conn, category="face", consumer=None):
+        FrameQueueBase.__init__(self, category)
+        self._redis = redis_conn
+        if consumer is None:
+            consumer = socket.gethostname()
+        self._consumer = consumer
+        self._is_group_created = False
+        self._drop_script = self._redis.register_script(self._DROP_SCRIPT)
+        # the ids are tracked on popping thread and acknowledged on publishing
+        # thread of inference engine
+        self._ids_lock = threading.Lock()
+        self._pending_ids = []
+        self._lost_ids = []
+        self._reclaimed = []
+        self._reclaimed_count = 0
+        self._lost_count = 0
+        self._claim_time = 0
+        self._drop_time = 0
+
+    @property
+    def name(self):
+        return "xqueue_" + self._category
+
+    @property
+    def push_counter_name(self):
+        """
+        Name of the counter for all frames pushed
+        """
+        return self.name + "_pushed"
+
+    @property
+    def reclaimed(self):
+        """
+        Total number of frames claimed from dead consumers
+        """
+        return self._reclaimed_count
+
+    def _create_group(self):
+        if self._is_group_created:
+            return
+        try:
+            self._redis.xgroup_create(self.name, self._GROUP_NAME, id="$",
+                                      mkstream=True)
+            LOG.info("Create consumer group %s on %s",
+                     self._GROUP_NAME, self.name)
+        except redis.exceptions.ResponseError as err:
+            if "BUSYGROUP" not in str(err):
+                raise
+        self._is_group_created = True
+
+    def _unpack(self, entries):
+        items = []
+        for msg_id, fields in entries:
+            if msg_id is None:
+                continue
+            if not fields:
+                # the frame was trimmed before being claimed
+                with self._ids_lock:
+                    self._lost_ids.append(msg_id)
+                self._lost_count += 1
+                continue
+            if b"header" in fields:
+                items.append((msg_id, (fields[b"header"], fields[b"frame"])))
+            else:
+                # the whole packet pushed by the producer not upgraded yet
+                items.append((msg_id, fields[b"frame"]))
+        return items
+
+    def _deliver(self, items):
+        # track the delivered ones in order for acknowledging, the id stays
+        # with the frame till it is decoded
+        with self._ids_lock:
+            self._pending_ids += [msg_id for msg_id, _ in items]
+        return items
+
+    def _remove_dead_consumers(self):
+        # the frames pending on dead consumer are claimed before it is idle
+        # long enough to be removed
+        for item in self._redis.xinfo_consumers(self.name, self._GROUP_NAME):
+            consumer = item["name"]
+            if isinstance(consumer, bytes):
+                consumer = consumer.decode("utf-8")
+            if consumer != self._consumer and item["pending"] == 0 and \
+                item["idle"] >= self._DEAD_CONSUMER_MS:
+                self._redis.xgroup_delconsumer(self.name, self._GROUP_NAME,
+                                               consumer)
+                LOG.info("Remove dead consumer %s", consumer)
+
+    def _claim_pending(self):
+        now = time.time()
+        if now - self._claim_time < self._CLAIM_INTERVAL:
+            return
+        self._claim_time = now
+        self._remove_dead_consumers()
+
+        msg_ids = []
+        for item in self._redis.xpending_range(
+                self.name, self._GROUP_NAME, "-", "+", self._MAX_BACKLOG):
+            consumer = item["consumer"]
+            if isinstance(consumer, bytes):
+                consumer = consumer.decode("utf-8")
+            if consumer != self._consumer and \
+                item["time_since_delivered"] >= self._CLAIM_IDLE_MS:
+                msg_ids.append(item["message_id"])
+        if len(msg_ids) == 0:
+            return
+
+        entries = self._redis.xclaim(self.name, self._GROUP_NAME,
+                                     self._consumer, self._CLAIM_IDLE_MS,
+                                     msg_ids)
+        items = self._unpack(entries)
+        self._reclaimed += items
+        self._reclaimed_count += len(items)
+        LOG.info("Claimed %d pending frames from dead consumers", len(items))
+
+    def _encode(self, msg):
+        # the header and payload are sent as separate fields of the entry to
+        # skip copying the payload into one packet
+        return msg.to_buffers()
+
+    def _decode(self, binary):
+        msg_id, fields = binary
+        if isinstance(fields, tuple):
+            msg = FrameMessage.from_buffers(*fields)
+        else:
+            msg = FrameMessage.from_binary(fields)
+        if msg is None:
+            # the bad frame is counted as dropped and never acked by count,
+            # so it is acked along with the next batch like a lost one
+            with self._ids_lock:
+                self._pending_ids.remove(msg_id)
+                self._lost_ids.append(msg_id)
+        return msg
+
+    def push_on_queuer(self, info, msg):
+        self.push_batch_on_queuer(info, [msg])
+
+    def push_batch_on_queuer(self, info, msgs):
+        pipe = self._redis.pipeline(transaction=False)
+        for header, data in msgs:
+            pipe.xadd(self.name, {"header": header, "frame": data},
+                      maxlen=self._MAX_LEN, approximate=True)
+        pipe.incrby(self.push_counter_name, len(msgs))
+        pipe.setex(info.name + "_expire", "1", 2)
+        pipe.execute()
+
+    def pop_on_queuer(self):
+        batch = self.pop_batch_on_queuer(1)
+        if len(batch) == 0:
+            return None
+        return batch[0]
+
+    def bpop_on_queuer(self, timeout):
+        self._create_group()
+        ret = self._redis.xreadgroup(self._GROUP_NAME, self._consumer,
+                                     {self.name: ">"}, count=1,
+                                     block=max(1, int(timeout * 1000)))
+        if not ret:
+            return None
+        batch = self._deliver(self._unpack(ret[0][1]))
+        if len(batch) == 0:
+            return None
+        return batch[0]
+
+    def pop_batch_on_queuer(self, count):
+        self._create_group()
+        self._claim_pending()
+
+        # the claimed frames go first since they are older
+        items = self._reclaimed[:count]
+        del self._reclaimed[:count]
+        if len(items) < count:
+            ret = self._redis.xreadgroup(self._GROUP_NAME, self._consumer,
+                                         {self.name: ">"},
+                                         count=count - len(items))
+            if ret:
+                items += self._unpack(ret[0][1])
+        return self._deliver(items)
+
+    def drop_on_queuer(self):
+        self._create_group()
+        drop_frame = self._lost_count
+        self._lost_count = 0
+        # the backlog is trimmed on claim interval instead of every pop, it
+        # could exceed _MAX_BACKLOG in between
+        now = time.time()
+        if now - self._drop_time >= self._CLAIM_INTERVAL:
+            self._drop_time = now
+            drop_frame += self._drop_script(keys=[self.name],
+                                            args=[self._GROUP_NAME,
+                                                  self._MAX_BACKLOG])
+        return drop_frame
+
+    def pushed_on_queuer(self):
+        return int(self._redis.get(self.push_counter_name) or 0)
+
+    def ack_on_queuer(self, count=None):
+        with self._ids_lock:
+            if count is None:
+                count = len(self._pending_ids)
+            msg_ids = self._lost_ids + self._pending_ids[:count]
+            self._lost_ids = []
+            del self._pending_ids[:count]
+        if len(msg_ids) == 0:
+            return
+        self._redis.xack(self.name, self._GROUP_NAME, *msg_ids)
+
+    def is_stream_expired(self, info):
+        if not self._redis.exists(info.name + "_expire"):
+            LOG.debug("stream %s expired.", info.name)
+            return True
+        return False
+
+    def expired_streams(self, infos):
+        pipe = self._redis.pipeline(transaction=False)
+        for info in infos:
+            pipe.exists(info.name + "_expire")
+        expired = []
+        for info, exists in zip(infos, pipe.execute()):
+            if not exists:
+                LOG.debug("stream %s expired.", info.name)
+                expired.append(info)
+        return expired
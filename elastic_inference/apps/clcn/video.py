@@ -2,14 +2,17 @@
 Manage video stream input from webcam or file.
 
 Capture video frames from webcam or files, publish to frame queue according to
-inference type.
+inference type. Each frame is put on the output queue as a tuple of capture
+timestamp and JPEG data.
 """
 import os
 import logging
 import time
+import queue
 from random import randrange
 import cv2
 from .appbase import CLCNTask
+from .profiling import StageTimer
 
 LOG = logging.getLogger(__name__)
 
@@ -70,11 +73,14 @@ class WebCamCaptureTask(CLCNTask):
     WebCam caputure task.
     """
 
-    def __init__(self, cam_num, fps, out_frame_queue):
+    def __init__(self, cam_num, fps, out_frame_queue, *,
+                 report_overflow_fn=None, report_stage_fn=None):
         CLCNTask.__init__(self)
         self._device_name = "/dev/video%d" % cam_num
         self._camera = Camera(cam_num, fps=fps)
         self._out_frame_queue = out_frame_queue
+        self._report_overflow_fn = report_overflow_fn
+        self._timer = StageTimer(report_stage_fn)
         self._fps_start_time = 0
         self._fps_end_time = 0
         self._fps_no = 0
@@ -90,12 +96,22 @@ class WebCamCaptureTask(CLCNTask):
             return
 
         while not self.is_task_stopping:
-            ret, frame = self._camera.read()
+            with self._timer.time("capture"):
+                ret, frame = self._camera.read()
+            capture_time = time.time()
             if ret:
                 if self._out_frame_queue.full():
-                    self._out_frame_queue.get()
-                _, jpeg = cv2.imencode('.jpg', frame)
-                self._out_frame_queue.put_nowait(jpeg.tobytes())
+                    # evict the oldest frame for the local queue overflow, the
+                    # producer may have emptied the queue since the full check
+                    try:
+                        self._out_frame_queue.get_nowait()
+                        if self._report_overflow_fn is not None:
+                            self._report_overflow_fn()
+                    except queue.Empty:
+                        pass
+                with self._timer.time("encode"):
+                    _, jpeg = cv2.imencode('.jpg', frame)
+                self._out_frame_queue.put_nowait((capture_time, jpeg.data))
                 self._report_fps()
             else:
                 LOG.error("Fail to capture")
@@ -124,10 +140,13 @@ class VideoFileTask(CLCNTask):
     Video File task.
     """
 
-    def __init__(self, output_queue, filedir="/sample-videos",
-                 filename="classroom.mp4", fps=30, random=False):
+    def __init__(self, output_queue, *, filedir="/sample-videos",
+                 filename="classroom.mp4", fps=30, random=False,
+                 report_overflow_fn=None, report_stage_fn=None):
         CLCNTask.__init__(self)
         self._output_queue = output_queue
+        self._report_overflow_fn = report_overflow_fn
+        self._timer = StageTimer(report_stage_fn)
         self._filedir = filedir
         self._filename = os.path.join(filedir, filename)
         self._is_random = random
@@ -142,11 +161,14 @@ class VideoFileTask(CLCNTask):
 
         frame_counter = 0
         while not self.is_task_stopping and cap.isOpened():
-            ret, frame = cap.read()
-            frame = cv2.resize(frame, (320, 240))
+            with self._timer.time("read"):
+                ret, frame = cap.read()
+            capture_time = time.time()
             if not ret:
                 LOG.error("Fail to read video file.")
                 break
+            with self._timer.time("resize"):
+                frame = cv2.resize(frame, (320, 240))
 
             frame_counter += 1
             if frame_counter == cap.get(cv2.CAP_PROP_FRAME_COUNT):
@@ -154,10 +176,18 @@ class VideoFileTask(CLCNTask):
                 cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
 
             if self._output_queue.full():
-                self._output_queue.get()
-
-            _, jpeg = cv2.imencode('.jpg', frame)
-            self._output_queue.put_nowait(jpeg.tobytes())
+                # evict the oldest frame for the local queue overflow, the
+                # producer may have emptied the queue since the full check
+                try:
+                    self._output_queue.get_nowait()
+                    if self._report_overflow_fn is not None:
+                        self._report_overflow_fn()
+                except queue.Empty:
+                    pass
+
+            with self._timer.time("encode"):
+                _, jpeg = cv2.imencode('.jpg', frame)
+            self._output_queue.put_nowait((capture_time, jpeg.data))
             time.sleep(float(1/self._fps))
 
     def _get_random_video_file(self):
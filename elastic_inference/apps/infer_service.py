@@ -23,17 +23,25 @@ import sys
 import logging
 import signal
 import socket
+import queue
+import threading
+import multiprocessing
+from collections import Counter
 import redis
+import numpy as np
 import prometheus_client as prom
 
 # add current path into PYTHONPATH
 APP_PATH = os.path.dirname(__file__)
 sys.path.append(APP_PATH)
 
-from clcn.appbase import CLCNAppBase                        # pylint: disable=wrong-import-position
-from clcn.frame import RedisFrameQueue                      # pylint: disable=wrong-import-position
-from clcn.stream import RedisStreamBroker                   # pylint: disable=wrong-import-position
-from clcn.nn.inferengine import OpenVinoInferEngineTask     # pylint: disable=wrong-import-position
+from clcn.appbase import CLCNAppBase, CLCNTask              # pylint: disable=wrong-import-position
+from clcn.queuefactory import FrameQueueFactory             # pylint: disable=wrong-import-position
+from clcn.stream import RedisStreamBroker, StreamInfo       # pylint: disable=wrong-import-position
+from clcn.nn.inferengine import NNInferEngineTask, DetectionModel, \
+    EngineOptions, EngineReporters                          # pylint: disable=wrong-import-position
+from clcn.metrics import InferMetrics, ServiceRateRegistry  # pylint: disable=wrong-import-position
+from clcn.profiling import install_profiler                 # pylint: disable=wrong-import-position
 
 LOG = logging.getLogger(__name__)
 
@@ -53,6 +61,10 @@ class InferServiceApp(CLCNAppBase):
         LOG.info("Output broker host: %s", self.out_broker_host)
 
         self.infer_type = self.get_env("INFER_TYPE", "face")
+        # frame queue backend: list (default), fair or stream
+        self.queue_backend = self.get_env("QUEUE_BACKEND", "list")
+        # bytes of each frame slot on shm frame queue
+        self.queue_slot_size = int(self.get_env("QUEUE_SLOT_SIZE", "262144"))
         self.model_name = self.get_env("INFER_MODEL_NAME")
 
         # MODEL_PATH env got higher priority
@@ -65,6 +77,68 @@ class InferServiceApp(CLCNAppBase):
         LOG.info("model dir: %s", self.model_dir)
         LOG.info("model name: %s", self.model_name)
 
+        # inference backend: openvino (default), opencv or synthetic
+        self.infer_backend = self.get_env("INFER_BACKEND", "openvino")
+        self.backend_args = {}
+        if self.infer_backend in ["opencv", "synthetic"]:
+            # input size of model as WxH, openvino reads it from model
+            weight, height = self.get_env(
+                "INFER_INPUT_SIZE", "300x300").split("x")
+            self.backend_args["input_size"] = (int(weight), int(height))
+        if self.infer_backend == "openvino":
+            # directory to cache the compiled model, empty means no cache
+            self.backend_args["cache_dir"] = self.get_env(
+                "MODEL_CACHE_DIR", "")
+        if self.infer_backend == "synthetic":
+            self.backend_args["cost_ms"] = float(
+                self.get_env("SYNTHETIC_COST_MS", "10"))
+            self.backend_args["detections"] = int(
+                self.get_env("SYNTHETIC_DETECTIONS", "1"))
+
+        # min score and max number (0 means all) of detections for each frame
+        self.threshold = float(self.get_env("DETECTION_THRESHOLD", "0.5"))
+        self.top_k = int(self.get_env("DETECTION_TOP_K", "0"))
+
+        # output mode: frame (default), detection or overlay
+        self.output_mode = self.get_env("OUTPUT_MODE", "frame")
+
+        # the file is created once the model is warmed up for readiness probe
+        self.ready_file = self.get_env("READY_FILE", "/tmp/ei-ready")
+
+        # number of frames popped from queue and inferred in one batch
+        self.batch_size = int(self.get_env("INFER_BATCH_SIZE", "1"))
+        # batch sizes like "1,2,4,8" to prepare up front and pad batches to,
+        # and max milliseconds to wait for filling a batch
+        batch_sizes = self.get_env("INFER_BATCH_SIZES", "")
+        self.batch_sizes = [int(size) for size in batch_sizes.split(",")
+                            if size.strip() != ""]
+        self.max_wait_ms = int(self.get_env("BATCH_MAX_WAIT_MS", "0"))
+
+        # rate estimator: ewma (default) or window, over RATE_WINDOW seconds
+        # as EWMA half life or sliding window length
+        self.rate_estimator = self.get_env("RATE_ESTIMATOR", "ewma")
+        self.rate_window = float(self.get_env("RATE_WINDOW", "30"))
+        # number of inference requests kept in flight
+        self.infer_requests = int(self.get_env("INFER_REQUESTS", "1"))
+        # number of threads to decode and encode frames
+        self.decode_workers = int(self.get_env("DECODE_WORKERS", "1"))
+        self.encode_workers = int(self.get_env("ENCODE_WORKERS", "1"))
+        # max interval to infer one in every N frames of a stream under load,
+        # 1 means inferring every frame
+        self.max_skip = int(self.get_env("FRAME_SKIP_MAX", "1"))
+        # the stacks are sampled for PROFILE_SECONDS on SIGUSR2 or HTTP
+        # request on PROFILE_PORT (0 means disabled), dumped to PROFILE_DIR
+        self.profile_dir = self.get_env("PROFILE_DIR", "/tmp")
+        self.profile_seconds = float(self.get_env("PROFILE_SECONDS", "30"))
+        self.profile_port = int(self.get_env("PROFILE_PORT", "0"))
+
+        self._init_metrics()
+        self._init_workers()
+
+    def _init_metrics(self):
+        """
+        Create the prometheus metrics exported on port 8000.
+        """
         self._guage_infer_fps = prom.Gauge(
             'ei_infer_fps', 'Total infererence FPS')
 
@@ -72,30 +146,350 @@ class InferServiceApp(CLCNAppBase):
             'ei_drop_fps', 'Drop frames for infer')
 
         self._guage_scale_ratio = prom.Gauge(
-            'ei_scale_ratio', 'Scale ratio for inference, (ei_infer_fps+ei_drop_fps)/ei_infer_fps')
+            'ei_scale_ratio', 'Scale ratio for inference, '
+            '(ei_infer_fps+ei_skip_fps+ei_drop_fps)/ei_infer_fps')
+
+        self._guage_skip_fps = prom.Gauge(
+            'ei_skip_fps', 'Frames skipped from inference and tracked')
+
+        self._guage_queue_depth = prom.Gauge(
+            'ei_queue_depth', 'Frames waiting on frame queue', ['category'])
+        self._guage_arrival_fps = prom.Gauge(
+            'ei_arrival_fps', 'Frames arriving for inference, '
+            'ei_infer_fps+ei_skip_fps+ei_drop_fps', ['category'])
+        self._guage_service_fps = prom.Gauge(
+            'ei_service_fps', 'Estimated inference capacity, frames inferred '
+            'per busy second', ['category'])
+        self._counter_stream_infer = prom.Counter(
+            'ei_stream_infer_frames', 'Inferred frames for each stream',
+            ['category', 'stream'])
+
+        self._counter_stream_drop = prom.Counter(
+            'ei_stream_drop_frames', 'Drop frames for each stream',
+            ['category', 'stream'])
+        self._histogram_queue_wait = prom.Histogram(
+            'ei_queue_wait_seconds',
+            'Seconds from frame capture to being picked up from frame queue',
+            ['category', 'stream'])
+        self._histogram_infer_latency = prom.Histogram(
+            'ei_infer_latency_seconds',
+            'Seconds from frame picked up to inferred frame published',
+            ['category', 'stream'])
+        self._guage_startup_seconds = prom.Gauge(
+            'ei_startup_seconds',
+            'Seconds to load, compile and warm up the model',
+            ['cache'])
+        self._guage_ready = prom.Gauge(
+            'ei_ready', 'Whether the model is warmed up to infer frames')
+        self._histogram_batch_size = prom.Histogram(
+            'ei_batch_size', 'Frames collected in each inference batch',
+            ['category'], buckets=(1, 2, 4, 8, 16, 32, 64))
+        self._histogram_batch_wait = prom.Histogram(
+            'ei_batch_wait_seconds',
+            'Seconds waited for more frames after the first one of batch',
+            ['category'],
+            buckets=(.001, .002, .005, .01, .02, .05, .1, .2, .5))
+        self._summary_stage_seconds = prom.Summary(
+            'ei_stage_seconds',
+            'Seconds spent in each stage of inference hot path',
+            ['category', 'stage'])
+        self._counter_detected_objects = prom.Counter(
+            'ei_detected_objects', 'Detected objects for each class',
+            ['category', 'class_id'])
+
+    def _init_workers(self):
+        """
+        Set up the worker processes, their metrics are aggregated via queue.
+        """
+        # number of inference processes, each pinned to a subset of CPUs
+        self.infer_workers = int(self.get_env("INFER_WORKERS", "1"))
+        self._input_queue = None
+        self._rate_registry = None
+        self._metric_queue = None
+        self._workers = []
 
     def run(self):
+        # the service rate of this pod is shared with the queue exporter
+        self._rate_registry = ServiceRateRegistry(
+            redis.StrictRedis(self.in_queue_host), self.infer_type)
+        if self.infer_workers <= 1:
+            install_profiler(self.profile_dir, self.profile_seconds,
+                             self.profile_port)
+            prom.start_http_server(8000)
+            infer_task = self._start_infer_task(EngineReporters(
+                self._report_metric, self._report_latency,
+                self._report_detection, self._report_batch,
+                self._report_stages))
+            self._report_startup(infer_task.model_cache,
+                                 infer_task.startup_seconds)
+            self._set_ready()
+            return
+
+        # fork the workers before starting any thread in this process
+        self._metric_queue = multiprocessing.Queue()
+        cpus = sorted(os.sched_getaffinity(0))
+        for index in range(self.infer_workers):
+            worker = multiprocessing.Process(
+                target=self._run_worker,
+                args=(index, self._get_worker_cpus(cpus, index)),
+                daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+        # SIGUSR2 is forwarded to the workers to profile them as well
+        install_profiler(self.profile_dir, self.profile_seconds,
+                         self.profile_port, self._forward_signal)
+        prom.start_http_server(8000)
+        CLCNTask(name="MetricAggregator",
+                 exec_func=self._aggregate_metrics).start()
+
+    def stop(self):
+        for worker in self._workers:
+            worker.terminate()
+            worker.join()
+        CLCNAppBase.stop(self)
+
+    def _forward_signal(self, num):
+        for worker in self._workers:
+            if worker.is_alive():
+                os.kill(worker.pid, num)
+
+    def _start_infer_task(self, reporters, consumer=None):
         in_redis_conn = redis.StrictRedis(self.in_queue_host)
         out_redis_conn = in_redis_conn
         if self.in_queue_host != self.out_broker_host:
             out_redis_conn = redis.StrictRedis(self.out_broker_host)
 
-        input_queue = RedisFrameQueue(in_redis_conn, self.infer_type)
+        input_queue = FrameQueueFactory.get_queue(
+            in_redis_conn, self.infer_type, self.queue_backend,
+            consumer=consumer, slot_size=self.queue_slot_size)
         out_broker = RedisStreamBroker(out_redis_conn)
         out_broker.start_streams_monitor_task()
 
-        infer_task = OpenVinoInferEngineTask(input_queue, out_broker,
-                                             self._report_metric,
-                                             model_dir=self.model_dir,
-                                             model_name=self.model_name)
+        model = DetectionModel(self.model_dir, self.model_name,
+                               self.infer_backend, self.backend_args,
+                               self.threshold, self.top_k)
+        options = EngineOptions(
+            batch_size=self.batch_size, batch_sizes=self.batch_sizes,
+            max_wait_ms=self.max_wait_ms, infer_requests=self.infer_requests,
+            decode_workers=self.decode_workers,
+            encode_workers=self.encode_workers, output_mode=self.output_mode,
+            max_skip=self.max_skip, rate_estimator=self.rate_estimator,
+            rate_window=self.rate_window)
+        infer_task = NNInferEngineTask(input_queue, out_broker, model,
+                                       options, reporters)
 
+        self._input_queue = input_queue
         infer_task.start()
-        prom.start_http_server(8000)
+        return infer_task
+
+    def _get_worker_cpus(self, cpus, index):
+        """
+        Split the CPUs into contiguous subsets, one for each worker.
+        """
+        count = len(cpus)
+        if self.infer_workers >= count:
+            return [cpus[index % count]]
+        return cpus[index * count // self.infer_workers:
+                    (index + 1) * count // self.infer_workers]
+
+    def _run_worker(self, index, cpus):
+        """
+        Entry of worker process, the metrics are sent back to parent process.
+        """
+        # the worker list is inherited from parent, do not stop the siblings
+        self._workers = []
+        os.sched_setaffinity(0, cpus)
+        LOG.info("Infer worker %d is pinned to CPU %s", index, cpus)
+        install_profiler(self.profile_dir, self.profile_seconds)
+
+        # the observations are buffered and sent along with the rates once
+        # a report interval, instead of a message for each frame
+        lock = threading.Lock()
+        latencies = []
+        detected = {}
+        batches = []
+
+        def report_metric(metrics):
+            with lock:
+                observations = (list(latencies), dict(detected), list(batches))
+                latencies.clear()
+                detected.clear()
+                batches.clear()
+            self._metric_queue.put(
+                ("metric", index, metrics,
+                 self._input_queue.collect_stream_drops(), observations))
+
+        def report_latency(info, queue_wait, infer_latency):
+            with lock:
+                latencies.append((info.name, info.category, queue_wait,
+                                  infer_latency))
+
+        def report_detection(info, detections):
+            if len(detections) != 0:
+                counts = self._count_detections(detections)
+                with lock:
+                    detected.setdefault(info.category, Counter()).update(
+                        counts)
+
+        def report_batch(batch_size, batch_wait):
+            with lock:
+                batches.append((batch_size, batch_wait))
+
+        def report_stages(observations):
+            self._metric_queue.put(("stage", observations))
+
+        # each worker reads stream frame queue as its own consumer, so the
+        # frames pending on a crashed sibling are claimed by the others
+        infer_task = self._start_infer_task(
+            EngineReporters(report_metric, report_latency, report_detection,
+                            report_batch, report_stages),
+            "%s-%d" % (socket.gethostname(), index))
+        self._metric_queue.put(("startup", index, infer_task.model_cache,
+                                infer_task.startup_seconds))
+        CLCNTask.wait_all_tasks_end()
+
+    def _aggregate_metrics(self, task):
+        """
+        Task entry to aggregate the metrics from all workers.
+        """
+        worker_metrics = {}
+        started_workers = set()
+        while not task.is_task_stopping:
+            for index, worker in enumerate(self._workers):
+                if not worker.is_alive():
+                    LOG.error("Infer worker %d exited with code %s",
+                              index, worker.exitcode)
+                    CLCNTask.stop_all_tasks()
+                    return
+
+            try:
+                item = self._metric_queue.get(timeout=1)
+            except queue.Empty:
+                continue
+
+            if item[0] == "startup":
+                _, index, model_cache, startup_seconds = item
+                self._report_startup(model_cache, startup_seconds)
+                started_workers.add(index)
+                # ready once all workers are warmed up
+                if len(started_workers) == len(self._workers):
+                    self._set_ready()
+                continue
+
+            if item[0] == "stage":
+                self._report_stages(item[1])
+                continue
+
+            _, index, metrics, stream_drops, observations = item
+            worker_metrics[index] = metrics
+            self._count_stream_drops(stream_drops)
+            self._count_stream_frames(metrics.stream_frames)
+            self._set_metric(self._sum_metrics(worker_metrics.values()))
+            self._report_observations(*observations)
+
+    def _report_observations(self, latencies, detected, batches):
+        """
+        Report the observations buffered by a worker since its last report.
+        """
+        for name, category, queue_wait, infer_latency in latencies:
+            self._report_latency(StreamInfo(name, category), queue_wait,
+                                 infer_latency)
+        for category, counts in detected.items():
+            self._count_detected_objects(category, counts)
+        for batch_size, batch_wait in batches:
+            self._report_batch(batch_size, batch_wait)
+
+    @staticmethod
+    def _sum_metrics(worker_metrics):
+        """
+        Sum the rates of workers, the scale ratio is the total arrival rate
+        over the total capacity. The workers share the same frame queue, so
+        its depth is the latest known one.
+        """
+        worker_metrics = list(worker_metrics)
+        arrival_fps = sum(metrics.arrival_fps for metrics in worker_metrics)
+        service_fps = sum(metrics.service_fps for metrics in worker_metrics)
+        scale_ratio = 0
+        if service_fps > 0:
+            scale_ratio = arrival_fps / service_fps
+        depths = [metrics.queue_depth for metrics in worker_metrics
+                  if metrics.queue_depth is not None]
+        return InferMetrics(
+            sum(metrics.infer_fps for metrics in worker_metrics),
+            sum(metrics.drop_fps for metrics in worker_metrics),
+            sum(metrics.skip_fps for metrics in worker_metrics),
+            arrival_fps, service_fps, scale_ratio,
+            depths[-1] if len(depths) != 0 else None, {})
+
+    def _set_metric(self, metrics):
+        self._guage_infer_fps.set(metrics.infer_fps)
+        self._guage_drop_fps.set(metrics.drop_fps)
+        self._guage_skip_fps.set(metrics.skip_fps)
+        self._guage_scale_ratio.set(metrics.scale_ratio)
+        self._guage_arrival_fps.labels(self.infer_type).set(
+            metrics.arrival_fps)
+        self._guage_service_fps.labels(self.infer_type).set(
+            metrics.service_fps)
+        if metrics.queue_depth is not None:
+            self._guage_queue_depth.labels(self.infer_type).set(
+                metrics.queue_depth)
+        self._rate_registry.report(socket.gethostname(), metrics)
+
+    def _count_stream_frames(self, stream_frames):
+        for stream, infer_frame in stream_frames.items():
+            self._counter_stream_infer.labels(
+                self.infer_type, stream).inc(infer_frame)
+
+    def _count_stream_drops(self, stream_drops):
+        for stream, drop_frame in stream_drops.items():
+            self._counter_stream_drop.labels(
+                self.infer_type, stream).inc(drop_frame)
+
+    def _report_metric(self, metrics):
+        self._set_metric(metrics)
+        self._count_stream_drops(self._input_queue.collect_stream_drops())
+        self._count_stream_frames(metrics.stream_frames)
+
+    def _report_startup(self, model_cache, startup_seconds):
+        self._guage_startup_seconds.labels(model_cache).set(startup_seconds)
+
+    def _set_ready(self):
+        with open(self.ready_file, "w", encoding="utf-8"):
+            pass
+        self._guage_ready.set(1)
+
+    @staticmethod
+    def _count_detections(detections):
+        class_ids, counts = np.unique(detections["class_id"],
+                                      return_counts=True)
+        return dict(zip(class_ids.tolist(), counts.tolist()))
+
+    def _count_detected_objects(self, category, counts):
+        for class_id, count in counts.items():
+            self._counter_detected_objects.labels(
+                category, str(class_id)).inc(count)
+
+    def _report_detection(self, info, detections):
+        if len(detections) != 0:
+            self._count_detected_objects(
+                info.category, self._count_detections(detections))
+
+    def _report_batch(self, batch_size, batch_wait):
+        self._histogram_batch_size.labels(self.infer_type).observe(batch_size)
+        self._histogram_batch_wait.labels(self.infer_type).observe(batch_wait)
+
+    def _report_stages(self, observations):
+        for stage, seconds in observations:
+            self._summary_stage_seconds.labels(
+                self.infer_type, stage).observe(seconds)
 
-    def _report_metric(self, infer_fps, drop_fps, scale_ratio):
-        self._guage_infer_fps.set(infer_fps)
-        self._guage_drop_fps.set(drop_fps)
-        self._guage_scale_ratio.set(scale_ratio)
+    def _report_latency(self, info, queue_wait, infer_latency):
+        if queue_wait is not None:
+            self._histogram_queue_wait.labels(
+                info.category, info.name).observe(queue_wait)
+        self._histogram_infer_latency.labels(
+            info.category, info.name).observe(infer_latency)
 
 def start_app():
     """
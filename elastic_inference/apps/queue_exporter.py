@@ -0,0 +1,185 @@
+#!/usr/bin/python3
+"""
+Queue Exporter.
+
+It samples the frame queue of each inference category and the service rate
+reported by each inference pod, then computes the desired replicas of the
+category from queueing model for HPA.
+
+  +---------------------+    +----------------+    +--------------------+
+  | Frame Queue (redis) | => | Queue Exporter | => | Desired replicas   |
+  | Service rates       |    +----------------+    | (prometheus)       |
+  +---------------------+                          +--------------------+
+
+Each inference pod only sees its own frames, while the exporter sees the
+total arrival rate from all producers and the backlog on queue, so the
+category is scaled up once the arrival rate exceeds the capacity, before the
+frames are dropped.
+"""
+import logging
+import signal
+import time
+import os
+import sys
+import redis
+import prometheus_client as prom
+
+# add current path into PYTHONPATH
+APP_PATH = os.path.dirname(__file__)
+sys.path.append(APP_PATH)
+
+from clcn.appbase import CLCNAppBase, CLCNTask  # pylint: disable=wrong-import-position
+from clcn.queuefactory import FrameQueueFactory # pylint: disable=wrong-import-position
+from clcn.metrics import RateEstimatorFactory, ServiceRateRegistry, desired_replicas # pylint: disable=wrong-import-position
+
+LOG = logging.getLogger(__name__)
+
+class CategorySampler:
+    """
+    Sample the frame queue and service rates of an inference category.
+    """
+
+    def __init__(self, redis_conn, category, backend, estimator, window):
+        self._category = category
+        self._queue = FrameQueueFactory.get_queue(redis_conn, category,
+                                                  backend)
+        self._registry = ServiceRateRegistry(redis_conn, category)
+        self._arrival = RateEstimatorFactory.get_estimator(estimator, window)
+        self._last_pushed = None
+
+    @property
+    def category(self):
+        """
+        Inference category
+        """
+        return self._category
+
+    def sample(self, now):
+        """
+        Sample the queue depth, arrival rate and service rate of each pod.
+        """
+        pushed = self._queue.pushed()
+        if pushed is not None:
+            if self._last_pushed is not None:
+                # the counter restarts from 0 if redis is restarted
+                self._arrival.add(max(0, pushed - self._last_pushed), now)
+            self._last_pushed = pushed
+        return self._queue.depth(), self._arrival.rate(now), \
+            self._registry.collect(now)
+
+class QueueExporterApp(CLCNAppBase):
+    """
+    Queue Exporter
+    """
+
+    def init(self):
+        self._redis_host = self.get_env("QUEUE_HOST", "127.0.0.1")
+        self._redis_port = int(self.get_env("QUEUE_PORT", "6379"))
+        self._queue_backend = self.get_env("QUEUE_BACKEND", "list")
+        self._categories = [
+            category.strip() for category in self.get_env(
+                "INFER_CATEGORIES",
+                "people,face-int8,face-fp32,car-int8,car-fp32").split(",")
+            if category.strip() != ""]
+        # seconds between two samples
+        self._interval = float(self.get_env("SAMPLE_INTERVAL", "5"))
+        # rate estimator (ewma or window) over RATE_WINDOW seconds
+        self._rate_estimator = self.get_env("RATE_ESTIMATOR", "ewma")
+        self._rate_window = float(self.get_env("RATE_WINDOW", "30"))
+        # targets of the queueing model
+        self._target_utilization = float(
+            self.get_env("TARGET_UTILIZATION", "0.8"))
+        self._target_wait = float(self.get_env("TARGET_QUEUE_WAIT", "0.5"))
+        self._drain_seconds = float(self.get_env("BACKLOG_DRAIN_SECONDS",
+                                                 "10"))
+        self._min_replicas = int(self.get_env("MIN_REPLICAS", "1"))
+        self._max_replicas = int(self.get_env("MAX_REPLICAS", "16"))
+        self._metrics_port = int(self.get_env("METRICS_PORT", "8000"))
+
+        LOG.info("Categories: %s", self._categories)
+        LOG.info("Target utilization: %.2f, queue wait: %.2f seconds",
+                 self._target_utilization, self._target_wait)
+
+        self._guage_queue_length = prom.Gauge(
+            'ei_queue_length', 'Frames waiting on frame queue',
+            ['category'])
+        self._guage_arrival_fps = prom.Gauge(
+            'ei_queue_arrival_fps', 'Frames pushed by all producers',
+            ['category'])
+        self._guage_service_fps = prom.Gauge(
+            'ei_pod_service_fps', 'Mean service rate of inference pods '
+            'with known capacity', ['category'])
+        self._guage_pods = prom.Gauge(
+            'ei_reporting_pods', 'Inference pods reporting known service '
+            'rate', ['category'])
+        self._guage_desired_replicas = prom.Gauge(
+            'ei_desired_replicas', 'Desired inference replicas computed '
+            'from M/M/c queueing model', ['category'])
+
+    def run(self):
+        redis_conn = redis.StrictRedis(self._redis_host, self._redis_port)
+        samplers = [CategorySampler(redis_conn, category, self._queue_backend,
+                                    self._rate_estimator, self._rate_window)
+                    for category in self._categories]
+        prom.start_http_server(self._metrics_port)
+        CLCNTask(name="QueueSampler",
+                 exec_func=lambda task: self._sample(task, samplers)).start()
+
+    def _sample(self, task, samplers):
+        """
+        Task entry to sample all categories periodically.
+        """
+        while not task.is_task_stopping:
+            now = time.time()
+            for sampler in samplers:
+                self._export(sampler, now)
+            time.sleep(max(0, self._interval - (time.time() - now)))
+
+    def _export(self, sampler, now):
+        category = sampler.category
+        depth, arrival_fps, pod_rates = sampler.sample(now)
+        backlog = depth or 0
+        self._guage_queue_length.labels(category).set(backlog)
+        self._guage_arrival_fps.labels(category).set(arrival_fps)
+        self._guage_pods.labels(category).set(len(pod_rates))
+        if len(pod_rates) == 0:
+            # keep the desired replicas till any pod reports its capacity
+            LOG.debug("[%s] no service rate reported", category)
+            return
+
+        service_fps = sum(pod_rates.values()) / len(pod_rates)
+        self._guage_service_fps.labels(category).set(service_fps)
+        replicas = desired_replicas(
+            arrival_fps, service_fps, backlog,
+            target_utilization=self._target_utilization,
+            target_wait=self._target_wait,
+            drain_seconds=self._drain_seconds,
+            max_replicas=self._max_replicas)
+        if replicas is None:
+            return
+        replicas = min(self._max_replicas, max(self._min_replicas, replicas))
+        LOG.debug("[%s] arrival: %.2f FPS, service: %.2f FPS, backlog: %d, "
+                  "desired replicas: %d", category, arrival_fps, service_fps,
+                  backlog, replicas)
+        self._guage_desired_replicas.labels(category).set(replicas)
+
+def start_app():
+    """
+    App entry
+    """
+    app = QueueExporterApp()
+
+    def signal_handler(num, _):
+        LOG.error("signal %d", num)
+        app.stop()
+        sys.exit(1)
+
+    # setup the signal handler
+    signames = ['SIGINT', 'SIGHUP', 'SIGQUIT', 'SIGUSR1']
+    for name in signames:
+        signal.signal(getattr(signal, name), signal_handler)
+
+    app.run_and_wait_task()
+
+if __name__ == "__main__":
+    start_app()
@@ -7,14 +7,34 @@ publish the streams to HTML5 based front-end SPA(Single Page Application).
 
 It is based on aysncio and coroutine programming model since most of operations
 are IO bound.
+
+The inferred frame is sent as binary JPEG, while the detections are sent as
+JSON text like below, so the front-end could overlay the boxes on frame.
+
+  {"sequence": 12, "detections": [[class_id, score, xmin, ymin, xmax, ymax]]}
+
+The latency from broker to websocket and the end to end latency from capture
+to websocket are exported as prometheus histograms, and the seconds spent in
+parsing and sending each message as prometheus summary.
 """
 import os
+import sys
+import time
+import json
 import asyncio
 import logging
 import signal
 import aioredis
 import websockets
 import websockets.exceptions
+import prometheus_client as prom
+
+APP_PATH = os.path.dirname(__file__)
+sys.path.append(APP_PATH)
+
+from clcn.stream import StreamInfo, StreamMessage   # pylint: disable=wrong-import-position
+from clcn.profiling import StageTimer, install_profiler # pylint: disable=wrong-import-position
+
 LOG = logging.getLogger(__name__)
 
 STREAM_WEBSOCKET_PORT = 31611
@@ -29,8 +49,31 @@ class StreamWebSocketServer:
             "STREAM_BROKER_REDIS_HOST", "127.0.0.1")
         self._stream_broker_redis_port = int(self._get_env(
             "STREAM_BROKER_REDIS_PORT", "6379"))
+        self._metrics_port = int(self._get_env("METRICS_PORT", "8000"))
+        # the stacks are sampled for PROFILE_SECONDS on SIGUSR2 or HTTP
+        # request on PROFILE_PORT (0 means disabled), dumped to PROFILE_DIR
+        self._profile_dir = self._get_env("PROFILE_DIR", "/tmp")
+        self._profile_seconds = float(self._get_env("PROFILE_SECONDS", "30"))
+        self._profile_port = int(self._get_env("PROFILE_PORT", "0"))
         self._streams = {}
         self._users = {}
+        self._histogram_delivery_latency = prom.Histogram(
+            'ei_ws_delivery_latency_seconds',
+            'Seconds from publishing on broker to receiving on websocket '
+            'server',
+            ['category', 'stream'])
+        self._histogram_e2e_latency = prom.Histogram(
+            'ei_e2e_latency_seconds',
+            'Seconds from frame capture to receiving on websocket server',
+            ['category', 'stream'])
+        self._summary_stage_seconds = prom.Summary(
+            'ei_ws_stage_seconds',
+            'Seconds spent in each stage of websocket hot path', ['stage'])
+        self._timer = StageTimer(self._report_stages)
+
+    def _report_stages(self, observations):
+        for stage, seconds in observations:
+            self._summary_stage_seconds.labels(stage).observe(seconds)
 
     @staticmethod
     def _get_env(key, default=None):
@@ -100,8 +143,32 @@ class StreamWebSocketServer:
             read_obj.close()
         LOG.info("Task stream status monitor task stop.")
 
+    def _observe_latency(self, info, stream_msg):
+        now = time.time()
+        if stream_msg.publish_time > 0:
+            self._histogram_delivery_latency.labels(
+                info.category, info.name).observe(
+                    now - stream_msg.publish_time)
+        if stream_msg.capture_time > 0:
+            self._histogram_e2e_latency.labels(
+                info.category, info.name).observe(
+                    now - stream_msg.capture_time)
+
+    @staticmethod
+    def _to_payload(stream_msg):
+        """
+        Payload sent to the users, the JPEG as is or the detections in JSON.
+        """
+        if stream_msg.kind != StreamMessage.KIND_DETECTIONS:
+            return bytes(stream_msg.payload)
+        return json.dumps({
+            "sequence": stream_msg.sequence,
+            "detections": [[det[0]] + [round(val, 4) for val in det[1:]]
+                           for det in stream_msg.detections()]})
+
     async def _stream_publish_task(self, sid):
         LOG.info("stream publish task start: %s", sid)
+        info = StreamInfo.from_id(sid)
         stream_sub_obj = await aioredis.create_redis(
             (self._stream_broker_redis_host,
              self._stream_broker_redis_port))
@@ -113,6 +180,14 @@ class StreamWebSocketServer:
             if msg is None:
                 break
             if isinstance(msg, bytes):
+                with self._timer.time("parse"):
+                    stream_msg = StreamMessage.from_binary(msg)
+                    if stream_msg is None:
+                        continue
+                    payload = self._to_payload(stream_msg)
+                # observed once for each frame however many users watch it
+                if info is not None:
+                    self._observe_latency(info, stream_msg)
                 for user in list(self._users.keys()):
                     if user not in self._users:
                         continue
@@ -120,7 +195,10 @@ class StreamWebSocketServer:
                         continue
 
                     try:
-                        await user.send(msg)
+                        # the await yields to other coroutines and waits for
+                        # the client, so it is not the cost of sending alone
+                        with self._timer.time("send_await"):
+                            await user.send(payload)
                     except websockets.exceptions.ConnectionClosedOK:
                         LOG.error("[%s] fail to send due to websocket exception [cc_ok]",
                                   sid)
@@ -162,6 +240,9 @@ class StreamWebSocketServer:
                 lambda sigobj=sigobj: asyncio.create_task(
                     self._shutdown(sigobj, loop)))
 
+        install_profiler(self._profile_dir, self._profile_seconds,
+                         self._profile_port)
+        prom.start_http_server(self._metrics_port)
         try:
             loop.create_task(self._stream_status_monitor_task())
             loop.create_task(self._start_ws_server())
@@ -0,0 +1,544 @@
+#!/usr/bin/python3
+"""
+Benchmark the whole pipeline from stream producers to websocket clients.
+
+N synthetic streams produce JPEG frames at given FPS into the frame queue via
+FrameQueueProduceTask, the inference engine infers them on synthetic backend
+and publishes them on the redis stream broker, and optionally websocket
+clients receive them from the websocket server. The redis is a local
+redis-server started for the run, or fakeredis in process when the server is
+not installed, or an existing one given as host:port. fakeredis does not
+block on XREADGROUP, so the stream backend and websocket clients need a real
+redis.
+
+The throughput, drop rate, latency percentiles and redis round trips per
+frame are reported for each stream count as JSON lines. With --baseline, the
+relative changes against the results of a previous run are reported as well.
+
+  ./bench_e2e.py -s 1,4,8 -f 15 -d 30 > baseline.json
+  ./bench_e2e.py -s 1,4,8 -f 15 -d 30 --baseline baseline.json
+"""
+import os
+import sys
+import json
+import time
+import queue
+import shutil
+import socket
+import asyncio
+import argparse
+import threading
+import subprocess
+import urllib.request
+import numpy as np
+import cv2
+import redis
+from prometheus_client.parser import text_string_to_metric_families
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "apps"))
+
+from clcn.appbase import CLCNTask                   # pylint: disable=wrong-import-position
+from clcn.frame import FrameQueueProduceTask  # pylint: disable=wrong-import-position
+from clcn.queuefactory import FrameQueueFactory # pylint: disable=wrong-import-position
+from clcn.stream import RedisStreamBroker, StreamInfo  # pylint: disable=wrong-import-position
+from clcn.nn.inferengine import NNInferEngineTask, DetectionModel, \
+    EngineOptions, EngineReporters                  # pylint: disable=wrong-import-position
+
+WEBSOCKET_PORT = 31611
+WEBSOCKET_SERVER = os.path.join(os.path.dirname(__file__), "..", "apps",
+                                "websocket_server.py")
+# metrics compared against baseline as relative changes
+BASELINE_METRICS = ["throughput_fps", "drop_rate", "e2e_p50_ms", "e2e_p99_ms",
+                    "producer_round_trips_per_frame",
+                    "consumer_round_trips_per_frame"]
+
+def counting_redis(base):
+    """
+    Redis client class counting the round trips, each command, script call
+    or pipeline execution is one round trip.
+    """
+
+    class CountingRedis(base):
+        """
+        Redis client counting the round trips.
+        """
+
+        def __init__(self, *args, **kwargs):
+            base.__init__(self, *args, **kwargs)
+            self.round_trips = 0
+            self._count_lock = threading.Lock()
+
+        def count(self):
+            """
+            Count one round trip
+            """
+            with self._count_lock:
+                self.round_trips += 1
+
+        def execute_command(self, *args, **options):
+            """
+            Execute a command in one round trip
+            """
+            self.count()
+            return base.execute_command(self, *args, **options)
+
+        def pipeline(self, transaction=True, shard_hint=None):
+            """
+            Pipeline executing all its commands in one round trip
+            """
+            pipe = base.pipeline(self, transaction, shard_hint)
+            execute = pipe.execute
+
+            def counted_execute(*args, **kwargs):
+                self.count()
+                return execute(*args, **kwargs)
+
+            pipe.execute = counted_execute
+            return pipe
+
+    return CountingRedis
+
+class RedisFixture:
+    """
+    Redis for the benchmark: spawn, fake or host:port.
+    """
+
+    def __init__(self, spec):
+        self._process = None
+        self._fake_server = None
+        self.host = None
+        self.port = None
+        if spec == "auto":
+            spec = "spawn" if shutil.which("redis-server") else "fake"
+        if spec == "fake":
+            # pylint: disable=import-outside-toplevel
+            import fakeredis
+            self._fake_server = fakeredis.FakeServer()
+        elif spec == "spawn":
+            self.host, self.port = "127.0.0.1", _free_port()
+            # the server runs till close()
+            self._process = subprocess.Popen(     # pylint: disable=consider-using-with
+                ["redis-server", "--port", str(self.port), "--save", "",
+                 "--appendonly", "no"], stdout=subprocess.DEVNULL)
+            self._wait_ready()
+        else:
+            host, port = spec.split(":")
+            self.host, self.port = host, int(port)
+        self.kind = spec if spec in ["fake", "spawn"] else "external"
+
+    def _wait_ready(self):
+        deadline = time.time() + 10
+        while time.time() < deadline:
+            try:
+                redis.StrictRedis(self.host, self.port).ping()
+                return
+            except redis.exceptions.ConnectionError:
+                time.sleep(0.1)
+        raise RuntimeError("redis-server is not ready")
+
+    @property
+    def is_fake(self):
+        """
+        Whether it is the in process fakeredis
+        """
+        return self._fake_server is not None
+
+    def connect(self):
+        """
+        New redis connection counting its round trips
+        """
+        if self.is_fake:
+            # pylint: disable=import-outside-toplevel
+            import fakeredis
+            return counting_redis(fakeredis.FakeStrictRedis)(
+                server=self._fake_server)
+        return counting_redis(redis.StrictRedis)(self.host, self.port)
+
+    def close(self):
+        """
+        Stop the spawned redis-server
+        """
+        if self._process is not None:
+            self._process.terminate()
+            self._process.wait()
+
+class SyntheticStreamTask(CLCNTask):
+    """
+    Produce the same JPEG frame at given FPS onto the local queue like the
+    capture task, the oldest frame is evicted once the queue is full.
+    """
+
+    def __init__(self, payload, fps, out_queue):
+        CLCNTask.__init__(self)
+        self._payload = payload
+        self._interval = 1.0 / fps
+        self._out_queue = out_queue
+        self.captured = 0
+        self.overflow = 0
+
+    def execute(self):
+        """
+        Task entry
+        """
+        start = time.time()
+        while not self.is_task_stopping:
+            if self._out_queue.full():
+                try:
+                    self._out_queue.get_nowait()
+                    self.overflow += 1
+                except queue.Empty:
+                    pass
+            self._out_queue.put_nowait((time.time(), self._payload))
+            self.captured += 1
+            delay = start + self.captured * self._interval - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+class LatencyCollector:
+    """
+    Collect the latency of each published frame from inference engine.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.e2e = []
+        self.queue_wait = []
+        self.infer = []
+        self.last_time = None
+
+    def report(self, _, queue_wait, infer_latency):
+        """
+        report_latency_fn of inference engine
+        """
+        with self._lock:
+            self.infer.append(infer_latency)
+            if queue_wait is not None:
+                self.queue_wait.append(queue_wait)
+                self.e2e.append(queue_wait + infer_latency)
+            self.last_time = time.time()
+
+    @property
+    def published(self):
+        """
+        Number of frames published
+        """
+        return len(self.infer)
+
+class WebSocketClients:
+    """
+    Websocket clients receiving the inferred streams from websocket server,
+    one per client in round robin over streams.
+    """
+
+    def __init__(self, sids):
+        self._sids = sids
+        self._loop = asyncio.new_event_loop()
+        self._stopping = False
+        self.received = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        """
+        Start the clients on their own event loop
+        """
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the clients
+        """
+        self._stopping = True
+        self._thread.join()
+
+    async def _client(self, sid):
+        # pylint: disable=import-outside-toplevel
+        import websockets
+        url = "ws://127.0.0.1:%d/%s" % (WEBSOCKET_PORT, sid)
+        async with websockets.connect(url) as wsobj:
+            while not self._stopping:
+                try:
+                    await asyncio.wait_for(wsobj.recv(), 0.5)
+                    self.received += 1
+                except asyncio.TimeoutError:
+                    continue
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(asyncio.gather(
+            *[self._client(sid) for sid in self._sids]))
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def _percentile_ms(values, percent):
+    if len(values) == 0:
+        return None
+    return round(float(np.percentile(values, percent)) * 1000, 3)
+
+def _histogram_quantile(buckets, quantile):
+    """
+    Quantile from cumulative prometheus histogram buckets like
+    histogram_quantile() does, by linear interpolation within the bucket.
+    """
+    buckets = sorted(buckets)
+    total = buckets[-1][1] if len(buckets) != 0 else 0
+    if total == 0:
+        return None
+    rank = quantile * total
+    lower, lower_count = 0, 0
+    for upper, count in buckets:
+        if count >= rank:
+            if upper == float("inf"):
+                return lower
+            return lower + (upper - lower) * \
+                (rank - lower_count) / max(count - lower_count, 1e-9)
+        lower, lower_count = upper, count
+    return lower
+
+def _scrape_e2e_quantiles(metrics_port):
+    """
+    Scrape the end to end latency histogram of websocket server.
+    """
+    with urllib.request.urlopen(
+            "http://127.0.0.1:%d/metrics" % metrics_port) as response:
+        text = response.read().decode("utf-8")
+    buckets = {}
+    for family in text_string_to_metric_families(text):
+        if family.name != "ei_e2e_latency_seconds":
+            continue
+        for sample in family.samples:
+            if sample.name.endswith("_bucket"):
+                upper = float(sample.labels["le"])
+                buckets[upper] = buckets.get(upper, 0) + sample.value
+    buckets = list(buckets.items())
+    result = {}
+    for percent in [50, 99]:
+        value = _histogram_quantile(buckets, percent / 100.0)
+        result["ws_e2e_p%d_ms" % percent] = \
+            None if value is None else round(value * 1000, 3)
+    return result
+
+def _start_websocket_server(fixture, metrics_port):
+    env = dict(os.environ, STREAM_BROKER_REDIS_HOST=fixture.host,
+               STREAM_BROKER_REDIS_PORT=str(fixture.port),
+               METRICS_PORT=str(metrics_port))
+    # the server runs till the streams are done, terminated by the caller
+    server = subprocess.Popen([sys.executable, WEBSOCKET_SERVER], env=env,   # pylint: disable=consider-using-with
+                              stderr=subprocess.DEVNULL)
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", WEBSOCKET_PORT), 1).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("websocket server is not ready")
+
+def _wait_drained(collector, timeout):
+    """
+    Wait until no frame is published for a second after producers stop.
+    """
+    deadline = time.time() + timeout
+    last = -1
+    while time.time() < deadline and collector.published != last:
+        last = collector.published
+        time.sleep(1)
+
+def run_streams(args, fixture, payload, streams):
+    """
+    Run the benchmark for given number of streams and return the result dict.
+    """
+    # a category of its own, so no frame is left from other runs
+    category = "bench%d-%d" % (os.getpid(), streams)
+    producer_conn = fixture.connect()
+    consumer_conn = fixture.connect()
+
+    collector = LatencyCollector()
+    engine = NNInferEngineTask(
+        FrameQueueFactory.get_queue(consumer_conn, category, args.backend),
+        RedisStreamBroker(consumer_conn),
+        DetectionModel(backend="synthetic", backend_args={
+            "cost_ms": args.infer_ms,
+            "input_size": (args.input_size, args.input_size)}),
+        EngineOptions(batch_size=args.batch, batch_sizes=args.batch_sizes,
+                      max_wait_ms=args.max_wait_ms,
+                      infer_requests=args.infer_requests,
+                      decode_workers=args.workers,
+                      encode_workers=args.workers,
+                      output_mode=args.output_mode),
+        EngineReporters(report_latency_fn=collector.report))
+
+    infos = [StreamInfo("stream%d" % index, category)
+             for index in range(streams)]
+    sources = []
+    tasks = []
+    for info in infos:
+        local_queue = queue.Queue(10)
+        sources.append(SyntheticStreamTask(payload, args.fps, local_queue))
+        tasks.append(FrameQueueProduceTask(
+            info, local_queue,
+            FrameQueueFactory.get_queue(producer_conn, category,
+                                        args.backend),
+            args.flush_ms / 1000.0))
+
+    server = None
+    clients = None
+    if args.ws_clients > 0:
+        # a server for each run, so its latency histogram is of this run
+        server = _start_websocket_server(fixture, args.ws_metrics_port)
+        clients = WebSocketClients(
+            [StreamInfo(infos[index % streams].name, category, "inferred").id
+             for index in range(args.ws_clients)])
+    engine.start()
+    for task in tasks + sources:
+        task.start()
+    if clients is not None:
+        # the stream is subscribed once it is registered on broker
+        time.sleep(1.5)
+        clients.start()
+
+    start = time.time()
+    time.sleep(args.duration)
+    for source in sources:
+        source.stop()
+    _wait_drained(collector, 10)
+    for task in tasks:
+        task.stop()
+    engine.stop()
+    if clients is not None:
+        clients.stop()
+        ws_result = _scrape_e2e_quantiles(args.ws_metrics_port)
+        server.terminate()
+        server.wait()
+
+    captured = sum(source.captured for source in sources)
+    overflow = sum(source.overflow for source in sources)
+    published = collector.published
+    duration = max((collector.last_time or time.time()) - start, 1e-6)
+    result = {
+        "streams": streams,
+        "fps_per_stream": args.fps,
+        "duration": args.duration,
+        "redis": fixture.kind,
+        "queue_backend": args.backend,
+        "output_mode": args.output_mode,
+        "infer_ms": args.infer_ms,
+        "batch": args.batch,
+        "captured": captured,
+        "capture_overflow": overflow,
+        "published": published,
+        "dropped": captured - published,
+        "drop_rate": round((captured - published) / max(captured, 1), 4),
+        "throughput_fps": round(published / duration, 2),
+        "queue_wait_p50_ms": _percentile_ms(collector.queue_wait, 50),
+        "queue_wait_p99_ms": _percentile_ms(collector.queue_wait, 99),
+        "infer_p50_ms": _percentile_ms(collector.infer, 50),
+        "infer_p99_ms": _percentile_ms(collector.infer, 99),
+        "e2e_p50_ms": _percentile_ms(collector.e2e, 50),
+        "e2e_p95_ms": _percentile_ms(collector.e2e, 95),
+        "e2e_p99_ms": _percentile_ms(collector.e2e, 99),
+        "producer_round_trips_per_frame": round(
+            producer_conn.round_trips / max(captured - overflow, 1), 3),
+        "consumer_round_trips_per_frame": round(
+            consumer_conn.round_trips / max(published, 1), 3),
+    }
+    if clients is not None:
+        result["ws_clients"] = args.ws_clients
+        result["ws_received"] = clients.received
+        result.update(ws_result)
+    return result
+
+def compare_baseline(result, baseline):
+    """
+    Relative change of each metric against the baseline of same streams.
+    """
+    changes = {}
+    for key in BASELINE_METRICS:
+        old, new = baseline.get(key), result.get(key)
+        if old is None or new is None:
+            continue
+        changes[key] = None if old == 0 else round((new - old) / old, 4)
+    return changes
+
+def _load_baseline(path):
+    baseline = {}
+    with open(path, encoding="utf-8") as lines:
+        for line in lines:
+            if line.strip() != "":
+                item = json.loads(line)
+                baseline[item["streams"]] = item
+    return baseline
+
+def main():
+    """
+    Benchmark entry
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("-s", "--streams", default="1,4",
+                        help="comma separated numbers of streams")
+    parser.add_argument("-f", "--fps", type=float, default=15,
+                        help="frames per second of each stream")
+    parser.add_argument("-d", "--duration", type=float, default=10,
+                        help="seconds to produce frames")
+    parser.add_argument("-r", "--redis", default="auto",
+                        help="spawn, fake, host:port or auto (spawn if "
+                        "redis-server is installed, otherwise fake)")
+    parser.add_argument("-b", "--backend", default="list",
+                        help="frame queue backend: list, fair or stream")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--infer-ms", type=float, default=10,
+                        help="synthetic inference latency in milliseconds")
+    parser.add_argument("--input-size", type=int, default=300,
+                        help="synthetic network input size")
+    parser.add_argument("--batch", type=int, default=1,
+                        help="max frames to infer at once")
+    parser.add_argument("--batch-sizes", default="",
+                        help="comma separated batch sizes to pad batches to")
+    parser.add_argument("--max-wait-ms", type=int, default=0,
+                        help="max milliseconds to wait for filling a batch")
+    parser.add_argument("--infer-requests", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="decode and encode workers")
+    parser.add_argument("--output-mode", default="frame",
+                        help="frame, detection or overlay")
+    parser.add_argument("--flush-ms", type=float, default=0,
+                        help="max milliseconds to wait before flushing")
+    parser.add_argument("--ws-clients", type=int, default=0,
+                        help="websocket clients, needs a real redis")
+    parser.add_argument("--ws-metrics-port", type=int, default=18000,
+                        help="metrics port of the websocket server")
+    parser.add_argument("--baseline",
+                        help="JSON lines of a previous run to compare with")
+    args = parser.parse_args()
+    args.batch_sizes = [int(size) for size in args.batch_sizes.split(",")
+                        if size.strip() != ""]
+
+    image = np.random.randint(0, 255, (args.height, args.width, 3), np.uint8)
+    image = cv2.GaussianBlur(image, (15, 15), 0)
+    _, jpeg = cv2.imencode(".jpg", image)
+    payload = jpeg.tobytes()
+    baseline = _load_baseline(args.baseline) if args.baseline else {}
+
+    fixture = RedisFixture(args.redis)
+    try:
+        if args.ws_clients > 0 and fixture.is_fake:
+            parser.error("websocket clients need a real redis")
+        if args.backend == "stream" and fixture.is_fake:
+            # fakeredis returns at once instead of blocking on XREADGROUP,
+            # so the consumer would busy poll and skew the results
+            parser.error("stream backend needs a real redis")
+        for streams in [int(item) for item in args.streams.split(",")]:
+            result = run_streams(args, fixture, payload, streams)
+            if streams in baseline:
+                result["baseline"] = compare_baseline(result,
+                                                      baseline[streams])
+            print(json.dumps(result), flush=True)
+    finally:
+        fixture.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+"""
+Benchmark frame queue backends.
+
+A producer process pushes synthetic frames into the frame queue at given FPS,
+while the consumer pops them in batch like the inference service does. The
+push/pop throughput and the queueing latency from push to pop are reported
+for each backend as JSON lines. The redis backends need a redis-server
+reachable by both processes.
+
+  ./bench_frame_queue.py -b shm,list -n 3000 -s 20000 -f 300
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+import redis
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "apps"))
+
+from clcn.queuefactory import FrameQueueFactory # pylint: disable=wrong-import-position
+from clcn.stream import StreamInfo          # pylint: disable=wrong-import-position
+
+CATEGORY = "bench"
+
+def _get_queue(args, backend):
+    redis_conn = None
+    if backend != "shm":
+        redis_conn = redis.StrictRedis(args.redis_host, args.redis_port)
+    return FrameQueueFactory.get_queue(redis_conn, CATEGORY, backend)
+
+def _produce(args, backend):
+    out_queue = _get_queue(args, backend)
+    info = StreamInfo("bench-stream", CATEGORY)
+    payload = os.urandom(args.size)
+    interval = 1.0 / args.fps if args.fps > 0 else 0
+    start = time.time()
+    for index in range(args.frames):
+        out_queue.push(info, payload)
+        if interval > 0:
+            delay = start + (index + 1) * interval - time.time()
+            if delay > 0:
+                time.sleep(delay)
+    return time.time() - start
+
+def _percentile(values, percent):
+    if len(values) == 0:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+def run_backend(args, backend):
+    """
+    Run the benchmark for one backend and return the result dict.
+    """
+    in_queue = _get_queue(args, backend)
+    # drain the left frames from previous run
+    while len(in_queue.pop_batch(args.batch)[0]) != 0:
+        pass
+
+    producer = multiprocessing.Process(target=_produce, args=(args, backend))
+    producer.start()
+
+    latencies = []
+    drop_frame = 0
+    start = time.time()
+    last_pop = start
+    idle_start = None
+    while True:
+        msgs, dropped = in_queue.pop_batch(args.batch, 1)
+        now = time.time()
+        drop_frame += dropped
+        for msg in msgs:
+            latencies.append(now - msg.timestamp)
+        if len(msgs) != 0:
+            last_pop = now
+            idle_start = None
+            continue
+        if not producer.is_alive():
+            if idle_start is None:
+                idle_start = now
+            elif now - idle_start > 1:
+                break
+    duration = max(last_pop - start, 1e-6)
+    producer.join()
+
+    return {
+        "backend": backend,
+        "frames": args.frames,
+        "frame_size": args.size,
+        "popped": len(latencies),
+        "dropped": drop_frame,
+        "pop_fps": round(len(latencies) / duration, 2),
+        "latency_p50_ms": round(_percentile(latencies, 50) * 1000, 3),
+        "latency_p99_ms": round(_percentile(latencies, 99) * 1000, 3),
+    }
+
+def main():
+    """
+    Benchmark entry
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("-b", "--backends", default="shm,list",
+                        help="comma separated queue backends")
+    parser.add_argument("-n", "--frames", type=int, default=3000,
+                        help="number of frames to push")
+    parser.add_argument("-s", "--size", type=int, default=20000,
+                        help="frame payload size in bytes")
+    parser.add_argument("-f", "--fps", type=int, default=300,
+                        help="push rate, 0 means as fast as possible")
+    parser.add_argument("--batch", type=int, default=1,
+                        help="max frames to pop at once")
+    parser.add_argument("--redis-host", default="127.0.0.1")
+    parser.add_argument("--redis-port", type=int, default=6379)
+    args = parser.parse_args()
+
+    backends = args.backends.split(",")
+    if any(backend != "shm" for backend in backends):
+        # the producer runs in its own process, so an in process fakeredis
+        # could not be shared with it
+        try:
+            redis.StrictRedis(args.redis_host, args.redis_port).ping()
+        except redis.exceptions.ConnectionError:
+            parser.error("redis is not reachable on %s:%d, start redis-server "
+                         "or only benchmark -b shm" % (args.redis_host,
+                                                       args.redis_port))
+
+    for backend in backends:
+        print(json.dumps(run_backend(args, backend)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+#!/usr/bin/python3
+"""
+Benchmark the decode/infer/encode pipeline of inference engine.
+
+The frames are fed from an in-memory frame queue and inferred on synthetic
+backend which holds the frame for given milliseconds without the GIL like the
+inference runtime does, so the FPS shows how well decoding and encoding are
+spread over the cores. The result for each decode:encode worker setting is
+reported as JSON lines. The "serial" setting is the baseline before the
+pipeline: one thread pops, decodes, infers, encodes and publishes each batch
+in turn. 1:1 is the pipelined stages with one worker each.
+
+  ./bench_infer_pipeline.py -w serial,1:1,2:2,4:4 -n 600 --width 1920 --height 1080
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import numpy as np
+import cv2
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "apps"))
+
+from clcn.frame import FrameQueueBase               # pylint: disable=wrong-import-position
+from clcn.stream import StreamBrokerBase, StreamInfo  # pylint: disable=wrong-import-position
+from clcn.nn.inferengine import NNInferEngineTask, DetectionModel, \
+    EngineOptions                                   # pylint: disable=wrong-import-position
+
+CATEGORY = "bench"
+
+class MemoryFrameQueue(FrameQueueBase):
+    """
+    Frame queue holding the packed frames in memory.
+    """
+
+    def __init__(self, info, payload, frames):
+        FrameQueueBase.__init__(self, CATEGORY)
+        self._frames = [self._pack(info, payload, None) for _ in range(frames)]
+        self._lock = threading.Lock()
+
+    def push_on_queuer(self, info, msg):     # pylint: disable=unused-argument
+        with self._lock:
+            self._frames.append(msg)
+
+    def pop_on_queuer(self):
+        with self._lock:
+            if len(self._frames) == 0:
+                return None
+            return self._frames.pop()
+
+    def bpop_on_queuer(self, timeout):
+        frame = self.pop_on_queuer()
+        if frame is None:
+            time.sleep(timeout)
+        return frame
+
+    def drop_on_queuer(self):
+        return 0
+
+    def is_stream_expired(self, info):     # pylint: disable=unused-argument
+        return False
+
+class CountingBroker(StreamBrokerBase):
+    """
+    Stream broker only counting the published frames.
+    """
+
+    def __init__(self, frames):
+        StreamBrokerBase.__init__(self)
+        self._left = frames
+        self.done = threading.Event()
+
+    def add_stream_on_broker(self, info):
+        pass
+
+    def del_stream_on_broker(self, info):
+        pass
+
+    def publish_frame_on_broker(self, info, msg):     # pylint: disable=unused-argument
+        self._left -= 1
+        if self._left == 0:
+            self.done.set()
+
+    def sync_streams_from_broker(self):
+        # the streams are only kept locally, nothing to sync
+        pass
+
+def run_serial(args, payload):
+    """
+    Run the serial loop of pop, decode, infer, encode and publish with the
+    same engine steps, and return the result dict.
+    """
+    info = StreamInfo("bench-stream", CATEGORY)
+    in_queue = MemoryFrameQueue(info, payload, args.frames)
+    broker = CountingBroker(args.frames)
+    # the engine is not started, only its steps are called on this thread
+    task = NNInferEngineTask(
+        in_queue, broker,
+        DetectionModel(backend="synthetic",
+                       backend_args={"cost_ms": args.infer_ms}),
+        EngineOptions(batch_size=args.batch))
+    out_info = StreamInfo("bench-stream", CATEGORY, "inferred")
+    # pylint: disable=protected-access
+    start = time.time()
+    while not broker.done.is_set():
+        msgs, _ = in_queue.pop_batch(args.batch)
+        frames = [task._decode(msg) for msg in msgs]
+        detections = task.infer_batch(frames)
+        publish_time = time.time()
+        broker.publish_batch([
+            (out_info, binary)
+            for msg, frame, dets in zip(msgs, frames, detections)
+            for binary in task._encode(msg, frame, dets, publish_time)])
+    duration = time.time() - start
+    # pylint: enable=protected-access
+
+    return {
+        "decode_workers": 0,
+        "encode_workers": 0,
+        "frames": args.frames,
+        "batch": args.batch,
+        "infer_ms": args.infer_ms,
+        "fps": round(args.frames / duration, 2),
+    }
+
+def run_setting(args, payload, decode_workers, encode_workers):
+    """
+    Run the benchmark for one worker setting and return the result dict.
+    """
+    info = StreamInfo("bench-stream", CATEGORY)
+    in_queue = MemoryFrameQueue(info, payload, args.frames)
+    broker = CountingBroker(args.frames)
+    task = NNInferEngineTask(
+        in_queue, broker,
+        DetectionModel(backend="synthetic",
+                       backend_args={"cost_ms": args.infer_ms}),
+        EngineOptions(batch_size=args.batch, decode_workers=decode_workers,
+                      encode_workers=encode_workers))
+    start = time.time()
+    task.start()
+    broker.done.wait()
+    duration = time.time() - start
+    task.stop()
+    task.join()
+
+    return {
+        "decode_workers": decode_workers,
+        "encode_workers": encode_workers,
+        "frames": args.frames,
+        "batch": args.batch,
+        "infer_ms": args.infer_ms,
+        "fps": round(args.frames / duration, 2),
+    }
+
+def main():
+    """
+    Benchmark entry
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("-w", "--workers", default="serial,1:1,2:2,4:4",
+                        help="comma separated decode:encode worker settings, "
+                        "or serial for the loop without pipeline")
+    parser.add_argument("-n", "--frames", type=int, default=600,
+                        help="number of frames to infer")
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--infer-ms", type=float, default=10,
+                        help="synthetic inference latency in milliseconds")
+    parser.add_argument("--batch", type=int, default=1,
+                        help="max frames to infer at once")
+    args = parser.parse_args()
+
+    image = np.random.randint(0, 255, (args.height, args.width, 3), np.uint8)
+    image = cv2.GaussianBlur(image, (15, 15), 0)
+    _, jpeg = cv2.imencode(".jpg", image)
+    payload = jpeg.tobytes()
+
+    for setting in args.workers.split(","):
+        if setting == "serial":
+            print(json.dumps(run_serial(args, payload)))
+            continue
+        decode_workers, encode_workers = setting.split(":")
+        print(json.dumps(run_setting(args, payload, int(decode_workers),
+                                     int(encode_workers))))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/python3
+"""
+Micro benchmark of the preprocessing from JPEG frame to network input blob.
+
+The legacy path decodes the frame at full resolution, then resizes, transposes
+and concatenates it into a new blob, while the fast path decodes the frame at
+reduced resolution and resizes it into the preallocated blob. The time and the
+memory allocated per frame are reported for each path as JSON lines.
+
+  ./bench_preprocess.py -n 200 --width 1920 --height 1080 --input 300x300
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+import numpy as np
+import cv2
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "apps"))
+
+from clcn.frame import FrameMessage                 # pylint: disable=wrong-import-position
+from clcn.nn.inferengine import NNInferEngineTask, DetectionModel, \
+    EngineOptions                                   # pylint: disable=wrong-import-position
+
+def _legacy_preprocess(task, msg):
+    weight, height = task.input_size
+    frame = cv2.imdecode(np.frombuffer(msg.data, dtype=np.uint8),
+                         cv2.IMREAD_COLOR)
+    in_frame = cv2.resize(frame, (weight, height))
+    in_frame = in_frame.transpose((2, 0, 1))
+    in_frame = in_frame.reshape((1, 3, height, weight))
+    return np.concatenate([in_frame])
+
+def _fast_preprocess(task, msg):
+    # pylint: disable=protected-access
+    return task._nn.process_input_batch([task._decode(msg)])
+
+def run_path(args, name, preprocess, task, msg):
+    """
+    Run the benchmark for one preprocessing path and return the result dict.
+    """
+    # warm up to allocate the reused buffers
+    preprocess(task, msg)
+
+    start = time.time()
+    for _ in range(args.frames):
+        preprocess(task, msg)
+    duration = time.time() - start
+
+    # the peak of each frame is the memory allocated during preprocessing
+    peaks = []
+    tracemalloc.start()
+    for _ in range(min(args.frames, 20)):
+        tracemalloc.reset_peak()
+        current, _ = tracemalloc.get_traced_memory()
+        preprocess(task, msg)
+        peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    tracemalloc.stop()
+
+    return {
+        "path": name,
+        "frame_size": "%dx%d" % (args.width, args.height),
+        "input_size": args.input,
+        "preprocess_ms": round(duration * 1000 / args.frames, 3),
+        "alloc_kb_per_frame": round(sum(peaks) / len(peaks) / 1024, 1),
+    }
+
+def main():
+    """
+    Benchmark entry
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("-n", "--frames", type=int, default=200,
+                        help="number of frames to preprocess")
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--input", default="300x300",
+                        help="network input size as WxH")
+    args = parser.parse_args()
+
+    image = np.random.randint(0, 255, (args.height, args.width, 3), np.uint8)
+    image = cv2.GaussianBlur(image, (15, 15), 0)
+    _, jpeg = cv2.imencode(".jpg", image)
+    msg = FrameMessage.from_binary(
+        FrameMessage("bench", "bench", jpeg.tobytes()).to_binary())
+
+    weight, height = args.input.split("x")
+    # the frame is only decoded for network input in detection output mode
+    task = NNInferEngineTask(
+        None, None,
+        DetectionModel(backend="synthetic", backend_args={
+            "input_size": (int(weight), int(height))}),
+        EngineOptions(output_mode=NNInferEngineTask.OUTPUT_DETECTION))
+    for name, preprocess in [("legacy", _legacy_preprocess),
+                             ("fast", _fast_preprocess)]:
+        print(json.dumps(run_path(args, name, preprocess, task, msg)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,706 @@
+#!/usr/bin/python3
+"""
+Simulate the HPA policies of inference service offline.
+
+The discrete event simulation models the producers pushing frames onto the
+frame queue of a category, the queue trimmed to its newest frames like
+RedisFrameQueue, the inference replicas popping one frame at a time with the
+service times drawn from a measured or synthetic distribution, and the HPA
+scaling the replicas on the metrics they report.
+
+Each replica estimates its rates with the same InferRates as the inference
+engine and reports them at the same interval, so ei_scale_ratio is computed
+exactly like the inference service. The queue exporter is modelled the same
+way for ei_desired_replicas. The HPA follows the kubernetes algorithm: sync
+period, tolerance, unready pods, scale down stabilization window and the
+default scale up rate limit.
+
+The arrival trace is either a file of "seconds,fps" lines, for example the
+ei_queue_arrival_fps exported from prometheus, or an inline spec like
+"0:15,300:90,900:15", the rate is held until the next point. Each policy is
+an HPA yaml file or an inline spec like
+"metric=ei_scale_ratio,target=1,min=1,max=4", and is reported as a JSON line
+with dropped frames, latency percentiles and pod seconds.
+
+  ./sim_autoscale.py -t 0:15,300:90,900:15 -d 1200 --service-ms 30 \\
+      -p ../kubernetes/scale/hpa-infer-people-on-custom-metric-scale-ratio.yaml \\
+      -p ../kubernetes/scale/hpa-infer-people-on-external-metric-desired-replicas.yaml
+
+With --regression it runs the built-in scenarios holding a steady load after a
+burst, and exits with 1 unless every policy settles on the replicas the load
+needs.
+"""
+import os
+import sys
+import csv
+import json
+import math
+import heapq
+import random
+import argparse
+from collections import deque
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "apps"))
+
+from clcn.frame import RedisFrameQueue          # pylint: disable=wrong-import-position
+from clcn.metrics import InferMetrics, InferRates, RateEstimatorFactory, \
+    desired_replicas                            # pylint: disable=wrong-import-position
+from clcn.nn.inferengine import InferEngineTask # pylint: disable=wrong-import-position
+
+# pylint: disable=protected-access
+# max frames kept on frame queue, the older ones are dropped
+QUEUE_MAX_LEN = RedisFrameQueue._MAX_LEN
+# seconds between two metric reports of inference engine
+REPORT_INTERVAL = InferEngineTask._METRIC_REPORT_INTERVAL
+# pylint: enable=protected-access
+# regression scenarios of (name, trace, seconds, service ms), the replicas
+# should settle on the load once the trace holds its last rate
+REGRESSION_SCENARIOS = [
+    ("under-load", "0:60,600:20", 3600, 30),
+    ("saturated", "0:60,600:150", 3600, 30),
+]
+REGRESSION_POLICIES = [
+    "metric=ei_scale_ratio,target=1,min=1,max=16",
+    "metric=ei_desired_replicas,target=1,min=1,max=16",
+]
+
+class ArrivalTrace:
+    """
+    Piecewise constant arrival rate over time.
+    """
+
+    def __init__(self, points):
+        self._points = sorted(points)
+        if len(self._points) == 0 or self._points[0][0] > 0:
+            self._points.insert(0, (0, 0))
+
+    @staticmethod
+    def load(spec):
+        """
+        Load the trace from "seconds,fps" file or inline "seconds:fps,..."
+        """
+        points = []
+        if os.path.isfile(spec):
+            with open(spec, encoding="utf-8") as trace_file:
+                for row in csv.reader(trace_file):
+                    try:
+                        points.append((float(row[0]), float(row[1])))
+                    except (ValueError, IndexError):
+                        # skip the header or blank line
+                        continue
+        else:
+            for item in spec.split(","):
+                seconds, fps = item.split(":")
+                points.append((float(seconds), float(fps)))
+        return ArrivalTrace(points)
+
+    @property
+    def end(self):
+        """
+        Seconds of the last point
+        """
+        return self._points[-1][0]
+
+    @property
+    def max_rate(self):
+        """
+        Max arrival rate of the trace
+        """
+        return max(fps for _, fps in self._points)
+
+    def rate(self, now):
+        """
+        Arrival rate at now
+        """
+        fps = 0
+        for seconds, value in self._points:
+            if seconds > now:
+                break
+            fps = value
+        return fps
+
+class ServiceTime:
+    """
+    Service time of a frame drawn from measured samples, or from lognormal
+    distribution with given mean and coefficient of variation.
+    """
+
+    def __init__(self, samples=None, mean_ms=30, cv=0.2):
+        self._samples = samples
+        self._mean = mean_ms / 1000.0
+        self._sigma = math.sqrt(math.log(1 + cv * cv))
+        self._mu = math.log(self._mean) - self._sigma * self._sigma / 2
+
+    @staticmethod
+    def load(path):
+        """
+        Load the samples in milliseconds, one per line.
+        """
+        with open(path, encoding="utf-8") as sample_file:
+            samples = [float(line) / 1000.0 for line in sample_file
+                       if line.strip() != ""]
+        return ServiceTime(samples)
+
+    @property
+    def mean(self):
+        """
+        Mean seconds of service time
+        """
+        if self._samples is not None:
+            return sum(self._samples) / len(self._samples)
+        return self._mean
+
+    def sample(self, rng):
+        """
+        Draw a service time in seconds
+        """
+        if self._samples is not None:
+            return rng.choice(self._samples)
+        return rng.lognormvariate(self._mu, self._sigma)
+
+def _quantity(value):
+    """
+    Parse kubernetes quantity like 1, "1.5" or "500m".
+    """
+    value = str(value)
+    if value.endswith("m"):
+        return float(value[:-1]) / 1000
+    return float(value)
+
+class HPAPolicy:
+    """
+    HPA policy on one metric, following the kubernetes algorithm.
+    """
+
+    # kubernetes defaults
+    _SYNC_PERIOD = 15
+    _TOLERANCE = 0.1
+    _SCALE_DOWN_WINDOW = 300
+
+    def __init__(self, name, metric="ei_scale_ratio", target=1.0, *,
+                 min_replicas=1, max_replicas=4, metric_type=None,
+                 target_type="AverageValue",
+                 scale_down_window=_SCALE_DOWN_WINDOW):
+        self.name = name
+        self.metric = metric
+        self.target = target
+        self.min_replicas = min_replicas
+        self.max_replicas = max_replicas
+        if metric_type is None:
+            metric_type = "Pods"
+            if metric == "cpu":
+                metric_type = "Resource"
+            elif metric in ["ei_desired_replicas", "ei_queue_length"]:
+                metric_type = "External"
+        self.metric_type = metric_type
+        self.target_type = target_type
+        self.scale_down_window = scale_down_window
+        self.sync_period = self._SYNC_PERIOD
+        self.tolerance = self._TOLERANCE
+        if metric_type == "Pods" and metric[3:] not in InferMetrics._fields:
+            raise ValueError("Unknown pod metric %s" % metric)
+
+    @staticmethod
+    def load(spec):
+        """
+        Load the policy from HPA yaml file or inline "key=value,..." spec.
+        """
+        if os.path.isfile(spec):
+            return HPAPolicy._load_yaml(spec)
+        args = dict(item.split("=") for item in spec.split(","))
+        return HPAPolicy(
+            args.get("name", spec), args.get("metric", "ei_scale_ratio"),
+            _quantity(args.get("target", 1)),
+            min_replicas=int(args.get("min", 1)),
+            max_replicas=int(args.get("max", 4)),
+            metric_type=args.get("type"),
+            target_type=args.get("target_type", "AverageValue"),
+            scale_down_window=float(args.get("window",
+                                             HPAPolicy._SCALE_DOWN_WINDOW)))
+
+    @staticmethod
+    def _load_yaml(path):
+        # pylint: disable=import-outside-toplevel
+        import yaml
+        with open(path, encoding="utf-8") as hpa_file:
+            spec = yaml.safe_load(hpa_file)["spec"]
+        name = os.path.basename(path)
+        min_replicas = spec.get("minReplicas", 1)
+        max_replicas = spec["maxReplicas"]
+        window = spec.get("behavior", {}).get("scaleDown", {}).get(
+            "stabilizationWindowSeconds", HPAPolicy._SCALE_DOWN_WINDOW)
+        if "targetCPUUtilizationPercentage" in spec:
+            return HPAPolicy(name, "cpu",
+                             spec["targetCPUUtilizationPercentage"],
+                             min_replicas=min_replicas,
+                             max_replicas=max_replicas,
+                             metric_type="Resource",
+                             target_type="Utilization",
+                             scale_down_window=window)
+        metric = spec["metrics"][0]
+        source = metric[metric["type"].lower()]
+        target = source["target"]
+        if metric["type"] == "Resource":
+            metric_name = source["name"]
+        else:
+            metric_name = source["metric"]["name"]
+        target_value = target.get("averageValue", target.get(
+            "value", target.get("averageUtilization")))
+        return HPAPolicy(name, metric_name, _quantity(target_value),
+                         min_replicas=min_replicas, max_replicas=max_replicas,
+                         metric_type=metric["type"],
+                         target_type=target["type"],
+                         scale_down_window=window)
+
+    def _ratio_replicas(self, current, ratio, count):
+        if abs(ratio - 1) <= self.tolerance:
+            return current
+        return math.ceil(ratio * count)
+
+    def recommend(self, current, values, unready, external):
+        """
+        Recommend the replicas from the values of ready pods with metrics,
+        the number of pods without metrics and the external metric value.
+        """
+        if self.metric_type == "External":
+            if external is None:
+                return current
+            if self.target_type == "Value":
+                return self._ratio_replicas(current, external / self.target,
+                                            current)
+            if current > 0 and \
+                abs(external / (self.target * current) - 1) <= self.tolerance:
+                return current
+            return math.ceil(external / self.target)
+
+        if len(values) == 0:
+            return current
+        ratio = sum(values) / len(values) / self.target
+        if unready == 0:
+            return self._ratio_replicas(current, ratio, len(values))
+        # the pods without metrics are assumed to use nothing when scaling
+        # up and exactly the target when scaling down
+        filled = list(values) + [0 if ratio > 1 else self.target] * unready
+        new_ratio = sum(filled) / len(filled) / self.target
+        if abs(new_ratio - 1) <= self.tolerance or \
+            (ratio > 1) != (new_ratio > 1):
+            return current
+        return math.ceil(new_ratio * len(filled))
+
+class Replica:
+    """
+    Inference replica popping one frame at a time.
+    """
+
+    def __init__(self, index, created, ready_at, args):
+        self.index = index
+        self.created = created
+        self.ready_at = ready_at
+        self.terminated = None
+        self.stopping = False
+        self.busy = False
+        self.busy_since = 0
+        self.busy_seconds = 0
+        self.scraped_busy = 0
+        self.reported_busy = 0
+        self.metrics = None
+        self.rates = InferRates(args.rate_estimator, args.rate_window,
+                                start=ready_at)
+
+    def busy_total(self, now):
+        """
+        Busy seconds including the frame in service
+        """
+        if self.busy:
+            return self.busy_seconds + now - self.busy_since
+        return self.busy_seconds
+
+class Simulation:
+    """
+    Simulate the frame queue, inference replicas and HPA for one policy.
+    """
+
+    def __init__(self, args, policy, trace, service):
+        self._args = args
+        self._policy = policy
+        self._trace = trace
+        self._service = service
+        # same seed for each policy, so they see the same arrivals
+        self._arrival_rng = random.Random(args.seed)
+        self._service_rng = random.Random(args.seed + 1)
+        self._events = []
+        self._sequence = 0
+        self._now = 0
+        self._queue = deque()
+        self._pending_dropped = 0
+        self._replicas = []
+        self._idle = deque()
+        self._scraped = {}
+        self._external = None
+        self._scraped_external = None
+        self._recommendations = []
+        self._exporter_arrival = RateEstimatorFactory.get_estimator(
+            args.rate_estimator, args.rate_window, start=0)
+        self._pushed = 0
+        self._sampled_pushed = 0
+        self.latencies = []
+        self.dropped = 0
+        self.scale_ups = 0
+        self.scale_downs = 0
+        self.peak_replicas = 0
+        self.timeline = []
+
+    def _schedule(self, when, func, *args):
+        self._sequence += 1
+        heapq.heappush(self._events, (when, self._sequence, func, args))
+
+    def _active(self):
+        return [replica for replica in self._replicas
+                if replica.terminated is None and not replica.stopping]
+
+    def _add_replica(self, startup):
+        replica = Replica(len(self._replicas), self._now,
+                          self._now + startup, self._args)
+        self._replicas.append(replica)
+        self._schedule(replica.ready_at, self._on_ready, replica)
+
+    def _on_ready(self, replica):
+        # deleted before being ready
+        if replica.stopping:
+            return
+        self._schedule(self._now + REPORT_INTERVAL, self._on_report, replica)
+        self._pop(replica)
+
+    def _terminate(self, replica):
+        replica.terminated = self._now
+        if replica in self._idle:
+            self._idle.remove(replica)
+
+    def _next_arrival(self):
+        # thinning of the poisson process at max rate
+        max_rate = self._trace.max_rate
+        if max_rate <= 0:
+            return
+        when = self._now
+        while when < self._args.duration:
+            when += self._arrival_rng.expovariate(max_rate)
+            if self._arrival_rng.random() * max_rate < self._trace.rate(when):
+                self._schedule(when, self._on_arrival)
+                return
+
+    def _on_arrival(self):
+        self._queue.append(self._now)
+        self._pushed += 1
+        if len(self._queue) > QUEUE_MAX_LEN:
+            self._queue.popleft()
+            self._pending_dropped += 1
+        if len(self._idle) != 0:
+            self._pop(self._idle.popleft())
+        self._next_arrival()
+
+    def _pop(self, replica):
+        if len(self._queue) == 0:
+            self._idle.append(replica)
+            return
+        arrival = self._queue.popleft()
+        # the frames trimmed on pushing are counted by the next popper
+        drop_frame = self._pending_dropped
+        self._pending_dropped = 0
+        self.dropped += drop_frame
+        replica.rates.add(1, drop_frame, 0, self._now)
+        replica.busy = True
+        replica.busy_since = self._now
+        self._schedule(self._now + self._service.sample(self._service_rng),
+                       self._on_done, replica, arrival)
+
+    def _on_done(self, replica, arrival):
+        self.latencies.append(self._now - arrival)
+        replica.busy = False
+        replica.busy_seconds += self._now - replica.busy_since
+        if replica.stopping:
+            self._terminate(replica)
+            return
+        self._pop(replica)
+
+    def _on_report(self, replica):
+        if replica.terminated is not None or replica.stopping:
+            return
+        busy = replica.busy_total(self._now)
+        replica.rates.add_busy(busy - replica.reported_busy, self._now)
+        replica.reported_busy = busy
+        replica.metrics = replica.rates.snapshot(self._now, len(self._queue))
+        self._schedule(self._now + REPORT_INTERVAL, self._on_report, replica)
+
+    def _on_scrape(self):
+        interval = self._args.scrape_interval
+        self._scraped = {}
+        for replica in self._active():
+            if self._now < replica.ready_at:
+                continue
+            busy = replica.busy_total(self._now)
+            if self._policy.metric_type == "Resource":
+                # the pod is taken as one CPU fully used while serving
+                self._scraped[replica.index] = \
+                    (busy - replica.scraped_busy) / interval * 100
+            elif self._policy.metric_type == "Pods" and \
+                replica.metrics is not None:
+                self._scraped[replica.index] = getattr(
+                    replica.metrics, self._policy.metric[3:])
+            replica.scraped_busy = busy
+        self._scraped_external = self._external
+        self._schedule(self._now + interval, self._on_scrape)
+
+    def _on_export(self):
+        """
+        Queue exporter sampling the arrival rate, backlog and service rates.
+        """
+        args = self._args
+        self._exporter_arrival.add(self._pushed - self._sampled_pushed,
+                                   self._now)
+        self._sampled_pushed = self._pushed
+        arrival_fps = self._exporter_arrival.rate(self._now)
+        if self._policy.metric == "ei_queue_length":
+            self._external = len(self._queue)
+        else:
+            rates = [replica.metrics.service_fps
+                     for replica in self._active()
+                     if replica.metrics is not None and
+                     replica.metrics.service_fps > 0]
+            if len(rates) != 0:
+                replicas = desired_replicas(
+                    arrival_fps, sum(rates) / len(rates), len(self._queue),
+                    target_utilization=args.target_utilization,
+                    target_wait=args.target_wait,
+                    drain_seconds=args.drain_seconds,
+                    max_replicas=self._policy.max_replicas)
+                if replicas is not None:
+                    self._external = min(self._policy.max_replicas, max(
+                        self._policy.min_replicas, replicas))
+        self._schedule(self._now + args.sample_interval, self._on_export)
+
+    def _on_sync(self):
+        policy = self._policy
+        active = self._active()
+        current = len(active)
+        values = [self._scraped[replica.index] for replica in active
+                  if replica.index in self._scraped]
+        recommended = policy.recommend(current, values,
+                                       current - len(values),
+                                       self._scraped_external)
+        recommended = min(policy.max_replicas,
+                          max(policy.min_replicas, recommended))
+
+        # scale down to the max recommendation within the window, and scale
+        # up by no more than doubling or 4 pods in a period
+        self._recommendations.append((self._now, recommended))
+        self._recommendations = [
+            item for item in self._recommendations
+            if item[0] > self._now - policy.scale_down_window]
+        desired = current
+        if recommended > current:
+            desired = min(recommended, max(2 * current, current + 4))
+        else:
+            desired = max(item[1] for item in self._recommendations)
+            desired = min(desired, current)
+        self._scale(current, desired)
+        self._schedule(self._now + policy.sync_period, self._on_sync)
+
+    def _scale(self, current, desired):
+        self.peak_replicas = max(self.peak_replicas, desired)
+        if desired > current:
+            self.scale_ups += 1
+            for _ in range(desired - current):
+                self._add_replica(self._args.startup_seconds)
+        elif desired < current:
+            self.scale_downs += 1
+            # the unready and newer pods are deleted first
+            victims = sorted(self._active(),
+                             key=lambda item: (item.ready_at <= self._now,
+                                               -item.created))
+            for replica in victims[:current - desired]:
+                replica.stopping = True
+                if not replica.busy:
+                    self._terminate(replica)
+
+    def _on_sample(self):
+        active = self._active()
+        self.timeline.append({
+            "policy": self._policy.name,
+            "seconds": round(self._now, 3),
+            "arrival_fps": self._trace.rate(self._now),
+            "queue_length": len(self._queue),
+            "replicas": len(active),
+            "ready_replicas": len([replica for replica in active
+                                   if replica.ready_at <= self._now]),
+            "external": self._scraped_external,
+        })
+        self._schedule(self._now + self._args.timeline_interval,
+                       self._on_sample)
+
+    def run(self):
+        """
+        Run the simulation and return the result dict.
+        """
+        args = self._args
+        for _ in range(max(self._policy.min_replicas, args.initial_replicas)):
+            self._add_replica(0)
+        self._next_arrival()
+        self._schedule(args.scrape_interval, self._on_scrape)
+        self._schedule(args.sample_interval, self._on_export)
+        self._schedule(self._policy.sync_period, self._on_sync)
+        self._schedule(0, self._on_sample)
+        while len(self._events) != 0:
+            when, _, func, func_args = heapq.heappop(self._events)
+            if when > args.duration:
+                break
+            self._now = when
+            func(*func_args)
+        self._now = args.duration
+        return self._result()
+
+    def _result(self):
+        duration = self._args.duration
+        pod_seconds = sum(
+            (replica.terminated if replica.terminated is not None
+             else duration) - replica.created for replica in self._replicas)
+        latencies = sorted(self.latencies)
+
+        def percentile_ms(percent):
+            if len(latencies) == 0:
+                return None
+            index = min(len(latencies) - 1, int(len(latencies) * percent / 100))
+            return round(latencies[index] * 1000, 3)
+
+        arrived = self._pushed
+        dropped = self.dropped + self._pending_dropped
+        return {
+            "policy": self._policy.name,
+            "metric": self._policy.metric,
+            "target": self._policy.target,
+            "arrived": arrived,
+            "inferred": len(latencies),
+            "dropped": dropped,
+            "drop_rate": round(dropped / max(arrived, 1), 4),
+            "latency_p50_ms": percentile_ms(50),
+            "latency_p95_ms": percentile_ms(95),
+            "latency_p99_ms": percentile_ms(99),
+            "pod_seconds": round(pod_seconds, 1),
+            "mean_replicas": round(pod_seconds / duration, 2),
+            "max_replicas": self.peak_replicas,
+            "scale_ups": self.scale_ups,
+            "scale_downs": self.scale_downs,
+        }
+
+def expected_replicas(policy, fps, service_ms, target_utilization):
+    """
+    Replicas a policy should settle on for a steady arrival rate, the load
+    over the target ratio or the target utilization of desired replicas.
+    """
+    load = fps * service_ms / 1000.0
+    if policy.metric == "ei_desired_replicas":
+        target = target_utilization
+    else:
+        target = policy.target
+    return min(policy.max_replicas,
+               max(policy.min_replicas, math.ceil(load / target)))
+
+def run_regression(args):
+    """
+    Run the regression scenarios and return True if the mean replicas over
+    the second half of each scenario is within half a replica of expected.
+    """
+    passed = True
+    for name, spec, duration, service_ms in REGRESSION_SCENARIOS:
+        trace = ArrivalTrace.load(spec)
+        service = ServiceTime(mean_ms=service_ms, cv=args.service_cv)
+        scenario_args = argparse.Namespace(**vars(args))
+        scenario_args.duration = duration
+        for policy_spec in REGRESSION_POLICIES:
+            policy = HPAPolicy.load(policy_spec)
+            simulation = Simulation(scenario_args, policy, trace, service)
+            result = simulation.run()
+            settled = [sample["replicas"] for sample in simulation.timeline
+                       if sample["seconds"] >= duration / 2]
+            expected = expected_replicas(policy, trace.rate(duration),
+                                         service_ms, args.target_utilization)
+            result["scenario"] = name
+            result["expected_replicas"] = expected
+            result["settled_replicas"] = round(sum(settled) / len(settled), 2)
+            result["passed"] = abs(result["settled_replicas"] - expected) <= 0.5
+            passed = passed and result["passed"]
+            print(json.dumps(result), flush=True)
+    return passed
+
+def main():
+    """
+    Simulator entry
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("-t", "--trace", default="0:15,300:90,900:15",
+                        help="arrival trace file of seconds,fps lines or "
+                        "inline seconds:fps,...")
+    parser.add_argument("-d", "--duration", type=float, default=0,
+                        help="seconds to simulate, default is the trace end "
+                        "plus 600 seconds")
+    parser.add_argument("-p", "--policy", action="append",
+                        help="HPA yaml file or inline spec like metric="
+                        "ei_scale_ratio,target=1,min=1,max=4,window=300")
+    parser.add_argument("--service-ms", type=float, default=30,
+                        help="mean service time of a frame in milliseconds")
+    parser.add_argument("--service-cv", type=float, default=0.2,
+                        help="coefficient of variation of service time")
+    parser.add_argument("--service-times",
+                        help="file of measured service times in "
+                        "milliseconds, one per line")
+    parser.add_argument("--startup-seconds", type=float, default=20,
+                        help="seconds for a new replica to be ready")
+    parser.add_argument("--initial-replicas", type=int, default=1)
+    parser.add_argument("--scrape-interval", type=float, default=15,
+                        help="seconds between prometheus scrapes")
+    parser.add_argument("--rate-estimator", default="ewma")
+    parser.add_argument("--rate-window", type=float, default=30)
+    parser.add_argument("--sample-interval", type=float, default=5,
+                        help="seconds between queue exporter samples")
+    parser.add_argument("--target-utilization", type=float, default=0.8)
+    parser.add_argument("--target-wait", type=float, default=0.5)
+    parser.add_argument("--drain-seconds", type=float, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeline",
+                        help="CSV file to write the replicas and queue "
+                        "length over time of each policy")
+    parser.add_argument("--timeline-interval", type=float, default=5)
+    parser.add_argument("--regression", action="store_true",
+                        help="run the built-in scenarios instead and exit "
+                        "with 1 if the replicas do not settle on the load")
+    args = parser.parse_args()
+
+    if args.regression:
+        sys.exit(0 if run_regression(args) else 1)
+
+    trace = ArrivalTrace.load(args.trace)
+    if args.duration <= 0:
+        args.duration = trace.end + 600
+    service = ServiceTime(mean_ms=args.service_ms, cv=args.service_cv)
+    if args.service_times:
+        service = ServiceTime.load(args.service_times)
+    policies = [HPAPolicy.load(spec) for spec in args.policy or [
+        os.path.join(os.path.dirname(__file__), "..", "kubernetes", "scale",
+                     "hpa-infer-people-on-custom-metric-scale-ratio.yaml")]]
+
+    timeline = []
+    for policy in policies:
+        simulation = Simulation(args, policy, trace, service)
+        print(json.dumps(simulation.run()), flush=True)
+        timeline += simulation.timeline
+
+    if args.timeline:
+        with open(args.timeline, "w", newline="",
+                  encoding="utf-8") as timeline_file:
+            writer = csv.DictWriter(timeline_file, fieldnames=[
+                "policy", "seconds", "arrival_fps", "queue_length",
+                "replicas", "ready_replicas", "external"])
+            writer.writeheader()
+            writer.writerows(timeline)
+
+if __name__ == "__main__":
+    main()